@@ -3,25 +3,31 @@
 FastAPI backend for Hirsakam Icon Generator
 """
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional
 import os
-import tempfile
-import shutil
-from hirsakam_icon_generator import HirsakamGenerator
+import json
+import time
+import zipfile
+from io import BytesIO
+from hirsakam_icon_generator import HirsakamGenerator, base_image_cache, emoji_remote_miss_cache, emoji_sprite_cache, layer_image_cache, text_layout_cache, text_sprite_cache
+from font_registry import get_font_registry
 import uuid
 import uvicorn
-# rembgインポート（透過処理用）
-try:
-    from rembg import remove
-    REMBG_AVAILABLE = True
-except ImportError:
-    REMBG_AVAILABLE = False
-    print("Warning: rembg library not available. Background removal feature will be disabled.")
+# rembg（透過処理用）のセッションプール
+from background_removal import REMBG_AVAILABLE, get_rembg_pool, get_background_removal_cache, remove_background_bytes
+from render_pool import PoolSaturatedError, get_render_pool
+from gallery_index import InvalidCursorError, get_gallery_index
+from thumbnails import THUMBNAIL_WIDTHS, get_thumbnail_store
+from render_cache import get_render_cache
+from asset_server import content_etag, content_etag_async, get_asset_server
+from output_formats import DEFAULT_PRESET, UnsupportedFormatError, get_output_format, media_type_for, negotiate
+from gacha_index import GACHA_GUARANTEED_TABLE, GACHA_RARITY_DIRS, GACHA_TABLE, get_gacha_index
+from upload_ingest import InvalidUploadError, get_upload_ingestor, parse_overlay_fields
+import threading
 # 統一された環境変数ファイルを読み込み（python-dotenv不要版）
 def load_env_file():
     """統一された環境変数ファイルを読み込み"""
@@ -89,18 +95,13 @@ app.add_middleware(CORSStaticFilesMiddleware)
 app.mount("/static", StaticFiles(directory=".."), name="static")
 
 @app.get("/default-image")
-async def get_default_image():
+async def get_default_image(request: Request):
     """デフォルトのhirsakam.jpg画像を提供"""
-    from fastapi import Response
     hirsakam_path = os.path.join("..", "hirsakam.jpg")
-    if os.path.exists(hirsakam_path):
-        # CORSヘッダーを明示的に設定
-        response = FileResponse(hirsakam_path, media_type="image/jpeg")
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-        return response
-    else:
+    try:
+        # CORSヘッダー・ETag付きで配信（変更がなければ304）
+        return get_asset_server().serve(request, hirsakam_path, "image/jpeg", kind="default")
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="デフォルト画像が見つかりません")
 
 # アップロードされたファイルの一時保存（親ディレクトリに保存）
@@ -115,12 +116,168 @@ class GenerateRequest(BaseModel):
     font_size: int = 48
     emoji_size: int = 164
 
+@app.on_event("startup")
+async def warm_up_caches():
+    """起動時にフォントインデックスなどのキャッシュを構築"""
+    try:
+        get_font_registry(HirsakamGenerator().FONT_SEARCH_DIRS).build_index()
+    except Exception as e:
+        print(f"⚠️ フォントインデックス構築エラー: {e}")
+    
+    # 背景透過モデルを事前に読み込み（初回リクエストでの読み込み待ちを防止）
+    if REMBG_AVAILABLE and os.getenv("REMBG_PRELOAD", "1") != "0":
+        try:
+            # 推論プロセスがある場合はそちらで読み込み、なければこのプロセスで読み込む
+            if not get_render_pool().warm_up():
+                get_rembg_pool().warm_up()
+        except Exception as e:
+            print(f"⚠️ rembgセッションのウォームアップエラー: {e}")
+    
+    # ギャラリーインデックスと出力ディレクトリの突き合わせを開始
+    try:
+        get_gallery_index().start_reconciler()
+    except Exception as e:
+        print(f"⚠️ ギャラリーインデックス初期化エラー: {e}")
+    
+    # ガチャ画像のインデックスを作成し、画像の追加・削除の監視を開始
+    try:
+        get_gacha_index().start_watcher()
+    except Exception as e:
+        print(f"⚠️ ガチャ画像インデックス初期化エラー: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_render_pool():
+    """ワーカープールを終了"""
+    get_render_pool().shutdown()
+    get_gallery_index().stop_reconciler()
+    get_gacha_index().stop_watcher()
+
+async def run_in_render_pool(func, *args, **kwargs):
+    """画像処理をワーカープールで実行（混雑時は503とRetry-Afterを返す）"""
+    try:
+        return await get_render_pool().run(func, *args, **kwargs)
+    except PoolSaturatedError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
 @app.get("/")
 async def root():
     return {"message": "Hirsakam Icon Generator API"}
 
+@app.get("/stats")
+async def get_stats():
+    """
+    キャッシュ統計を取得
+    """
+    return {
+        "fonts": get_font_registry().stats(),
+        "emoji_sprites": emoji_sprite_cache.stats(),
+        "emoji_remote_misses": emoji_remote_miss_cache.stats(),
+        "base_images": base_image_cache.stats(),
+        "layer_images": layer_image_cache.stats(),
+        "text_layouts": text_layout_cache.stats(),
+        "text_sprites": text_sprite_cache.stats(),
+        "rembg": get_rembg_pool().stats(),
+        "rembg_cache": get_background_removal_cache().stats(),
+        "render_pool": get_render_pool().stats(),
+        "gallery_index": get_gallery_index().stats(),
+        "gacha_index": get_gacha_index().stats(),
+        "thumbnails": get_thumbnail_store().stats(),
+        "render_cache": get_render_cache().stats(),
+        "uploads": get_upload_ingestor().stats(),
+        "assets": get_asset_server().stats()
+    }
+
+def select_output_format(output_format, preset=None, transparent=False, accept=None):
+    """
+    出力形式を決めてプリセットを検証する
+    透過出力で形式を指定していない場合は、Acceptで選んだ形式が透過を保存できなければPNGにする
+    Raises:
+        UnsupportedFormatError: 形式・プリセットが使えない、または指定された形式が透過に対応していない
+    """
+    selected = negotiate(accept, output_format)
+    if transparent and not selected.supports_alpha:
+        if output_format and output_format.lower() != "auto":
+            raise UnsupportedFormatError(f"{selected.name} は透過出力に対応していません（png / webp / webp-lossless / avif を指定してください）")
+        selected = get_output_format("png")
+    selected.save_options(preset)
+    return selected
+
+def render_with_thumbnails(generator, layers, output_path, output_format=None, preset=None):
+    """
+    レイヤーを合成して保存し、合成済みのキャンバスからサムネイルも作成する
+    同じ内容の生成結果が既にあればそのパスを返す（戻り値: (パス, キャッシュヒットか)）
+    """
+    output_format = output_format or get_output_format("jpeg")
+    render_cache = get_render_cache()
+    settings = {"quality": generator.IMAGE_QUALITY, "resample": int(generator.resample)}
+    # 従来のJPEG出力のキーは変えない（既存のキャッシュを使い続けるため）
+    if output_format.name != "jpeg" or (preset or DEFAULT_PRESET) != "balanced":
+        settings.update({"format": output_format.name, "preset": preset or DEFAULT_PRESET})
+    if generator.transparent:
+        settings["transparent"] = True
+    cache_key = render_cache.make_key(generator.base_image_path, layers, settings)
+    cached_path = render_cache.lookup(cache_key, output_format.extension)
+    if cached_path is not None:
+        print(f"生成結果キャッシュヒット: {cached_path}")
+        return cached_path, True
+    
+    canvas = generator.composite_layers(layers)
+    # 失敗したレイヤーがある結果は内容どおりではないため、キャッシュ用の名前では保存しない
+    if cache_key is not None and not generator.render_errors:
+        output_path = os.path.join(os.path.dirname(output_path), render_cache.filename_for(cache_key, output_format.extension))
+    # 同じ内容の同時リクエストと書き込みが重ならないよう一時ファイルから置き換える
+    temp_path = f"{output_path}.{threading.get_ident()}.tmp"
+    generator.save_canvas(canvas, temp_path, output_format, preset)
+    os.replace(temp_path, output_path)
+    # 配信時のETag（内容のハッシュ）を書き出しと同じワーカーで計算しておく
+    content_etag(output_path)
+    try:
+        get_thumbnail_store().generate_all(os.path.basename(output_path), canvas, transparent=generator.transparent)
+    except Exception as e:
+        # サムネイルは初回リクエスト時にも作成されるため、失敗しても生成自体は成功とする
+        print(f"サムネイル作成エラー: {e}")
+    print(f"レイヤー合成完了: {len(layers)}レイヤー -> {output_path}")
+    return output_path, False
+
+def hex_to_rgb(hex_color):
+    """カラーコード（#rrggbb）をRGBタプルに変換"""
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+def build_text_layer(text, x, y, color, font_size, rotation, stroke_width=0, stroke_color="#000000"):
+    """テキストレイヤーの定義を作成（縁取りがない場合のキーは従来と同じ）"""
+    if not 0 <= stroke_width <= HirsakamGenerator.MAX_STROKE_WIDTH:
+        raise ValueError(f"text_stroke_width は0〜{HirsakamGenerator.MAX_STROKE_WIDTH}で指定してください")
+    layer = {
+        'type': 'text',
+        'text': text,
+        'position': (x, y),
+        'color': hex_to_rgb(color),
+        'font_size': font_size,
+        'rotation': rotation
+    }
+    if stroke_width:
+        layer.update({'stroke_width': stroke_width, 'stroke_color': hex_to_rgb(stroke_color)})
+    return layer
+
+def build_emoji_layer(emoji, x, y, size, rotation, flip_horizontal):
+    """絵文字レイヤーの定義を作成"""
+    return {
+        'type': 'emoji',
+        'emoji': emoji,
+        'position': (x, y),
+        'size': size,
+        'rotation': rotation,
+        'flip_horizontal': flip_horizontal
+    }
+
 @app.post("/generate")
 async def generate_icon(
+    request: Request,
     text: Optional[str] = Form(None),
     emoji: Optional[str] = Form(None),
     text_x: int = Form(260),  # テキストのX座標
@@ -131,49 +288,71 @@ async def generate_icon(
     emoji_size: int = Form(164),
     text_color: str = Form("#ffffff"),
     text_rotation: int = Form(0),  # テキストの回転角度
+    text_stroke_width: int = Form(0),  # テキストの縁取りの幅（0で縁取りなし）
+    text_stroke_color: str = Form("#000000"),  # テキストの縁取りの色
     emoji_rotation: int = Form(0),  # 絵文字の回転角度
     emoji_flip_horizontal: bool = Form(False),  # 絵文字の左右反転
     base_image: Optional[UploadFile] = File(None),
     drawing_data: Optional[UploadFile] = File(None),
-    overlay_images: Optional[str] = Form(None),  # JSON string with overlay data
-    layer_order: Optional[str] = Form(None)  # JSON string with layer order
+    overlay_images: Optional[str] = Form(None),  # JSON string with overlay data（base64、従来形式）
+    overlay_meta: Optional[str] = Form(None),  # バイナリのオーバーレイ（overlay1〜3）の位置・サイズなどのJSON
+    overlay1: Optional[UploadFile] = File(None),
+    overlay2: Optional[UploadFile] = File(None),
+    overlay3: Optional[UploadFile] = File(None),
+    layer_order: Optional[str] = Form(None),  # JSON string with layer order
+    stream: bool = Form(False),  # Trueの場合は保存せず画像を直接レスポンスで返す
+    preview: bool = Form(False),  # Trueの場合は縮小・高速エンコードのプレビューを返す（保存しない）
+    preview_scale: Optional[float] = Form(None),  # プレビューの縮小率（0より大きく1以下）
+    preview_format: str = Form("jpeg"),  # プレビューの形式（jpeg / webp）
+    output_format: Optional[str] = Form(None),  # 出力形式（jpeg / webp / webp-lossless / png / avif / auto）。未指定時はAcceptヘッダーで決める
+    output_preset: Optional[str] = Form(None),  # エンコードのプリセット（speed / balanced / size）
+    transparent: bool = Form(False)  # Trueの場合はベース画像の透過を保ったまま出力する（形式未指定時はPNG）
 ):
     """
     アイコンを生成する
+    stream=True の場合は ../output に保存せず、画像をレスポンス本文で返す
+    preview=True の場合は縮小した低遅延のプレビュー画像をレスポンス本文で返す
     """
+    # 取り込んだアップロード（大きいものだけ一時ファイルに書き出されるため最後に削除）
+    ingested_uploads = []
     try:
+        try:
+            # Accept に image/webp などが明示されている場合のみJPEG以外を選ぶ
+            negotiated_format = select_output_format(output_format, output_preset, transparent, request.headers.get("accept"))
+        except UnsupportedFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        if not 0 <= text_stroke_width <= HirsakamGenerator.MAX_STROKE_WIDTH:
+            raise HTTPException(status_code=400, detail=f"text_stroke_width は0〜{HirsakamGenerator.MAX_STROKE_WIDTH}で指定してください")
+        
+        if preview:
+            if preview_scale is not None and not 0 < preview_scale <= 1:
+                raise HTTPException(status_code=400, detail="preview_scale は0より大きく1以下で指定してください")
+            if preview_format.lower() not in ("jpeg", "webp"):
+                raise HTTPException(status_code=400, detail="preview_format は jpeg または webp を指定してください")
+            if transparent:
+                # JPEGでは透過が確認できないため、透過出力のプレビューはWebPにする
+                preview_format = "webp"
+        
         print(f"Debug: text={text}, emoji={emoji}, text_pos=({text_x},{text_y}), emoji_pos=({emoji_x},{emoji_y}), font_size={font_size}, emoji_size={emoji_size}, text_color={text_color}")
         
         # ベース画像のパス（親ディレクトリから参照）
         base_image_path = os.path.join("..", "hirsakam.jpg")
         
-        # カスタム画像がアップロードされた場合
+        # カスタム画像がアップロードされた場合はメモリ上のバイト列として取り込む
         if base_image:
-            # 一意のファイル名を生成
-            file_id = str(uuid.uuid4())
-            file_extension = os.path.splitext(base_image.filename)[1]
-            temp_path = os.path.join(UPLOAD_DIR, f"{file_id}{file_extension}")
-            
-            # ファイルを保存
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(base_image.file, buffer)
-            
-            base_image_path = temp_path
+            base_upload = get_upload_ingestor().ingest_file(base_image, "base")
+            ingested_uploads.append(base_upload)
+            base_image_path = base_upload.source
         
-        # ジェネレーターを初期化
-        generator = HirsakamGenerator(base_image_path)
+        # ジェネレーターを初期化（アップロード画像は一度しか使わないためデコード結果をキャッシュしない）
+        generator = HirsakamGenerator(base_image_path, cache_base_image=not base_image, transparent=transparent)
         
         # 出力ファイル名を生成（親ディレクトリのoutputフォルダ）
         output_id = str(uuid.uuid4())
-        output_path = os.path.join("..", "output", f"image_{output_id}.jpg")
-        
-        # ベース画像をコピーして開始
-        result_path = output_path
-        generator.copy_base_image(result_path)
+        output_path = os.path.join("..", "output", f"image_{output_id}.{negotiated_format.extension}")
         
         # レイヤー順序を解析（デフォルト: ['text', 'emoji', 'overlay1', 'overlay2', 'overlay3']）
-        import json
-        import base64
         try:
             if layer_order:
                 layer_order_list = json.loads(layer_order)
@@ -184,216 +363,351 @@ async def generate_icon(
         
         print(f"Layer order: {layer_order_list}")
         
-        # レイヤー順序に基づいて処理
-        def process_layer(layer_type, current_path):
+        # オーバーレイデータはリクエストごとに一度だけ解析（スロット番号で引けるようにする）
+        # バイナリのマルチパート（overlay_meta + overlay1〜3）と従来のbase64形式の両方を受け付ける
+        # 不正なJSONは InvalidUploadError（400、どちらのフィールドが不正かをメッセージに含む）
+        overlays_by_slot = parse_overlay_fields(
+            overlay_images,
+            overlay_meta,
+            {1: overlay1, 2: overlay2, 3: overlay3}
+        )
+        
+        # レイヤー順序に基づいてレイヤー定義を構築
+        def build_layer(layer_type):
             if layer_type == 'text' and text:
-                # カラーコードをRGBタプルに変換
-                def hex_to_rgb(hex_color):
-                    hex_color = hex_color.lstrip('#')
-                    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-                
-                color_rgb = hex_to_rgb(text_color)
-                return generator.add_text_to_image(
-                    current_path,
-                    text, 
-                    (text_x, text_y), 
-                    color=color_rgb,
-                    font_size=font_size,
-                    rotation=text_rotation,
-                    output_path=current_path
-                )
+                return build_text_layer(text, text_x, text_y, text_color, font_size, text_rotation, text_stroke_width, text_stroke_color)
             elif layer_type == 'emoji' and emoji:
-                return generator.add_emoji_to_image(
-                    current_path,
-                    emoji, 
-                    (emoji_x, emoji_y), 
-                    emoji_size,
-                    rotation=emoji_rotation,
-                    flip_horizontal=emoji_flip_horizontal,
-                    output_path=current_path
-                )
-            elif layer_type.startswith('overlay') and overlay_images:
+                return build_emoji_layer(emoji, emoji_x, emoji_y, emoji_size, emoji_rotation, emoji_flip_horizontal)
+            elif layer_type.startswith('overlay') and overlays_by_slot:
                 # 特定のオーバーレイレイヤーを処理
                 print(f"Processing {layer_type} layer...")
-                current_result_path = current_path
                 try:
-                    overlay_data = json.loads(overlay_images)
                     # overlay1 -> slotNumber 1, overlay2 -> slotNumber 2, overlay3 -> slotNumber 3
                     target_slot_number = int(layer_type.replace('overlay', ''))
-                    
-                    # 対応するスロット番号のオーバーレイを検索
-                    target_overlay = None
-                    for overlay in overlay_data:
-                        if overlay.get('slotNumber') == target_slot_number:
-                            target_overlay = overlay
-                            break
+                    target_overlay = overlays_by_slot.get(target_slot_number)
                     
                     if target_overlay:
-                        # オーバーレイ画像をbase64からデコードして保存
-                        overlay_id = str(uuid.uuid4())
-                        overlay_temp_path = os.path.join(UPLOAD_DIR, f"overlay_{overlay_id}.png")
-                        
-                        # base64データから画像ファイルを作成
-                        image_data = base64.b64decode(target_overlay['data'].split(',')[1])
-                        with open(overlay_temp_path, "wb") as f:
-                            f.write(image_data)
+                        # オーバーレイ画像をメモリ上に取り込む（base64の場合はデコード）
+                        overlay_upload = get_upload_ingestor().ingest_overlay(target_overlay)
+                        ingested_uploads.append(overlay_upload)
                         
-                        # オーバーレイ画像を合成
-                        current_result_path = generator.add_overlay_image(
-                            current_result_path, 
-                            overlay_temp_path, 
-                            target_overlay['x'], 
-                            target_overlay['y'], 
-                            target_overlay['width'], 
-                            target_overlay['height'], 
-                            target_overlay['opacity'],
-                            target_overlay.get('rotation', 0),
-                            target_overlay.get('removeBackground', False),
-                            target_overlay.get('flipHorizontal', False),
-                            current_result_path
-                        )
-                        
-                        # 一時ファイルを削除
-                        if os.path.exists(overlay_temp_path):
-                            os.remove(overlay_temp_path)
+                        return {
+                            'type': 'overlay',
+                            'image': overlay_upload.source,
+                            'x': target_overlay['x'],
+                            'y': target_overlay['y'],
+                            'width': target_overlay['width'],
+                            'height': target_overlay['height'],
+                            'opacity': target_overlay['opacity'],
+                            'rotation': target_overlay.get('rotation', 0),
+                            'remove_background': target_overlay.get('removeBackground', False),
+                            'flip_horizontal': target_overlay.get('flipHorizontal', False)
+                        }
                     else:
                         print(f"No overlay found for {layer_type} (slot {target_slot_number})")
-                            
+                        
+                except InvalidUploadError:
+                    # 不正なアップロードは黙って捨てず、400で返す
+                    raise
                 except Exception as e:
                     print(f"Error processing {layer_type}: {e}")
-                return current_result_path
-            return current_path
+            return None
         
-        # レイヤー順序に従って処理
+        layers = []
         for layer_type in layer_order_list:
-            result_path = process_layer(layer_type, result_path)
+            layer = build_layer(layer_type)
+            if layer:
+                layers.append(layer)
         
         # コンテンツが何もない場合でもベース画像をそのまま生成できるようにする（エラーチェック削除）
 
         # 描画データがある場合は最後に合成（最上位レイヤー）
         if drawing_data:
             print("Drawing data received, processing...")
-            # 描画データを一時ファイルとして保存
-            drawing_id = str(uuid.uuid4())
-            drawing_temp_path = os.path.join(UPLOAD_DIR, f"drawing_{drawing_id}.png")
-            
-            with open(drawing_temp_path, "wb") as buffer:
-                shutil.copyfileobj(drawing_data.file, buffer)
+            # 描画データをメモリ上に取り込む
+            drawing_upload = get_upload_ingestor().ingest_file(drawing_data, "drawing")
+            ingested_uploads.append(drawing_upload)
             
-            # 描画データを合成
-            result_path = generator.add_drawing_overlay(result_path, drawing_temp_path, output_path)
-            
-            # 描画一時ファイルを削除
-            if os.path.exists(drawing_temp_path):
-                os.remove(drawing_temp_path)
+            layers.append({'type': 'drawing', 'image': drawing_upload.source})
+        
+        # メモリ上のキャンバスに全レイヤーを合成し、最後に一度だけエンコード
+        if preview:
+            image_data = await run_in_render_pool(generator.render_preview, layers, preview_scale, preview_format)
+        elif stream:
+            image_data = await run_in_render_pool(generator.render_layers_to_bytes, layers, negotiated_format, output_preset)
+        else:
+            result_path, cache_hit = await run_in_render_pool(
+                render_with_thumbnails, generator, layers, output_path, negotiated_format, output_preset
+            )
+        
+        if preview or stream:
+            # 保存もギャラリー登録もせず、エンコード済みの画像をそのまま返す
+            response_format = get_output_format(preview_format) if preview else negotiated_format
+            headers = {
+                "Cache-Control": "no-store",
+                "Content-Disposition": f'inline; filename="preview.{response_format.extension}"',
+                "Vary": "Accept"
+            }
+            if generator.render_errors:
+                # 描画できなかったレイヤーの数（内容はJSONのレスポンスでのみ返す）
+                headers["X-Render-Errors"] = str(len(generator.render_errors))
+            return Response(content=image_data, media_type=response_format.media_type, headers=headers)
         
-        # 一時ファイルを削除（アップロードされたファイルのみ）
-        hirsakam_default = os.path.join("..", "hirsakam.jpg")
-        if base_image and base_image_path != hirsakam_default and os.path.exists(base_image_path):
-            os.remove(base_image_path)
+        # ギャラリーインデックスに登録（キャッシュヒット時は登録済み）
+        if not cache_hit:
+            get_gallery_index().add(os.path.basename(result_path))
         
+        # 描画できなかったレイヤーがある場合は画像を返しつつ success を false にする
         return {
-            "success": True,
+            "success": not generator.render_errors,
             "output_path": result_path,
-            "download_url": f"/download/{os.path.basename(result_path)}"
+            "download_url": f"/download/{os.path.basename(result_path)}",
+            "cached": cache_hit,
+            "format": negotiated_format.name,
+            "errors": list(generator.render_errors)
         }
         
+    except InvalidUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        # エラー時に一時ファイルを削除（アップロードされたファイルのみ）
-        hirsakam_default = os.path.join("..", "hirsakam.jpg")
-        if (base_image and 'base_image_path' in locals() and 
-            base_image_path != hirsakam_default and os.path.exists(base_image_path)):
-            os.remove(base_image_path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # 一時ファイルに書き出したアップロードを削除
+        for upload in ingested_uploads:
+            upload.cleanup()
+
+# 1回のバッチで生成できる画像数の上限
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+
+def build_batch_item_layers(item):
+    """バッチの1項目（/generate と同じ名前のテキスト・絵文字パラメーター）からレイヤー定義を作成"""
+    layers = []
+    for layer_type in item.get('layer_order') or ['text', 'emoji']:
+        if layer_type == 'text' and item.get('text'):
+            layers.append(build_text_layer(
+                item['text'],
+                int(item.get('text_x', 260)),
+                int(item.get('text_y', 143)),
+                item.get('text_color', "#ffffff"),
+                int(item.get('font_size', 48)),
+                int(item.get('text_rotation', 0)),
+                int(item.get('text_stroke_width', 0)),
+                item.get('text_stroke_color', "#000000")
+            ))
+        elif layer_type == 'emoji' and item.get('emoji'):
+            layers.append(build_emoji_layer(
+                item['emoji'],
+                int(item.get('emoji_x', 260)),
+                int(item.get('emoji_y', 143)),
+                int(item.get('emoji_size', 164)),
+                int(item.get('emoji_rotation', 0)),
+                bool(item.get('emoji_flip_horizontal', False))
+            ))
+    return layers
+
+@app.post("/generate-batch")
+async def generate_batch(
+    items: str = Form(...),  # JSON配列（各要素は text / emoji / text_x などの /generate と同じパラメーター）
+    base_image: Optional[UploadFile] = File(None),
+    response_format: str = Form("urls"),  # urls: 保存してURLの一覧を返す / zip: 保存せずZIPで返す
+    output_format: Optional[str] = Form(None),  # 各画像の出力形式（/generate と同じ、デフォルト: jpeg）
+    output_preset: Optional[str] = Form(None),  # エンコードのプリセット（speed / balanced / size）
+    transparent: bool = Form(False)  # Trueの場合はベース画像の透過を保ったまま出力する（形式未指定時はPNG）
+):
+    """
+    同じベース画像で複数のバリエーションをまとめて生成する
+    ベース画像のデコード・フォント・絵文字スプライトをバッチ内で共有し、ワーカースレッドで並列に合成する
+    """
+    response_format = response_format.lower()
+    if response_format not in ("urls", "zip"):
+        raise HTTPException(status_code=400, detail="response_format は urls または zip を指定してください")
+    try:
+        # レスポンス自体はJSONまたはZIPのため、Acceptヘッダーではなく output_format だけで決める
+        batch_format = select_output_format(output_format, output_preset, transparent)
+    except UnsupportedFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        batch_items = json.loads(items)
+        if not isinstance(batch_items, list) or not all(isinstance(item, dict) for item in batch_items):
+            raise ValueError("items はオブジェクトの配列で指定してください")
+        layer_sets = [build_batch_item_layers(item) for item in batch_items]
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"items を解釈できません: {e}")
+    if not layer_sets:
+        raise HTTPException(status_code=400, detail="items が空です")
+    if len(layer_sets) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一度に生成できるのは{BATCH_MAX_ITEMS}件までです")
+    
+    base_upload = None
+    try:
+        base_image_path = os.path.join("..", "hirsakam.jpg")
+        if base_image:
+            base_upload = get_upload_ingestor().ingest_file(base_image, "base")
+            base_image_path = base_upload.source
+        # アップロード画像はバッチ内でのみ共有する（プロセス共通のキャッシュには入れない）
+        generator = HirsakamGenerator(base_image_path, cache_base_image=not base_image, transparent=transparent)
+        
+        if response_format == "zip":
+            def render(worker, layers):
+                return worker.render_layers_to_bytes(layers, batch_format, output_preset)
+        else:
+            def render(worker, layers):
+                output_path = os.path.join("..", "output", f"image_{uuid.uuid4()}.{batch_format.extension}")
+                return render_with_thumbnails(worker, layers, output_path, batch_format, output_preset)
+        
+        start = time.perf_counter()
+        # バッチ全体を1つの実行枠で順番に合成する（プール内で別のスレッドを増やすと
+        # RENDER_THREAD_WORKERS を超えて合成が並び、混雑時の503が効かなくなる）
+        results = await run_in_render_pool(generator.render_batch, layer_sets, render)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"バッチ生成完了: {len(layer_sets)}件 {elapsed_ms:.1f}ms")
+        
+        if response_format == "zip":
+            if all(error is not None for _, error in results):
+                raise HTTPException(status_code=500, detail=results[0][1])
+            buffer = BytesIO()
+            # JPEGはこれ以上圧縮できないため無圧縮で格納する
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+                errors = []
+                for index, (image_data, error) in enumerate(results):
+                    if error is None:
+                        archive.writestr(f"image_{index:03d}.{batch_format.extension}", image_data)
+                    else:
+                        errors.append(f"{index}: {error}")
+                if errors:
+                    archive.writestr("errors.txt", "\n".join(errors))
+            return Response(
+                content=buffer.getvalue(),
+                media_type="application/zip",
+                headers={"Content-Disposition": 'attachment; filename="hirsakam_batch.zip"'}
+            )
         
+        images = []
+        for index, (result, error) in enumerate(results):
+            if error is not None:
+                images.append({"index": index, "success": False, "error": error})
+                continue
+            result_path, cache_hit = result
+            if not cache_hit:
+                get_gallery_index().add(os.path.basename(result_path))
+            images.append({
+                "index": index,
+                "success": True,
+                "download_url": f"/download/{os.path.basename(result_path)}",
+                "cached": cache_hit
+            })
+        return {
+            "success": any(image["success"] for image in images),
+            "images": images,
+            "elapsed_ms": round(elapsed_ms, 1)
+        }
+    
+    except InvalidUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if base_upload is not None:
+            base_upload.cleanup()
 
 @app.get("/download/{filename}")
-async def download_file(filename: str):
+async def download_file(filename: str, request: Request):
     """
     生成されたファイルをダウンロード
     """
+    if os.path.basename(filename) != filename or filename.startswith('.'):
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません")
     file_path = os.path.join("..", "output", filename)
-    if not os.path.exists(file_path):
+    
+    try:
+        # 生成結果キャッシュのファイル名は内容で決まるため immutable として配信
+        return get_asset_server().serve(
+            request,
+            file_path,
+            media_type_for(filename),
+            kind="download",
+            # ハッシュの計算でイベントループを止めない（生成時に計算済みなら即座に返る）
+            etag=await content_etag_async(file_path),
+            immutable=get_render_cache().is_cache_filename(filename),
+            filename=filename
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません")
+
+@app.get("/thumb/{size}/{filename}")
+async def get_thumbnail(size: int, filename: str, request: Request):
+    """
+    生成画像のサムネイルを取得（未作成の場合はこのリクエストで作成）
+    """
+    if size not in THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=404, detail=f"サムネイルの幅は {', '.join(map(str, THUMBNAIL_WIDTHS))} のいずれかです")
+    if os.path.basename(filename) != filename or filename.startswith('.'):
         raise HTTPException(status_code=404, detail="ファイルが見つかりません")
     
-    # CORSヘッダーを明示的に設定
-    response = FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type='image/jpeg'
+    try:
+        thumb_path = await run_in_render_pool(get_thumbnail_store().ensure, size, filename)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません")
+    
+    # サムネイルは元画像が変わらない限り同じ内容なので、ETagで再送を省く
+    return get_asset_server().serve(
+        request,
+        thumb_path,
+        "image/jpeg",
+        kind="thumb",
+        etag=get_thumbnail_store().etag_for(thumb_path),
+        max_age=86400
     )
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET"
-    response.headers["Access-Control-Allow-Headers"] = "*"
-    return response
 
 @app.get("/gallery")
-async def get_gallery(sort: str = "desc", offset: int = 0, limit: int = 20):
+async def get_gallery(sort: str = "desc", offset: int = 0, limit: int = 20, cursor: Optional[str] = None):
     """
     生成済みの画像一覧を取得
     Args:
         sort: ソート順 ("asc" = 古い順, "desc" = 新しい順, デフォルト: desc)
-        offset: 開始位置 (デフォルト: 0)
+        offset: 開始位置 (デフォルト: 0、cursor指定時は無視)
         limit: 取得件数 (デフォルト: 20, 最大: 100)
+        cursor: 前のレスポンスの next_cursor（指定すると途中で画像が追加されてもずれずに続きを取得）
     """
     try:
         # limitの上限を設定
         limit = min(limit, 100)
         
-        output_dir = os.path.join("..", "output")
-        if not os.path.exists(output_dir):
-            return {
-                "images": [],
-                "total": 0,
-                "offset": offset,
-                "limit": limit,
-                "has_next": False,
-                "has_prev": False
+        gallery_index = get_gallery_index()
+        filenames, next_cursor = gallery_index.page(sort, limit, offset, cursor)
+        total = gallery_index.count()
+        
+        images = [
+            {
+                "filename": filename,
+                "url": f"/download/{filename}",
+                # ギャラリー表示用の縮小画像（幅ごと）
+                "thumb_url": f"/thumb/{THUMBNAIL_WIDTHS[1]}/{filename}",
+                "thumbnails": {str(width): f"/thumb/{width}/{filename}" for width in THUMBNAIL_WIDTHS}
             }
-        
-        images = []
-        for filename in os.listdir(output_dir):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_path = os.path.join(output_dir, filename)
-                # ファイルの作成時刻を取得
-                creation_time = os.path.getctime(file_path)
-                images.append({
-                    "filename": filename,
-                    "url": f"/download/{filename}",
-                    "created_at": creation_time
-                })
-        
-        # ソート順に応じて並び替え
-        if sort.lower() == "asc":
-            # 古い順（昇順）
-            images.sort(key=lambda x: x["created_at"])
-        else:
-            # 新しい順（降順）- デフォルト
-            images.sort(key=lambda x: x["created_at"], reverse=True)
-        
-        # 総件数を取得
-        total = len(images)
-        
-        # ページング処理
-        paginated_images = images[offset:offset + limit]
-        
-        # created_atフィールドを除去（フロントエンドには不要）
-        for image in paginated_images:
-            del image["created_at"]
+            for filename in filenames
+        ]
         
         # ページング情報を計算
-        has_next = offset + limit < total
-        has_prev = offset > 0
+        has_next = next_cursor is not None
+        has_prev = bool(cursor) or offset > 0
         
         return {
-            "images": paginated_images,
+            "images": images,
             "total": total,
             "offset": offset,
             "limit": limit,
             "has_next": has_next,
-            "has_prev": has_prev
+            "has_prev": has_prev,
+            "next_cursor": next_cursor
         }
         
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -411,60 +725,35 @@ async def crop_image(
     try:
         print(f"Crop request: x={crop_x}, y={crop_y}, width={crop_width}, height={crop_height}")
         
-        # ベース画像のパス
-        base_image_path = os.path.join("..", "hirsakam.jpg")
-        
-        # カスタム画像がアップロードされた場合
+        # カスタム画像がアップロードされた場合はメモリ上で処理し、なければデフォルト画像を使う
         if base_image:
-            # 一意のファイル名を生成
-            file_id = str(uuid.uuid4())
-            file_extension = os.path.splitext(base_image.filename)[1]
-            temp_path = os.path.join(UPLOAD_DIR, f"{file_id}{file_extension}")
-            
-            # ファイルを保存
-            with open(temp_path, "wb") as buffer:
-                shutil.copyfileobj(base_image.file, buffer)
-            
-            base_image_path = temp_path
+            base_upload = get_upload_ingestor().ingest_file(base_image, "crop")
+            try:
+                image_data = base_upload.read()
+            finally:
+                base_upload.cleanup()
+        else:
+            with open(os.path.join("..", "hirsakam.jpg"), 'rb') as f:
+                image_data = f.read()
         
         # ジェネレーターを初期化
-        generator = HirsakamGenerator(base_image_path)
+        generator = HirsakamGenerator()
         
-        # 出力ファイル名を生成
+        # トリミング実行（結果はファイルに保存せずJPEGのバイト列で受け取る）
         output_id = str(uuid.uuid4())
-        output_path = os.path.join(UPLOAD_DIR, f"cropped_{output_id}.jpg")
-        
-        # トリミング実行
-        result_path = generator.crop_image(
-            base_image_path, 
-            crop_x, crop_y, crop_width, crop_height, 
-            output_path
+        cropped_data = await run_in_render_pool(
+            generator.crop_image_bytes,
+            image_data,
+            crop_x, crop_y, crop_width, crop_height
         )
         
-        print(f"Crop completed: {result_path}")
-        
-        # 一時ファイルを削除（アップロードされたファイルのみ）
-        hirsakam_default = os.path.join("..", "hirsakam.jpg")
-        if base_image and base_image_path != hirsakam_default and os.path.exists(base_image_path):
-            os.remove(base_image_path)
+        print(f"Crop completed: {len(cropped_data)} bytes")
         
         # トリミングされた画像を返す
-        from starlette.background import BackgroundTask
-        
-        def cleanup_file():
-            # レスポンス送信後にファイルを削除
-            if os.path.exists(result_path):
-                try:
-                    os.remove(result_path)
-                    print(f"Cleaned up temporary crop file: {result_path}")
-                except Exception as e:
-                    print(f"Failed to cleanup crop file: {e}")
-        
-        response = FileResponse(
-            path=result_path,
-            filename=f"cropped_{output_id}.jpg",
+        response = Response(
+            content=cropped_data,
             media_type='image/jpeg',
-            background=BackgroundTask(cleanup_file)
+            headers={"Content-Disposition": f'attachment; filename="cropped_{output_id}.jpg"'}
         )
         response.headers["Access-Control-Allow-Origin"] = "*"
         response.headers["Access-Control-Allow-Methods"] = "POST"
@@ -474,82 +763,17 @@ async def crop_image(
         
     except Exception as e:
         print(f"Crop error: {e}")
-        # エラー時に一時ファイルを削除
-        hirsakam_default = os.path.join("..", "hirsakam.jpg")
-        if (base_image and 'base_image_path' in locals() and 
-            base_image_path != hirsakam_default and os.path.exists(base_image_path)):
-            os.remove(base_image_path)
-        
-        # トリミング結果ファイルも削除（存在する場合）
-        if 'result_path' in locals() and os.path.exists(result_path):
-            try:
-                os.remove(result_path)
-                print(f"Cleaned up failed crop file: {result_path}")
-            except Exception as cleanup_error:
-                print(f"Failed to cleanup failed crop file: {cleanup_error}")
-        
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/gacha")
 async def gacha():
     """
-    ガチャを引く
+    ガチャを引く（事前に作成したインデックスから抽選し、ファイルシステムにはアクセスしない）
     """
     try:
-        import random
-        import glob
-        
-        # ガチャ確率設定
-        probabilities = {
-            'N': 0.50,    # 50%
-            'R': 0.30,    # 30%
-            'SR': 0.17,   # 17%
-            'SSR': 0.03   # 3%
-        }
-        
-        # レアリティを抽選
-        rand = random.random()
-        cumulative = 0
-        selected_rarity = None
-        
-        for rarity, prob in probabilities.items():
-            cumulative += prob
-            if rand <= cumulative:
-                selected_rarity = rarity
-                break
-        
-        # 画像ディレクトリのマッピング
-        rarity_dirs = {
-            'N': 'normal',
-            'R': 'rare', 
-            'SR': 'super_rare',
-            'SSR': 'special_super_rare'
-        }
-        
-        # 対応するディレクトリから画像を選択
-        gacha_dir = os.path.join("..", "hirsakam_gacha_image", rarity_dirs[selected_rarity])
-        
-        if not os.path.exists(gacha_dir):
-            raise HTTPException(status_code=500, detail=f"ガチャ画像ディレクトリが見つかりません: {gacha_dir}")
-        
-        # ディレクトリ内の画像ファイルを取得
-        image_files = []
-        for ext in ['*.jpg', '*.jpeg', '*.png', '*.gif']:
-            image_files.extend(glob.glob(os.path.join(gacha_dir, ext)))
-        
-        if not image_files:
-            raise HTTPException(status_code=500, detail=f"ガチャ画像が見つかりません: {gacha_dir}")
-        
-        # ランダムに画像を選択
-        selected_image = random.choice(image_files)
-        image_filename = os.path.basename(selected_image)
-        
-        return {
-            "rarity": selected_rarity,
-            "image_url": f"/gacha-image/{rarity_dirs[selected_rarity]}/{image_filename}",
-            "filename": image_filename
-        }
-        
+        return get_gacha_index().draw(GACHA_TABLE)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -559,78 +783,11 @@ async def gacha_ten():
     10連ガチャを引く
     """
     try:
-        import random
-        import glob
-        
-        # ガチャ確率設定（通常の9枚）
-        probabilities = {
-            'N': 0.50,    # 50%
-            'R': 0.30,    # 30%
-            'SR': 0.17,   # 17%
-            'SSR': 0.03   # 3%
-        }
-        
-        # 最後の1枚用の確率設定（SR以上確定）
-        guaranteed_probabilities = {
-            'SR': 0.90,   # 90%
-            'SSR': 0.10   # 10%
-        }
-        
-        # 画像ディレクトリのマッピング
-        rarity_dirs = {
-            'N': 'normal',
-            'R': 'rare', 
-            'SR': 'super_rare',
-            'SSR': 'special_super_rare'
-        }
-        
-        def get_random_image(selected_rarity):
-            """指定されたレアリティの画像をランダムに選択"""
-            gacha_dir = os.path.join("..", "hirsakam_gacha_image", rarity_dirs[selected_rarity])
-            
-            if not os.path.exists(gacha_dir):
-                raise HTTPException(status_code=500, detail=f"ガチャ画像ディレクトリが見つかりません: {gacha_dir}")
-            
-            # ディレクトリ内の画像ファイルを取得
-            image_files = []
-            for ext in ['*.jpg', '*.jpeg', '*.png', '*.gif']:
-                image_files.extend(glob.glob(os.path.join(gacha_dir, ext)))
-            
-            if not image_files:
-                raise HTTPException(status_code=500, detail=f"ガチャ画像が見つかりません: {gacha_dir}")
-            
-            # ランダムに画像を選択
-            selected_image = random.choice(image_files)
-            image_filename = os.path.basename(selected_image)
-            
-            return {
-                "rarity": selected_rarity,
-                "image_url": f"/gacha-image/{rarity_dirs[selected_rarity]}/{image_filename}",
-                "filename": image_filename
-            }
-        
-        def draw_gacha(probs):
-            """確率に基づいてレアリティを抽選"""
-            rand = random.random()
-            cumulative = 0
-            for rarity, prob in probs.items():
-                cumulative += prob
-                if rand <= cumulative:
-                    return rarity
-            return list(probs.keys())[-1]  # フォールバック
-        
-        results = []
-        
+        gacha_index = get_gacha_index()
         # 最初の9枚を通常確率で抽選
-        for i in range(9):
-            selected_rarity = draw_gacha(probabilities)
-            result = get_random_image(selected_rarity)
-            results.append(result)
-        
+        results = [gacha_index.draw(GACHA_TABLE) for _ in range(9)]
         # 最後の1枚をSR以上確定で抽選
-        guaranteed_rarity = draw_gacha(guaranteed_probabilities)
-        guaranteed_result = get_random_image(guaranteed_rarity)
-        results.append(guaranteed_result)
+        results.append(gacha_index.draw(GACHA_GUARANTEED_TABLE))
         
         return {
             "results": results,
@@ -641,7 +798,7 @@ async def gacha_ten():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/gacha-image/{rarity}/{filename}")
-async def get_gacha_image(rarity: str, filename: str):
+async def get_gacha_image(rarity: str, filename: str, request: Request):
     """
     ガチャ画像を提供
     """
@@ -650,43 +807,27 @@ async def get_gacha_image(rarity: str, filename: str):
         if '..' in rarity or '..' in filename or '/' in rarity or '\\' in rarity:
             raise HTTPException(status_code=400, detail="Invalid path")
         
-        rarity_dirs = {
-            'normal': 'normal',
-            'rare': 'rare', 
-            'super_rare': 'super_rare',
-            'special_super_rare': 'special_super_rare'
-        }
-        
-        if rarity not in rarity_dirs:
+        if rarity not in GACHA_RARITY_DIRS.values():
             raise HTTPException(status_code=400, detail="Invalid rarity")
         
-        image_path = os.path.join("..", "hirsakam_gacha_image", rarity_dirs[rarity], filename)
-        
-        if not os.path.exists(image_path):
+        # インデックスからパス・メディアタイプ・ETagを取得
+        asset = get_gacha_index().lookup(rarity, filename)
+        if asset is None:
             raise HTTPException(status_code=404, detail="ガチャ画像が見つかりません")
         
-        # ファイル拡張子から適切なメディアタイプを決定
-        ext = os.path.splitext(filename)[1].lower()
-        media_type_map = {
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg', 
-            '.png': 'image/png',
-            '.gif': 'image/gif'
-        }
-        media_type = media_type_map.get(ext, 'application/octet-stream')
-        
-        response = FileResponse(
-            path=image_path,
-            filename=filename,
-            media_type=media_type
+        # ガチャ結果のURLには ?v= が付くため immutable として配信される
+        return get_asset_server().serve(
+            request,
+            asset.path,
+            asset.media_type,
+            kind="gacha",
+            etag=asset.etag,
+            filename=filename
         )
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET"
-        response.headers["Access-Control-Allow-Headers"] = "*"
-        
-        return response
         
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/other-images")
@@ -723,7 +864,7 @@ async def get_other_images():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/other-image/{filename}")
-async def get_other_image(filename: str):
+async def get_other_image(filename: str, request: Request):
     """
     other_imageディレクトリの画像を提供
     """
@@ -737,9 +878,11 @@ async def get_other_image(filename: str):
         if not os.path.exists(image_path):
             raise HTTPException(status_code=404, detail="Image not found")
         
-        return FileResponse(image_path)
+        return get_asset_server().serve(request, image_path, kind="other", etag=await content_etag_async(image_path))
         
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/share-to-slack")
@@ -761,22 +904,23 @@ async def share_to_slack(
         if not slack_webhook_url:
             raise HTTPException(status_code=400, detail="Slack Webhook URLが設定されていません。env/.envファイルでSLACK_WEBHOOK_URLを設定してください。")
         
-        # スクリーンショットを一時保存
+        # スクリーンショットをメモリ上に取り込む
         screenshot_id = str(uuid.uuid4())
-        screenshot_path = os.path.join(UPLOAD_DIR, f"slack_screenshot_{screenshot_id}.png")
-        
-        with open(screenshot_path, "wb") as buffer:
-            shutil.copyfileobj(screenshot.file, buffer)
+        screenshot_upload = get_upload_ingestor().ingest_file(screenshot, "slack_screenshot")
+        try:
+            screenshot_data = screenshot_upload.read()
+        finally:
+            screenshot_upload.cleanup()
         
-        print(f"スクリーンショットを一時保存: {screenshot_path}")
+        print(f"スクリーンショットを受信: {len(screenshot_data)} bytes")
         
         # Slackにスクリーンショット付きメッセージを送信
-        # files.upload APIを使用してファイル送信
+        # files.upload APIを使用してファイル送信（ファイル内容は標準入力で渡す）
         files_upload_url = slack_webhook_url.replace('/chat.postMessage', '/files.upload')
         
         curl_command = [
             'curl',
-            '-F', f'file=@{screenshot_path}',
+            '-F', f'file=@-;filename=slack_screenshot_{screenshot_id}.png',
             '-F', f'initial_comment={message}',
             '-F', f'channels={channel}',
             files_upload_url
@@ -787,40 +931,31 @@ async def share_to_slack(
         # curlコマンドを実行
         result = subprocess.run(
             curl_command,
+            input=screenshot_data,
             capture_output=True,
-            text=True,
             timeout=30
         )
-        
-        # 一時ファイルを削除
-        if os.path.exists(screenshot_path):
-            os.remove(screenshot_path)
-            print(f"一時ファイルを削除: {screenshot_path}")
+        stdout = result.stdout.decode('utf-8', errors='replace')
+        stderr = result.stderr.decode('utf-8', errors='replace')
         
         if result.returncode == 0:
-            print(f"Slack送信成功: {result.stdout}")
+            print(f"Slack送信成功: {stdout}")
             return {
                 "success": True,
                 "message": "Slackに正常に送信されました",
                 "channel": channel,
-                "response": result.stdout
+                "response": stdout
             }
         else:
-            print(f"Slack送信失敗: {result.stderr}")
+            print(f"Slack送信失敗: {stderr}")
             raise HTTPException(
                 status_code=500, 
-                detail=f"Slack送信に失敗しました: {result.stderr}"
+                detail=f"Slack送信に失敗しました: {stderr}"
             )
             
     except subprocess.TimeoutExpired:
-        # タイムアウト時も一時ファイルを削除
-        if 'screenshot_path' in locals() and os.path.exists(screenshot_path):
-            os.remove(screenshot_path)
         raise HTTPException(status_code=500, detail="Slack送信がタイムアウトしました")
     except Exception as e:
-        # エラー時も一時ファイルを削除
-        if 'screenshot_path' in locals() and os.path.exists(screenshot_path):
-            os.remove(screenshot_path)
         print(f"Slack送信エラー: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -907,49 +1042,26 @@ async def remove_background_preview(
         if not REMBG_AVAILABLE:
             raise HTTPException(status_code=500, detail="背景透過機能が利用できません。rembgライブラリがインストールされていません。")
         
-        # アップロードされた画像を一時保存
+        # アップロードされた画像をメモリ上に取り込む
         temp_id = str(uuid.uuid4())
-        temp_input_path = os.path.join(UPLOAD_DIR, f"temp_input_{temp_id}.png")
-        temp_output_path = os.path.join(UPLOAD_DIR, f"temp_output_{temp_id}.png")
-        
-        # ファイルを保存
-        with open(temp_input_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        
-        print(f"背景透過処理開始: {temp_input_path}")
-        
-        # rembgで背景透過処理
-        from rembg import remove
-        with open(temp_input_path, 'rb') as input_file:
-            input_data = input_file.read()
-        
-        # 背景除去実行
-        output_data = remove(input_data)
+        upload = get_upload_ingestor().ingest_file(image, "remove_background")
+        try:
+            input_data = upload.read()
+        finally:
+            upload.cleanup()
         
-        # 処理済み画像を保存
-        with open(temp_output_path, 'wb') as output_file:
-            output_file.write(output_data)
+        print(f"背景透過処理開始: {len(input_data)} bytes")
         
-        print(f"背景透過処理完了: {temp_output_path}")
+        # 背景除去実行（/generateの背景透過とキャッシュを共有）
+        output_data = await run_in_render_pool(remove_background_bytes, input_data)
         
-        # レスポンス用のクリーンアップ関数
-        from starlette.background import BackgroundTask
-        def cleanup_files():
-            try:
-                if os.path.exists(temp_input_path):
-                    os.remove(temp_input_path)
-                if os.path.exists(temp_output_path):
-                    os.remove(temp_output_path)
-                print(f"一時ファイルを削除: {temp_input_path}, {temp_output_path}")
-            except Exception as e:
-                print(f"一時ファイル削除エラー: {e}")
+        print(f"背景透過処理完了: {len(output_data)} bytes")
         
         # 処理済み画像を返す
-        response = FileResponse(
-            path=temp_output_path,
-            filename=f"transparent_{temp_id}.png",
+        response = Response(
+            content=output_data,
             media_type='image/png',
-            background=BackgroundTask(cleanup_files)
+            headers={"Content-Disposition": f'attachment; filename="transparent_{temp_id}.png"'}
         )
         response.headers["Access-Control-Allow-Origin"] = "*"
         response.headers["Access-Control-Allow-Methods"] = "POST"
@@ -958,13 +1070,9 @@ async def remove_background_preview(
         return response
         
     except Exception as e:
-        # エラー時も一時ファイルを削除
-        if 'temp_input_path' in locals() and os.path.exists(temp_input_path):
-            os.remove(temp_input_path)
-        if 'temp_output_path' in locals() and os.path.exists(temp_output_path):
-            os.remove(temp_output_path)
-        
         print(f"背景透過処理エラー: {e}")
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
@@ -978,8 +1086,19 @@ if __name__ == "__main__":
     else:
         print(f"🏠 ローカル開発環境: {server_url}:8000")
     
+    # ワーカープロセス数（各ワーカーが起動時にフォント・モデルなどのキャッシュを個別に構築）
+    workers = max(1, int(os.getenv("BACKEND_WORKERS", "1")))
+    if workers > 1:
+        print(f"⚙️ ワーカープロセス数: {workers}")
+        # rembgの推論プロセスとモデルはワーカーごとに作られる
+        rembg_processes = int(os.getenv("REMBG_PROCESS_WORKERS", "0"))
+        if rembg_processes > 0:
+            print(f"⚙️ rembg推論プロセス数: {workers} × {rembg_processes} = {workers * rembg_processes}")
+    
     uvicorn.run(
-        app, 
+        # 複数ワーカーの場合はインポート文字列で渡す必要がある
+        "app:app" if workers > 1 else app, 
+        workers=workers,
         host="0.0.0.0", 
         port=8000,
         # リクエストサイズ制限を5MB（5 * 1024 * 1024 bytes）に設定
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+静的ファイル・ガチャ画像などの配信（HTTPキャッシュ対応）
+
+ファイル内容のハッシュから作るETag・Last-Modified を付けて配信し、条件付きリクエスト
+（If-None-Match / If-Modified-Since）には 304 Not Modified、Range リクエストには 206 で応答する。
+内容で決まるURL（?v=<バージョン> が現在の内容と一致する場合や生成結果キャッシュのファイル名）には
+Cache-Control: immutable を付け、ブラウザやリバースプロキシが再検証せずに使い回せるようにする。
+
+環境変数:
+    ASSET_ETAG_CACHE_BYTES   ETag（ファイル内容のハッシュ）のキャッシュ上限（デフォルト: 4MB）
+"""
+
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+import hashlib
+import mimetypes
+import os
+import threading
+from lru_cache import BoundedLRUCache
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 内容が変わりうるURLは毎回再検証させる（変わっていなければ304で本文を送らない）
+REVALIDATE_CACHE_CONTROL = "no-cache"
+ETAG_LENGTH = 32
+RANGE_CHUNK_SIZE = 64 * 1024
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET",
+    "Access-Control-Allow-Headers": "*"
+}
+
+# (パス, 更新時刻, サイズ) -> ETag（ファイルが変わるまでハッシュを再計算しない）
+etag_cache = BoundedLRUCache(int(os.getenv("ASSET_ETAG_CACHE_BYTES", 4 * 1024 * 1024)), size_of=lambda etag: 256)
+
+
+def content_etag(path, stat=None):
+    """ファイル内容のSHA-256から作る強いETag"""
+    if stat is None:
+        stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    etag = etag_cache.get(cache_key)
+    if etag is not None:
+        return etag
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return etag_cache.put(cache_key, f'"{hasher.hexdigest()[:ETAG_LENGTH]}"')
+
+
+async def content_etag_async(path):
+    """
+    content_etag のイベントループ用（キャッシュにない場合のみスレッドでハッシュを計算し、ループを止めない）
+    Raises:
+        FileNotFoundError: ファイルがない
+    """
+    stat = os.stat(path)
+    etag = etag_cache.get((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    if etag is not None:
+        return etag
+    return await run_in_threadpool(content_etag, path, stat)
+
+
+def etag_version(etag):
+    """URLの ?v= に使うバージョン（ETagの引用符と弱い比較の接頭辞を除いたもの）"""
+    return etag.replace('W/', '').strip('"')
+
+
+class AssetServer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _record(self, kind, status, size, sent):
+        """応答の種類・送信バイト数・（キャッシュにより）送らずに済んだバイト数を記録"""
+        with self._lock:
+            stats = self._stats.setdefault(kind, {
+                "requests": 0,
+                "full": 0,
+                "not_modified": 0,
+                "partial": 0,
+                "range_not_satisfiable": 0,
+                "bytes_sent": 0,
+                "bytes_saved": 0
+            })
+            stats["requests"] += 1
+            stats[{200: "full", 304: "not_modified", 206: "partial", 416: "range_not_satisfiable"}[status]] += 1
+            stats["bytes_sent"] += sent
+            stats["bytes_saved"] += size - sent if status in (206, 304) else 0
+
+    @staticmethod
+    def _not_modified(request, etag, mtime):
+        """条件付きリクエストの検証（If-None-Match がある場合は If-Modified-Since より優先）"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            # GETの If-None-Match は弱い比較
+            return etag_version(etag) in [etag_version(tag.strip()) for tag in if_none_match.split(",")]
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _parse_range(range_header, size):
+        """
+        Rangeヘッダーを解釈して (開始, 終了) を返す（終了は含む）
+        解釈できない・不正な場合（終了が開始より前など）と複数範囲の指定はNone（RFC 9110 に従いRangeを無視して全体を返す）、
+        正しい指定だがファイルの末尾以降を指す場合は False（416）
+        """
+        if not range_header or not range_header.startswith("bytes="):
+            return None
+        spec = range_header[len("bytes="):]
+        if "," in spec:
+            # 離れた複数範囲を1つにまとめると要求されていない部分まで送るため、全体を返す
+            return None
+        start, separator, end = spec.strip().partition("-")
+        if not separator:
+            return None
+        try:
+            if start:
+                first = int(start)
+                if end and int(end) < first:
+                    # 終了位置が開始位置より前のRangeヘッダーは不正
+                    return None
+                last = min(int(end), size - 1) if end else size - 1
+            elif end:
+                # 末尾からのバイト数（bytes=-500）
+                first = max(0, size - int(end))
+                last = size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+        if first > last or first >= size:
+            return False
+        return first, last
+
+    @staticmethod
+    def _read_range(path, start, end):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def serve(self, request, path, media_type=None, kind="static", etag=None, immutable=False,
+              max_age=None, filename=None):
+        """
+        ファイルをキャッシュ用ヘッダー付きで配信する
+        Args:
+            etag: 事前に計算済みのETag（省略時はファイル内容から計算）
+            immutable: URLが内容で決まる場合はTrue（?v= が現在のETagと一致する場合も immutable になる）
+            max_age: 再検証せずに使える秒数（省略時は毎回再検証）
+            filename: 指定するとダウンロード用の Content-Disposition を付ける
+        Raises:
+            FileNotFoundError: ファイルがない
+        """
+        stat = os.stat(path)
+        etag = etag or content_etag(path, stat)
+        media_type = media_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        version = request.query_params.get("v")
+        if immutable or (version and version == etag_version(etag)):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        elif max_age:
+            cache_control = f"public, max-age={max_age}"
+        else:
+            cache_control = REVALIDATE_CACHE_CONTROL
+        headers = dict(CORS_HEADERS, **{
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Cache-Control": cache_control,
+            "Accept-Ranges": "bytes"
+        })
+        if filename:
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+        if self._not_modified(request, etag, stat.st_mtime):
+            self._record(kind, 304, stat.st_size, 0)
+            return Response(status_code=304, headers=headers)
+
+        byte_range = self._parse_range(request.headers.get("range"), stat.st_size)
+        # If-Range が現在の内容と一致しない場合は Range を無視して全体を返す
+        if_range = request.headers.get("if-range")
+        if byte_range is not None and if_range and if_range not in (etag, headers["Last-Modified"]):
+            byte_range = None
+
+        if byte_range is False:
+            self._record(kind, 416, stat.st_size, 0)
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(length)
+            self._record(kind, 206, stat.st_size, length)
+            return StreamingResponse(self._read_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+        self._record(kind, 200, stat.st_size, stat.st_size)
+        if request.headers.get("range") is not None:
+            # 無視したRangeヘッダーを FileResponse が解釈し直さないよう、全体をそのまま送る
+            headers["Content-Length"] = str(stat.st_size)
+            return StreamingResponse(self._read_range(path, 0, stat.st_size - 1), media_type=media_type, headers=headers)
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+    def stats(self):
+        """配信統計を返す（種類ごと、bytes_saved は304・206により送らずに済んだバイト数）"""
+        with self._lock:
+            by_kind = {kind: dict(stats) for kind, stats in self._stats.items()}
+        total = {}
+        for stats in by_kind.values():
+            for key, value in stats.items():
+                total[key] = total.get(key, 0) + value
+        return {
+            "total": total,
+            "by_kind": by_kind,
+            "etag_cache": etag_cache.stats()
+        }
+
+
+_asset_server = None
+_asset_server_lock = threading.Lock()
+
+
+def get_asset_server():
+    """プロセス共通のAssetServerを取得"""
+    global _asset_server
+    if _asset_server is None:
+        with _asset_server_lock:
+            if _asset_server is None:
+                _asset_server = AssetServer()
+    return _asset_server
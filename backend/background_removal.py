@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+rembg による背景透過処理
+
+rembg のセッション（ONNXモデル）をプロセス内で使い回すためのプールと、
+同一画像の透過結果を再利用するためのキャッシュを提供する。
+
+環境変数:
+    REMBG_MODEL               使用するモデル名（デフォルト: u2net）
+    REMBG_POOL_SIZE           セッション数 = 同時推論数の上限（デフォルト: 1）
+    REMBG_INTRA_OP_THREADS    1推論あたりのスレッド数（未設定時はonnxruntimeの既定値）
+    REMBG_PRELOAD             0 の場合は起動時のモデル読み込みを行わない
+    REMBG_CACHE_MEMORY_BYTES  透過結果のメモリキャッシュ上限（デフォルト: 64MB）
+    REMBG_CACHE_DIR           透過結果のディスクキャッシュの保存先（未設定時はディスクキャッシュなし）
+    REMBG_CACHE_DISK_BYTES    ディスクキャッシュの上限（デフォルト: 512MB）
+    REMBG_CACHE_TTL           キャッシュの有効期限（秒、デフォルト: 86400）
+"""
+
+from PIL import Image
+from contextlib import contextmanager
+from io import BytesIO
+import hashlib
+import os
+import queue
+import threading
+import time
+from lru_cache import BoundedLRUCache
+try:
+    from rembg import new_session, remove
+    REMBG_AVAILABLE = True
+except ImportError:
+    REMBG_AVAILABLE = False
+    print("Warning: rembg library not available. Background removal feature will be disabled.")
+
+
+class RembgSessionPool:
+    DEFAULT_MODEL = "u2net"
+    DEFAULT_POOL_SIZE = 1
+    WARM_UP_IMAGE_SIZE = (64, 64)
+
+    def __init__(self, model_name=None, pool_size=None, intra_op_threads=None):
+        self.model_name = model_name or os.getenv("REMBG_MODEL", self.DEFAULT_MODEL)
+        self.pool_size = max(1, int(pool_size or os.getenv("REMBG_POOL_SIZE", self.DEFAULT_POOL_SIZE)))
+        threads = intra_op_threads or os.getenv("REMBG_INTRA_OP_THREADS")
+        self.intra_op_threads = int(threads) if threads else None
+        self._lock = threading.Lock()
+        self._sessions = queue.Queue()
+        self._created = 0
+        self._stats = {
+            "requests": 0,
+            "inference_time_ms": 0.0,
+            "session_load_time_ms": 0.0
+        }
+
+    def _create_session(self):
+        """rembgセッションを作成（モデルの読み込みと初期化）"""
+        if self.intra_op_threads:
+            # rembgはOMP_NUM_THREADSからonnxruntimeのスレッド数を設定する
+            os.environ["OMP_NUM_THREADS"] = str(self.intra_op_threads)
+        start = time.perf_counter()
+        session = new_session(self.model_name)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["session_load_time_ms"] += elapsed_ms
+        print(f"rembgセッションを作成: {self.model_name} ({elapsed_ms:.0f}ms)")
+        return session
+
+    def _acquire(self):
+        """空きセッションを取得（上限まで未作成なら作成、上限に達していれば空き待ち）"""
+        try:
+            return self._sessions.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.pool_size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._create_session()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._sessions.get()
+
+    @contextmanager
+    def session(self):
+        """セッションを借りて、使用後にプールへ返却する"""
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+    def remove(self, input_data):
+        """画像バイト列の背景を除去し、PNGバイト列を返す"""
+        with self.session() as session:
+            start = time.perf_counter()
+            output_data = remove(input_data, session=session)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["inference_time_ms"] += elapsed_ms
+        return output_data
+
+    def warm_up(self):
+        """全セッションを作成し、ダミー推論で初期化を済ませる"""
+        with BytesIO() as buffer:
+            Image.new('RGB', self.WARM_UP_IMAGE_SIZE, (255, 255, 255)).save(buffer, format='PNG')
+            dummy_data = buffer.getvalue()
+
+        sessions = [self._acquire() for _ in range(self.pool_size)]
+        try:
+            for session in sessions:
+                remove(dummy_data, session=session)
+        finally:
+            for session in sessions:
+                self._sessions.put(session)
+        print(f"rembgセッションのウォームアップ完了: {self.pool_size}セッション")
+
+    def stats(self):
+        """プール統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["model"] = self.model_name
+            stats["pool_size"] = self.pool_size
+            stats["sessions_created"] = self._created
+            stats["sessions_idle"] = self._sessions.qsize()
+            return stats
+
+
+class BackgroundRemovalCache:
+    """入力画像のハッシュをキーにした透過結果（PNGバイト列）のキャッシュ（メモリ＋ディスク）"""
+    DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+    DEFAULT_DISK_BYTES = 512 * 1024 * 1024
+    DEFAULT_TTL = 24 * 60 * 60
+
+    def __init__(self, memory_bytes=None, cache_dir=None, disk_bytes=None, ttl=None):
+        self.ttl = ttl or int(os.getenv("REMBG_CACHE_TTL", self.DEFAULT_TTL))
+        self.memory = BoundedLRUCache(
+            memory_bytes or int(os.getenv("REMBG_CACHE_MEMORY_BYTES", self.DEFAULT_MEMORY_BYTES)),
+            size_of=len,
+            ttl=self.ttl
+        )
+        self.cache_dir = cache_dir or os.getenv("REMBG_CACHE_DIR") or None
+        self.disk_bytes = disk_bytes or int(os.getenv("REMBG_CACHE_DISK_BYTES", self.DEFAULT_DISK_BYTES))
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {
+            "disk_hits": 0,
+            "disk_writes": 0,
+            "disk_evictions": 0
+        }
+
+    def make_key(self, input_data, model_name):
+        """入力バイト列とモデル名からキャッシュキーを作成"""
+        digest = hashlib.sha256()
+        digest.update(model_name.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(input_data)
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def get(self, key):
+        """キャッシュから透過結果を取得（メモリ → ディスクの順）"""
+        output_data = self.memory.get(key)
+        if output_data is not None or not self.cache_dir:
+            return output_data
+
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                output_data = f.read()
+        except OSError:
+            return None
+
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        # ディスクで見つかった結果はメモリにも載せる
+        return self.memory.put(key, output_data)
+
+    def put(self, key, output_data):
+        """透過結果をキャッシュに格納"""
+        self.memory.put(key, output_data)
+        if not self.cache_dir:
+            return output_data
+
+        path = self._disk_path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(output_data)
+            os.replace(temp_path, path)
+            with self._lock:
+                self._stats["disk_writes"] += 1
+            self._enforce_disk_limit()
+        except OSError as e:
+            print(f"透過結果のディスクキャッシュ書き込みエラー: {e}")
+        return output_data
+
+    def _enforce_disk_limit(self):
+        """期限切れのファイルを削除し、上限を超えた分を古い順に削除"""
+        now = time.time()
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".png"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove_disk_entry(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_bytes <= self.disk_bytes:
+                break
+            self._remove_disk_entry(path)
+            total_bytes -= size
+
+    def _remove_disk_entry(self, path):
+        try:
+            os.remove(path)
+            with self._lock:
+                self._stats["disk_evictions"] += 1
+        except OSError:
+            pass
+
+    def stats(self):
+        """キャッシュ統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["memory"] = self.memory.stats()
+        stats["cache_dir"] = self.cache_dir
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_cache = None
+# 推論を別プロセスで行う場合のExecutor（render_poolが設定する）
+_inference_executor = None
+
+
+def get_rembg_pool():
+    """プロセス共通のRembgSessionPoolを取得"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RembgSessionPool()
+    return _pool
+
+
+def get_background_removal_cache():
+    """プロセス共通のBackgroundRemovalCacheを取得"""
+    global _cache
+    if _cache is None:
+        with _pool_lock:
+            if _cache is None:
+                _cache = BackgroundRemovalCache()
+    return _cache
+
+
+def set_inference_executor(executor):
+    """推論を実行するExecutorを設定（Noneの場合は呼び出し元のスレッドで推論）"""
+    global _inference_executor
+    _inference_executor = executor
+
+
+def warm_up_worker():
+    """推論プロセス内でセッションを作成・初期化する"""
+    if REMBG_AVAILABLE and os.getenv("REMBG_PRELOAD", "1") != "0":
+        get_rembg_pool().warm_up()
+    return os.getpid()
+
+
+def _remove_in_worker(input_data):
+    """推論プロセス内で実行される背景除去"""
+    return get_rembg_pool().remove(input_data)
+
+
+def remove_background_bytes(input_data):
+    """背景除去を行う（同一入力はキャッシュから返し、未処理なら共有セッションプールで推論）"""
+    pool = get_rembg_pool()
+    cache = get_background_removal_cache()
+    key = cache.make_key(input_data, pool.model_name)
+    output_data = cache.get(key)
+    if output_data is not None:
+        return output_data
+
+    executor = _inference_executor
+    if executor is not None:
+        output_data = executor.submit(_remove_in_worker, input_data).result()
+    else:
+        output_data = pool.remove(input_data)
+    return cache.put(key, output_data)
@@ -0,0 +1,687 @@
+#!/usr/bin/env python3
+"""
+Hirsakam Icon Generator ベンチマーク
+
+使用方法:
+    cd backend && python3 benchmark.py compositing
+    cd backend && python3 benchmark.py emoji-cleanup
+    cd backend && python3 benchmark.py preview
+    cd backend && python3 benchmark.py overlay-transport
+    cd backend && python3 benchmark.py batch --count 20
+    cd backend && python3 benchmark.py formats
+    cd backend && python3 benchmark.py text-layout
+    cd backend && python3 benchmark.py stroke
+    cd backend && python3 benchmark.py loadtest --url http://localhost:8000
+    cd backend && python3 benchmark.py throughput
+    cd backend && python3 benchmark.py throughput --url http://localhost:8000 --concurrency 1,2,4,8
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+from hirsakam_icon_generator import HirsakamGenerator, text_layout_cache, text_sprite_cache
+from output_formats import PRESETS, available_formats
+from upload_ingest import UploadIngestor, parse_overlay_fields
+
+BASE_IMAGE_PATH = os.path.join("..", "hirsakam.jpg")
+OVERLAY_IMAGE_PATH = os.path.join("..", "other_image", "user_hirsakam_eyes2.png")
+
+
+def _time_call(func, repeat):
+    """関数をrepeat回実行し、各回の所要時間（ミリ秒）を返す"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _make_drawing_image(size, path):
+    """ベンチマーク用のフリーハンド描画（透過PNG）を作成"""
+    drawing = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(drawing)
+    draw.line((20, 20, size[0] - 20, size[1] - 20), fill=(255, 0, 0, 255), width=8)
+    draw.ellipse((60, 60, 200, 200), outline=(0, 128, 255, 255), width=6)
+    drawing.save(path, "PNG")
+    return path
+
+
+def _sample_layers(drawing_path):
+    """text / overlay / text / overlay / drawing の5レイヤー構成"""
+    return [
+        {'type': 'text', 'text': 'LGTM', 'position': (260, 80), 'color': (255, 255, 255), 'font_size': 48, 'rotation': 0},
+        {'type': 'overlay', 'image': OVERLAY_IMAGE_PATH, 'x': 180, 'y': 200, 'width': 120, 'height': 120, 'opacity': 0.8, 'rotation': 15},
+        {'type': 'text', 'text': 'おはよう', 'position': (260, 300), 'color': (255, 255, 0), 'font_size': 40, 'rotation': 10},
+        {'type': 'overlay', 'image': OVERLAY_IMAGE_PATH, 'x': 360, 'y': 200, 'width': 100, 'height': 100, 'opacity': 1.0, 'flip_horizontal': True},
+        {'type': 'drawing', 'image': drawing_path},
+    ]
+
+
+def _render_per_file(generator, layers, output_path):
+    """従来のレイヤーごとにJPEGを読み書きする処理"""
+    generator.copy_base_image(output_path)
+    for layer in layers:
+        if layer['type'] == 'text':
+            generator.add_text_to_image(output_path, layer['text'], layer['position'], layer['color'], layer['font_size'], layer['rotation'], output_path)
+        elif layer['type'] == 'overlay':
+            generator.add_overlay_image(
+                output_path, layer['image'], layer['x'], layer['y'], layer['width'], layer['height'],
+                layer['opacity'], layer.get('rotation', 0), False, layer.get('flip_horizontal', False), output_path
+            )
+        elif layer['type'] == 'drawing':
+            generator.add_drawing_overlay(output_path, layer['image'], output_path)
+    return output_path
+
+
+def bench_compositing(repeat):
+    """レイヤーごとのJPEG往復とメモリ上合成のレイテンシを比較"""
+    generator = HirsakamGenerator(BASE_IMAGE_PATH)
+    base_size = generator.load_base_image().size
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        drawing_path = _make_drawing_image(base_size, os.path.join(work_dir, "drawing.png"))
+        all_layers = _sample_layers(drawing_path)
+
+        # ウォームアップ（フォント解決などを計測から除外）
+        generator.composite_layers(all_layers)
+
+        print(f"{'layers':>6} {'per-file(ms)':>13} {'in-memory(ms)':>14} {'saved(ms)':>10} {'mean |diff|':>12}")
+        previous_saved = 0.0
+        for layer_count in range(0, len(all_layers) + 1):
+            layers = all_layers[:layer_count]
+            per_file_path = os.path.join(work_dir, f"per_file_{uuid.uuid4()}.jpg")
+            in_memory_path = os.path.join(work_dir, f"in_memory_{uuid.uuid4()}.jpg")
+
+            per_file = statistics.median(_time_call(lambda: _render_per_file(generator, layers, per_file_path), repeat))
+            in_memory = statistics.median(_time_call(lambda: generator.render_layers(layers, in_memory_path), repeat))
+
+            # 画素差分（再圧縮の劣化分のみのはず）
+            per_file_rgb = Image.open(per_file_path).convert('RGB')
+            reference_rgb = generator.composite_layers(layers).convert('RGB')
+            diff = ImageChops.difference(per_file_rgb, reference_rgb).convert('L')
+            mean_diff = ImageStat.Stat(diff).mean[0]
+
+            saved = per_file - in_memory
+            print(f"{layer_count:>6} {per_file:>13.2f} {in_memory:>14.2f} {saved:>10.2f} {mean_diff:>12.3f}")
+            if layer_count > 0:
+                print(f"{'':>6} 1レイヤー追加あたりの削減: {saved - previous_saved:.2f} ms")
+            previous_saved = saved
+
+
+def _bench_preview_base(base_path, drawing_path, repeat, scales):
+    """1つのベース画像について最終出力とプレビューのレンダリング時間を表示"""
+    generator = HirsakamGenerator(base_path)
+    layers = _sample_layers(drawing_path)
+
+    # ウォームアップ（フォント解決などを計測から除外）
+    generator.render_layers_to_bytes(layers)
+    for scale in scales:
+        generator.render_preview(layers, scale)
+
+    final = _time_call(lambda: generator.render_layers_to_bytes(layers), repeat)
+    final_bytes = len(generator.render_layers_to_bytes(layers))
+    print(f"{'mode':>14} {'p50(ms)':>9} {'p99(ms)':>9} {'bytes':>8} {'speedup':>8}")
+    print(f"{'final':>14} {_percentile(final, 50):>9.2f} {_percentile(final, 99):>9.2f} {final_bytes:>8} {1.0:>7.1f}x")
+    for image_format in ("JPEG", "WEBP"):
+        for scale in scales:
+            timings = _time_call(lambda: generator.render_preview(layers, scale, image_format), repeat)
+            preview_bytes = len(generator.render_preview(layers, scale, image_format))
+            speedup = _percentile(final, 50) / _percentile(timings, 50)
+            label = f"{image_format.lower()} x{scale}"
+            print(f"{label:>14} {_percentile(timings, 50):>9.2f} {_percentile(timings, 99):>9.2f} {preview_bytes:>8} {speedup:>7.1f}x")
+
+
+def bench_preview(repeat, scales, large_size):
+    """最終出力とプレビュー（縮小・軽量フィルター・高速エンコード）のレンダリング時間を比較"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        base_image = Image.open(BASE_IMAGE_PATH).convert('RGB')
+        # カスタム画像を想定した大きいベース画像
+        large_base_path = os.path.join(work_dir, "large_base.jpg")
+        base_image.resize((large_size, large_size), Image.LANCZOS).save(large_base_path, "JPEG", quality=95)
+
+        # フロントエンドは描画を表示サイズのキャンバスで送るため、描画はベース画像の大きさによらず同じサイズ
+        drawing_path = _make_drawing_image(base_image.size, os.path.join(work_dir, "drawing.png"))
+        for label, base_path, size in (("デフォルト画像", BASE_IMAGE_PATH, base_image.size),
+                                       ("大きいカスタム画像", large_base_path, (large_size, large_size))):
+            print(f"{label} ({size[0]}x{size[1]})")
+            _bench_preview_base(base_path, drawing_path, repeat, scales)
+
+
+def _batch_layer_sets(count, overlay_data):
+    """同じベース画像・オーバーレイでテキストだけが異なるバリエーション（アイコンセットを想定）"""
+    return [
+        [
+            {'type': 'text', 'text': f"バリエーション{index}", 'position': (260, 80), 'color': (255, 255, 255), 'font_size': 48, 'rotation': 0},
+            {'type': 'overlay', 'image': overlay_data, 'x': 180, 'y': 200, 'width': 120, 'height': 120, 'opacity': 0.8, 'rotation': 15},
+            {'type': 'text', 'text': f"#{index}", 'position': (260, 300), 'color': (255, 255, 0), 'font_size': 40, 'rotation': 10},
+        ]
+        for index in range(count)
+    ]
+
+
+def bench_batch(count, workers, repeat):
+    """/generate を1枚ずつ呼ぶ場合とバッチ合成（render_batch）の1枚あたりの時間を比較"""
+    with open(BASE_IMAGE_PATH, 'rb') as f:
+        base_data = f.read()
+    with open(OVERLAY_IMAGE_PATH, 'rb') as f:
+        overlay_data = f.read()
+    layer_sets = _batch_layer_sets(count, overlay_data)
+
+    print(f"{count}枚のバリエーション（バッチのスレッド数: {workers}）")
+    print(f"{'base':>10} {'single(ms/img)':>15} {'batch(ms/img)':>14} {'speedup':>8}")
+    for label, base_image, cache_base_image in (("default", BASE_IMAGE_PATH, True), ("upload", base_data, False)):
+        # 1枚ずつ: リクエストごとにジェネレーターを作り、ベース画像・オーバーレイをデコードする（/generate と同じ）
+        def single():
+            for layers in layer_sets:
+                HirsakamGenerator(base_image, cache_base_image=cache_base_image).render_layers_to_bytes(layers)
+
+        def batch():
+            results = HirsakamGenerator(base_image, cache_base_image=cache_base_image).render_batch(layer_sets, max_workers=workers)
+            assert all(error is None for _, error in results)
+
+        # ウォームアップ（フォント解決などを計測から除外）
+        single()
+        batch()
+        single_ms = statistics.median(_time_call(single, repeat)) / count
+        batch_ms = statistics.median(_time_call(batch, repeat)) / count
+        print(f"{label:>10} {single_ms:>15.2f} {batch_ms:>14.2f} {single_ms / batch_ms:>7.1f}x")
+
+
+def bench_formats(repeat, large_size):
+    """代表的な合成画像について、出力形式・プリセットごとのエンコード時間とファイルサイズを比較"""
+    print(f"利用可能な出力形式: {', '.join(available_formats())}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        generator = HirsakamGenerator(BASE_IMAGE_PATH)
+        base_size = generator.load_base_image().size
+        drawing_path = _make_drawing_image(base_size, os.path.join(work_dir, "drawing.png"))
+        large_base_path = os.path.join(work_dir, "large_base.jpg")
+        Image.open(BASE_IMAGE_PATH).convert('RGB').resize((large_size, large_size), Image.LANCZOS).save(large_base_path, "JPEG", quality=95)
+
+        compositions = (
+            ("テキストのみ", BASE_IMAGE_PATH, _sample_layers(drawing_path)[:1]),
+            ("5レイヤー", BASE_IMAGE_PATH, _sample_layers(drawing_path)),
+            (f"大きいベース画像 ({large_size}px)", large_base_path, _sample_layers(drawing_path)[:2]),
+        )
+        for label, base_path, layers in compositions:
+            generator = HirsakamGenerator(base_path)
+            canvas = generator.composite_layers(layers).convert('RGB')
+            baseline = len(generator.encode_canvas(canvas, "jpeg", preset="balanced"))
+            print(f"\n{label} ({canvas.width}x{canvas.height})")
+            print(f"{'format':>14} {'preset':>9} {'p50(ms)':>9} {'bytes':>9} {'vs jpeg':>8}")
+            for name in available_formats():
+                for preset in PRESETS:
+                    timings = _time_call(lambda: generator.encode_canvas(canvas, name, preset=preset), repeat)
+                    size = len(generator.encode_canvas(canvas, name, preset=preset))
+                    print(f"{name:>14} {preset:>9} {_percentile(timings, 50):>9.2f} {size:>9} {size / baseline * 100:>7.0f}%")
+
+
+def bench_text_layout(repeat):
+    """テキストレイヤーの合成時間（計測・描画・回転を毎回行う場合とキャッシュ済みのスプライトを合成する場合）"""
+    generator = HirsakamGenerator(BASE_IMAGE_PATH)
+    canvas = generator.load_base_canvas()
+    captions = (("LGTM", 48), ("おはよう", 40), ("LGTM\nおはよう\nおつかれさまです", 36))
+
+    def render(text, font_size, rotation):
+        return generator.add_text_to_image_obj(canvas.copy(), text, (260, 143), (255, 255, 255), font_size, rotation)
+
+    def render_cold(text, font_size, rotation):
+        text_layout_cache.clear()
+        text_sprite_cache.clear()
+        return render(text, font_size, rotation)
+
+    print(f"{'text':>18} {'rotation':>9} {'cold(ms)':>9} {'cached(ms)':>11} {'speedup':>8}")
+    for text, font_size in captions:
+        for rotation in (0, 15):
+            cold = statistics.median(_time_call(lambda: render_cold(text, font_size, rotation), repeat))
+            cached = statistics.median(_time_call(lambda: render(text, font_size, rotation), repeat))
+            label = text.replace("\n", "/")
+            print(f"{label:>18} {rotation:>9} {cold:>9.2f} {cached:>11.2f} {cold / cached:>7.1f}x")
+    print(f"\ntext_sprites: {text_sprite_cache.stats()}")
+
+
+class _CountingDraw(ImageDraw.ImageDraw):
+    """draw.text の呼び出し回数（テキストのラスタライズ回数）を数える"""
+    calls = 0
+
+    def text(self, *args, **kwargs):
+        _CountingDraw.calls += 1
+        return super().text(*args, **kwargs)
+
+
+def _legacy_outline_text(image, text, position, font, color, width):
+    """従来の縁取り（(2w+1)^2 - 1 通りにずらして描画してから本体を描画）"""
+    draw = _CountingDraw(image)
+    x, y = position
+    for dx in range(-width, width + 1):
+        for dy in range(-width, width + 1):
+            if dx != 0 or dy != 0:
+                draw.text((x + dx, y + dy), text, font=font, fill=(0, 0, 0))
+    draw.text((x, y), text, font=font, fill=color)
+    return image
+
+
+def bench_stroke(repeat, widths):
+    """テキストの縁取り（ずらして重ね描きする従来方式とFreeTypeのストローク）のラスタライズ回数と時間を比較"""
+    generator = HirsakamGenerator(BASE_IMAGE_PATH)
+    canvas = generator.load_base_canvas()
+    original_draw = ImageDraw.Draw
+    print(f"{'text':>10} {'width':>6} {'legacy calls':>13} {'legacy(ms)':>11} {'stroke calls':>13} {'stroke(ms)':>11} {'speedup':>8}")
+    for text in ("LGTM", "おはよう"):
+        font = generator.get_font(48, text=text)
+        for width in widths:
+            _CountingDraw.calls = 0
+            legacy = statistics.median(_time_call(
+                lambda: _legacy_outline_text(canvas.copy(), text, (200, 120), font, (255, 255, 255), width), repeat
+            ))
+            legacy_calls = _CountingDraw.calls // repeat
+
+            def render_stroke():
+                # スプライトのキャッシュを使わず、毎回ラスタライズする場合の時間を計測
+                text_layout_cache.clear()
+                text_sprite_cache.clear()
+                return generator.add_text_to_image_obj(canvas.copy(), text, (260, 143), (255, 255, 255), 48, 0, width, (0, 0, 0))
+
+            _CountingDraw.calls = 0
+            ImageDraw.Draw = lambda image, mode=None: _CountingDraw(image, mode)
+            try:
+                stroke = statistics.median(_time_call(render_stroke, repeat))
+            finally:
+                ImageDraw.Draw = original_draw
+            stroke_calls = _CountingDraw.calls // repeat
+            print(f"{text:>10} {width:>6} {legacy_calls:>13} {legacy:>11.2f} {stroke_calls:>13} {stroke:>11.2f} {legacy / stroke:>7.1f}x")
+
+
+def _overlay_transport_bodies(overlay_size, overlay_count):
+    """同じオーバーレイをbase64 JSON形式とバイナリマルチパート形式で送る場合のリクエスト本文"""
+    from urllib3 import encode_multipart_formdata
+
+    with BytesIO() as buffer:
+        # 写真を想定し、圧縮の効きにくいノイズ画像を使う
+        Image.effect_noise((overlay_size, overlay_size), 64).convert('RGBA').save(buffer, format='PNG')
+        overlay_data = buffer.getvalue()
+
+    meta = [
+        {'slotNumber': slot, 'x': 100 * slot, 'y': 200, 'width': 200, 'height': 200,
+         'opacity': 1.0, 'rotation': 0, 'removeBackground': False, 'flipHorizontal': False}
+        for slot in range(1, overlay_count + 1)
+    ]
+    data_url = "data:image/png;base64," + base64.b64encode(overlay_data).decode('ascii')
+    base64_fields = {
+        'overlay_images': json.dumps([dict(item, data=data_url) for item in meta]),
+        'layer_order': json.dumps([f"overlay{slot}" for slot in range(1, overlay_count + 1)])
+    }
+    binary_fields = {
+        'overlay_meta': json.dumps(meta),
+        'layer_order': base64_fields['layer_order']
+    }
+    for slot in range(1, overlay_count + 1):
+        binary_fields[f"overlay{slot}"] = (f"overlay{slot}.png", overlay_data, 'image/png')
+
+    return encode_multipart_formdata(base64_fields), encode_multipart_formdata(binary_fields)
+
+
+def _parse_overlay_request(body, content_type, ingestor):
+    """マルチパートの解析からオーバーレイ画像の取り込みまで（サーバー側の処理と同じ手順）"""
+    from starlette.datastructures import Headers
+    from starlette.formparsers import MultiPartParser
+
+    async def stream():
+        yield body
+        yield b""
+
+    async def parse():
+        # 従来形式の巨大なフォームフィールドも解析できるよう上限を広げる
+        parser = MultiPartParser(Headers({'content-type': content_type}), stream(), max_part_size=len(body))
+        return await parser.parse()
+
+    form = asyncio.run(parse())
+    overlays = parse_overlay_fields(
+        form.get('overlay_images'),
+        form.get('overlay_meta'),
+        {slot: form.get(f"overlay{slot}") for slot in (1, 2, 3)}
+    )
+    return [ingestor.ingest_overlay(overlay).read() for overlay in overlays.values()]
+
+
+def bench_overlay_transport(repeat, overlay_size, overlay_count):
+    """オーバーレイのbase64 JSON形式とバイナリマルチパート形式のリクエストサイズ・解析時間を比較"""
+    (base64_body, base64_type), (binary_body, binary_type) = _overlay_transport_bodies(overlay_size, overlay_count)
+    ingestor = UploadIngestor(tempfile.gettempdir())
+
+    print(f"オーバーレイ {overlay_count}枚 ({overlay_size}x{overlay_size} PNG)")
+    print(f"{'transport':>10} {'bytes':>10} {'parse p50(ms)':>14} {'parse p99(ms)':>14}")
+    for label, body, content_type in (("base64", base64_body, base64_type), ("binary", binary_body, binary_type)):
+        timings = _time_call(lambda: _parse_overlay_request(body, content_type, ingestor), repeat)
+        print(f"{label:>10} {len(body):>10} {_percentile(timings, 50):>14.2f} {_percentile(timings, 99):>14.2f}")
+    print(f"リクエストサイズ削減: {(1 - len(binary_body) / len(base64_body)) * 100:.1f}%")
+
+
+def _legacy_emoji_cleanup(generator, emoji_img, size):
+    """従来のPythonループによる透明性処理（比較用）"""
+    emoji_array = list(emoji_img.getdata())
+    cleaned_data = []
+    transparent_colors = {}
+    for pixel in emoji_array:
+        r, g, b, a = pixel
+        if a == 0:
+            color_key = (r, g, b)
+            transparent_colors[color_key] = transparent_colors.get(color_key, 0) + 1
+    background_color = None
+    if transparent_colors:
+        background_color = max(transparent_colors.items(), key=lambda x: x[1])[0]
+    for pixel in emoji_array:
+        r, g, b, a = pixel
+        is_background = (
+            a == 0 or
+            (background_color and (r, g, b) == background_color) or
+            a < generator.BACKGROUND_ALPHA_THRESHOLD
+        )
+        if is_background:
+            cleaned_data.append((0, 0, 0, 0))
+        else:
+            cleaned_data.append((r, g, b, 255))
+    emoji_img = emoji_img.copy()
+    emoji_img.putdata(cleaned_data)
+    emoji_img = emoji_img.resize((size, size), Image.Resampling.LANCZOS)
+    final_data = []
+    for pixel in emoji_img.getdata():
+        r, g, b, a = pixel
+        if a < generator.TRANSPARENT_ALPHA_THRESHOLD:
+            final_data.append((0, 0, 0, 0))
+        else:
+            final_data.append((r, g, b, 255))
+    emoji_img.putdata(final_data)
+    return emoji_img
+
+
+def _vectorized_emoji_cleanup(generator, emoji_img, size):
+    """Pillowのバンド演算による透明性処理"""
+    emoji_img = generator._clean_emoji_background(emoji_img)
+    emoji_img = emoji_img.resize((size, size), Image.Resampling.LANCZOS)
+    return generator._binarize_alpha(emoji_img, generator.TRANSPARENT_ALPHA_THRESHOLD)
+
+
+def _make_emoji_sprite(size):
+    """ベンチマーク用の絵文字風スプライト（縁が半透明、背景は透明色が混在）"""
+    scale = 4
+    large = Image.new('RGBA', (size * scale, size * scale), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(large)
+    margin = size * scale // 10
+    draw.ellipse((margin, margin, size * scale - margin, size * scale - margin), fill=(255, 204, 77, 255))
+    draw.ellipse((size * scale * 3 // 10, size * scale * 3 // 10, size * scale * 4 // 10, size * scale * 45 // 100), fill=(102, 69, 0, 255))
+    draw.rectangle((0, 0, size * scale // 8, size * scale // 8), fill=(0, 0, 0, 0))
+    return large.resize((size, size), Image.Resampling.LANCZOS)
+
+
+def bench_emoji_cleanup(repeat):
+    """絵文字スプライトの透明性処理（Pythonループ vs バンド演算）"""
+    generator = HirsakamGenerator(BASE_IMAGE_PATH)
+    print(f"{'size':>5} {'legacy(ms)':>11} {'vectorized(ms)':>15} {'speedup':>8} {'identical':>10}")
+    for size in (32, 64, 128, 164, 256, 512):
+        sprite = _make_emoji_sprite(size)
+        legacy = statistics.median(_time_call(lambda: _legacy_emoji_cleanup(generator, sprite, size), repeat))
+        vectorized = statistics.median(_time_call(lambda: _vectorized_emoji_cleanup(generator, sprite, size), repeat))
+        identical = _legacy_emoji_cleanup(generator, sprite, size).tobytes() == _vectorized_emoji_cleanup(generator, sprite, size).tobytes()
+        print(f"{size:>5} {legacy:>11.2f} {vectorized:>15.2f} {legacy / vectorized:>7.1f}x {str(identical):>10}")
+
+
+def _percentile(values, percent):
+    """パーセンタイル値（最近傍法）"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _heavy_generate_payload(remove_background):
+    """重いレンダリングを発生させる/generateのリクエスト内容"""
+    with BytesIO() as buffer:
+        Image.open(OVERLAY_IMAGE_PATH).convert('RGBA').resize((512, 512)).save(buffer, format='PNG')
+        overlay_data = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+    overlays = [
+        {'slotNumber': slot, 'data': overlay_data, 'x': 100 * slot, 'y': 200, 'width': 300, 'height': 300,
+         'opacity': 0.9, 'rotation': 15 * slot, 'removeBackground': remove_background}
+        for slot in (1, 2, 3)
+    ]
+    return {
+        'text': 'LGTM\nおはよう',
+        'text_rotation': '10',
+        'overlay_images': json.dumps(overlays),
+        'layer_order': json.dumps(['text', 'overlay1', 'overlay2', 'overlay3'])
+    }
+
+
+def _measure_light_requests(session, url, count):
+    """軽いエンドポイントのレイテンシ（ミリ秒）を計測"""
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        session.get(url, timeout=60)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def bench_loadtest(base_url, heavy_clients, light_requests, light_endpoint, remove_background):
+    """重いレンダリング実行中の軽いエンドポイントのレイテンシを計測"""
+    import requests
+
+    light_url = base_url.rstrip('/') + light_endpoint
+    generate_url = base_url.rstrip('/') + '/generate'
+    payload = _heavy_generate_payload(remove_background)
+
+    session = requests.Session()
+    baseline = _measure_light_requests(session, light_url, light_requests)
+
+    stop = threading.Event()
+    heavy_results = []
+
+    def heavy_worker():
+        heavy_session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = heavy_session.post(generate_url, data=payload, timeout=120)
+            heavy_results.append((response.status_code, (time.perf_counter() - start) * 1000))
+
+    workers = [threading.Thread(target=heavy_worker, daemon=True) for _ in range(heavy_clients)]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.5)
+    under_load = _measure_light_requests(session, light_url, light_requests)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    print(f"{light_endpoint} のレイテンシ（{light_requests}リクエスト、重い/generate並列数: {heavy_clients}）")
+    print(f"{'':>12} {'p50(ms)':>9} {'p99(ms)':>9} {'max(ms)':>9}")
+    for label, timings in (("負荷なし", baseline), ("負荷あり", under_load)):
+        print(f"{label:>10} {_percentile(timings, 50):>9.1f} {_percentile(timings, 99):>9.1f} {max(timings):>9.1f}")
+
+    statuses = {}
+    for status, _ in heavy_results:
+        statuses[status] = statuses.get(status, 0) + 1
+    heavy_timings = [elapsed for status, elapsed in heavy_results if status == 200]
+    if heavy_timings:
+        print(f"/generate: {statuses}, p50 {_percentile(heavy_timings, 50):.1f}ms")
+    else:
+        print(f"/generate: {statuses}")
+
+
+_throughput_generator = None
+_throughput_drawing_path = None
+
+
+def _init_throughput_worker(drawing_path):
+    """ワーカープロセスごとにジェネレーターを作成し、フォント・スプライトを温めておく"""
+    global _throughput_generator, _throughput_drawing_path
+    _throughput_generator = HirsakamGenerator(BASE_IMAGE_PATH)
+    _throughput_drawing_path = drawing_path
+    _throughput_generator.composite_layers(_sample_layers(drawing_path))
+
+
+def _render_in_worker(_):
+    """ワーカープロセス内で5レイヤーの合成を1回実行"""
+    _throughput_generator.composite_layers(_sample_layers(_throughput_drawing_path))
+    return os.getpid()
+
+
+def _bench_process_throughput(worker_counts, images_per_worker):
+    """ProcessPoolExecutorのワーカー数ごとの合成スループットを計測"""
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        drawing_path = _make_drawing_image(Image.open(BASE_IMAGE_PATH).size, os.path.join(temp_dir, "drawing.png"))
+        results = []
+        for workers in worker_counts:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_init_throughput_worker, initargs=(drawing_path,)) as executor:
+                # 全ワーカーを起動させてから計測する
+                list(executor.map(_render_in_worker, range(workers)))
+                count = workers * images_per_worker
+                start = time.perf_counter()
+                list(executor.map(_render_in_worker, range(count)))
+                elapsed = time.perf_counter() - start
+            results.append((workers, count / elapsed))
+    return results
+
+
+def _bench_http_throughput(base_url, concurrency_levels, requests_per_client):
+    """/generateへの同時リクエスト数ごとのスループットを計測（要サーバー起動）"""
+    import requests
+
+    generate_url = base_url.rstrip('/') + '/generate'
+    payload = _heavy_generate_payload(False)
+    results = []
+    for concurrency in concurrency_levels:
+        statuses = {}
+        lock = threading.Lock()
+
+        def client():
+            session = requests.Session()
+            for _ in range(requests_per_client):
+                response = session.post(generate_url, data=payload, timeout=120)
+                with lock:
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        clients = [threading.Thread(target=client) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results.append((concurrency, statuses.get(200, 0) / elapsed))
+        if set(statuses) != {200}:
+            print(f"  同時{concurrency}: ステータス内訳 {statuses}")
+    return results
+
+
+def bench_throughput(base_url, levels, count):
+    """並列度ごとの/generateスループット（images/s）とスケーリング効率を表示"""
+    if levels is None:
+        levels = list(range(1, (os.cpu_count() or 1) + 1))
+
+    if base_url:
+        print(f"/generate スループット（{base_url}、クライアントあたり{count}リクエスト）")
+        results = _bench_http_throughput(base_url, levels, count)
+        label = "同時接続数"
+    else:
+        print(f"合成スループット（プロセスプール、ワーカーあたり{count}枚）")
+        results = _bench_process_throughput(levels, count)
+        label = "ワーカー数"
+
+    baseline = results[0][1] / results[0][0]
+    if baseline == 0:
+        print("成功したレンダリングがないため、スループットを計算できません")
+        return
+    print(f"{label:>8} {'images/s':>10} {'効率':>8}")
+    for parallelism, images_per_second in results:
+        efficiency = images_per_second / (baseline * parallelism) * 100
+        print(f"{parallelism:>12} {images_per_second:>10.1f} {efficiency:>7.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hirsakam Icon Generator ベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compositing_parser = subparsers.add_parser("compositing", help="レイヤー合成パイプラインの比較")
+    compositing_parser.add_argument("--repeat", type=int, default=10)
+
+    preview_parser = subparsers.add_parser("preview", help="最終出力とプレビューのレンダリング時間の比較")
+    preview_parser.add_argument("--repeat", type=int, default=20)
+    preview_parser.add_argument("--scales", default="0.5,0.25", help="プレビューの縮小率の一覧（例: 0.5,0.25）")
+    preview_parser.add_argument("--large-size", type=int, default=2048, help="大きいカスタム画像の一辺のピクセル数")
+
+    overlay_transport_parser = subparsers.add_parser("overlay-transport", help="オーバーレイの送信形式（base64 / バイナリ）の比較")
+    overlay_transport_parser.add_argument("--repeat", type=int, default=20)
+    overlay_transport_parser.add_argument("--overlay-size", type=int, default=512)
+    overlay_transport_parser.add_argument("--overlays", type=int, default=3, choices=[1, 2, 3])
+
+    batch_parser = subparsers.add_parser("batch", help="1枚ずつの生成とバッチ生成の1枚あたりの時間の比較")
+    batch_parser.add_argument("--count", type=int, default=20, help="バッチあたりの画像数")
+    batch_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="バッチ合成のスレッド数")
+    batch_parser.add_argument("--repeat", type=int, default=5)
+
+    formats_parser = subparsers.add_parser("formats", help="出力形式・プリセットごとのエンコード時間とサイズの比較")
+    formats_parser.add_argument("--repeat", type=int, default=10)
+    formats_parser.add_argument("--large-size", type=int, default=1024, help="大きいベース画像の一辺のピクセル数")
+
+    text_layout_parser = subparsers.add_parser("text-layout", help="テキストレイヤーの計測・描画キャッシュの効果")
+    text_layout_parser.add_argument("--repeat", type=int, default=20)
+
+    stroke_parser = subparsers.add_parser("stroke", help="テキストの縁取りのラスタライズ回数と時間の比較")
+    stroke_parser.add_argument("--repeat", type=int, default=20)
+    stroke_parser.add_argument("--widths", default="1,2,4,8", help="縁取りの幅の一覧（例: 1,2,4,8）")
+
+    emoji_cleanup_parser = subparsers.add_parser("emoji-cleanup", help="絵文字の透明性処理の比較")
+    emoji_cleanup_parser.add_argument("--repeat", type=int, default=10)
+
+    loadtest_parser = subparsers.add_parser("loadtest", help="重いレンダリング中の軽いエンドポイントのレイテンシ計測（要サーバー起動）")
+    loadtest_parser.add_argument("--url", default="http://localhost:8000")
+    loadtest_parser.add_argument("--heavy-clients", type=int, default=4)
+    loadtest_parser.add_argument("--light-requests", type=int, default=200)
+    loadtest_parser.add_argument("--light-endpoint", default="/gacha")
+    loadtest_parser.add_argument("--remove-background", action="store_true", help="オーバーレイに背景透過を適用する")
+
+    throughput_parser = subparsers.add_parser("throughput", help="並列度ごとの/generateスループット計測")
+    throughput_parser.add_argument("--url", default=None, help="指定するとHTTP経由で計測（要サーバー起動）。未指定時はプロセスプールで計測")
+    throughput_parser.add_argument("--concurrency", default=None, help="並列度の一覧（例: 1,2,4,8、デフォルト: 1〜CPU数）")
+    throughput_parser.add_argument("--count", type=int, default=10, help="並列単位あたりのレンダリング回数")
+
+    args = parser.parse_args()
+    if args.command == "compositing":
+        bench_compositing(args.repeat)
+    elif args.command == "preview":
+        bench_preview(args.repeat, [float(scale) for scale in args.scales.split(',')], args.large_size)
+    elif args.command == "overlay-transport":
+        bench_overlay_transport(args.repeat, args.overlay_size, args.overlays)
+    elif args.command == "batch":
+        bench_batch(args.count, args.workers, args.repeat)
+    elif args.command == "formats":
+        bench_formats(args.repeat, args.large_size)
+    elif args.command == "text-layout":
+        bench_text_layout(args.repeat)
+    elif args.command == "stroke":
+        bench_stroke(args.repeat, [int(width) for width in args.widths.split(',')])
+    elif args.command == "emoji-cleanup":
+        bench_emoji_cleanup(args.repeat)
+    elif args.command == "loadtest":
+        bench_loadtest(args.url, args.heavy_clients, args.light_requests, args.light_endpoint, args.remove_background)
+    elif args.command == "throughput":
+        levels = [int(level) for level in args.concurrency.split(',')] if args.concurrency else None
+        bench_throughput(args.url, levels, args.count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+ローカル絵文字スプライトアトラス
+
+twemoji の PNG アセットを1枚の生RGBAアトラス（atlas.rgba）と
+インデックス（atlas.json）にまとめ、実行時はメモリマップして参照する。
+
+アトラスの作成:
+    cd backend && python3 emoji_atlas.py build /path/to/twemoji/assets/72x72
+"""
+
+from PIL import Image
+import argparse
+import glob
+import json
+import math
+import mmap
+import os
+import threading
+
+ATLAS_IMAGE_FILENAME = "atlas.rgba"
+ATLAS_INDEX_FILENAME = "atlas.json"
+DEFAULT_ATLAS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "emoji_atlas")
+VARIATION_SELECTOR_16 = 0xFE0F
+ZERO_WIDTH_JOINER = 0x200D
+
+
+def emoji_sequence_key(emoji_text):
+    """絵文字文字列をコードポイント列のキー（例: 1f468-200d-1f469）に変換"""
+    return '-'.join(f"{ord(char):x}" for char in emoji_text.strip())
+
+
+def candidate_keys(emoji_text):
+    """検索に使うキー候補（twemojiはZWJを含まない場合FE0Fを省略する）"""
+    codepoints = [ord(char) for char in emoji_text.strip()]
+    keys = [emoji_sequence_key(emoji_text)]
+    stripped = [cp for cp in codepoints if cp != VARIATION_SELECTOR_16]
+    if stripped and stripped != codepoints:
+        keys.append('-'.join(f"{cp:x}" for cp in stripped))
+    return keys
+
+
+def twemoji_key(emoji_text):
+    """twemojiのファイル名に使われるキー（ZWJを含まない場合はFE0Fを省略する）"""
+    codepoints = [ord(char) for char in emoji_text.strip()]
+    if ZERO_WIDTH_JOINER not in codepoints:
+        codepoints = [cp for cp in codepoints if cp != VARIATION_SELECTOR_16] or codepoints
+    return '-'.join(f"{cp:x}" for cp in codepoints)
+
+
+class EmojiAtlas:
+    def __init__(self, atlas_dir=None):
+        self.atlas_dir = atlas_dir or os.getenv("EMOJI_ATLAS_DIR", DEFAULT_ATLAS_DIR)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._atlas = None
+        self._mmap = None
+        self._sprites = {}
+
+    def _load(self):
+        """インデックスを読み込み、アトラス本体をメモリマップする（初回のみ）"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+
+            index_path = os.path.join(self.atlas_dir, ATLAS_INDEX_FILENAME)
+            image_path = os.path.join(self.atlas_dir, ATLAS_IMAGE_FILENAME)
+            if not (os.path.exists(index_path) and os.path.exists(image_path)):
+                print(f"絵文字アトラスが見つかりません: {self.atlas_dir}")
+                return
+
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                width, height = index["size"]
+                with open(image_path, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._atlas = Image.frombuffer('RGBA', (width, height), self._mmap, 'raw', 'RGBA', 0, 1)
+                self._sprites = {key: tuple(box) for key, box in index["sprites"].items()}
+                print(f"絵文字アトラスを読み込み: {len(self._sprites)}件 ({self.atlas_dir})")
+            except Exception as e:
+                print(f"絵文字アトラス読み込みエラー: {e}")
+                self._atlas = None
+                self._sprites = {}
+
+    @property
+    def available(self):
+        self._load()
+        return self._atlas is not None
+
+    def __len__(self):
+        self._load()
+        return len(self._sprites)
+
+    def find_key(self, emoji_text):
+        """アトラス内に存在するキーを返す（なければNone）"""
+        self._load()
+        for key in candidate_keys(emoji_text):
+            if key in self._sprites:
+                return key
+        return None
+
+    def get(self, emoji_text):
+        """絵文字スプライトをRGBA画像として返す（なければNone）"""
+        key = self.find_key(emoji_text)
+        if key is None:
+            return None
+        x, y, width, height = self._sprites[key]
+        # crop()は新しい画像を返すため、呼び出し側で自由に加工できる
+        return self._atlas.crop((x, y, x + width, y + height))
+
+
+def build_atlas(source_dir, output_dir=None, columns=None):
+    """twemojiのPNGアセットディレクトリからアトラスとインデックスを作成"""
+    output_dir = output_dir or DEFAULT_ATLAS_DIR
+    paths = sorted(glob.glob(os.path.join(source_dir, "*.png")))
+    if not paths:
+        raise FileNotFoundError(f"PNGアセットが見つかりません: {source_dir}")
+
+    sprites = []
+    cell_width = cell_height = 0
+    for path in paths:
+        key = os.path.splitext(os.path.basename(path))[0].lower()
+        with Image.open(path) as sprite:
+            sprite = sprite.convert('RGBA')
+        sprites.append((key, sprite))
+        cell_width = max(cell_width, sprite.width)
+        cell_height = max(cell_height, sprite.height)
+
+    if columns is None:
+        columns = math.ceil(math.sqrt(len(sprites)))
+    rows = math.ceil(len(sprites) / columns)
+    atlas = Image.new('RGBA', (columns * cell_width, rows * cell_height), (0, 0, 0, 0))
+
+    index = {}
+    for i, (key, sprite) in enumerate(sprites):
+        x = (i % columns) * cell_width
+        y = (i // columns) * cell_height
+        atlas.paste(sprite, (x, y))
+        index[key] = [x, y, sprite.width, sprite.height]
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, ATLAS_IMAGE_FILENAME), 'wb') as f:
+        f.write(atlas.tobytes())
+    with open(os.path.join(output_dir, ATLAS_INDEX_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({"size": list(atlas.size), "sprites": index}, f)
+
+    print(f"絵文字アトラスを作成しました: {len(index)}件, {atlas.size[0]}x{atlas.size[1]} -> {output_dir}")
+    return output_dir
+
+
+_atlas = None
+_atlas_lock = threading.Lock()
+
+
+def get_emoji_atlas():
+    """プロセス共通のEmojiAtlasを取得"""
+    global _atlas
+    if _atlas is None:
+        with _atlas_lock:
+            if _atlas is None:
+                _atlas = EmojiAtlas()
+    return _atlas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="絵文字スプライトアトラスの作成")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="twemojiアセットからアトラスを作成")
+    build_parser.add_argument("source_dir", help="twemojiのPNGディレクトリ（例: twemoji/assets/72x72）")
+    build_parser.add_argument("--output", default=None, help=f"出力ディレクトリ（デフォルト: {DEFAULT_ATLAS_DIR}）")
+    build_parser.add_argument("--columns", type=int, default=None, help="アトラスの列数")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_atlas(args.source_dir, args.output, args.columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+プロセス共通のフォントレジストリ
+
+フォントディレクトリを一度だけ走査してインデックス化し、
+読み込み済みの FreeTypeFont を (path, size, index) 単位でLRUキャッシュする。
+"""
+
+from PIL import ImageFont
+from collections import OrderedDict
+import fnmatch
+import os
+import threading
+import time
+
+
+class FontRegistry:
+    FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf')
+    DEFAULT_MAX_FONTS = 64
+    # ファイル名からカバーする文字体系を推定するパターン
+    CJK_FILE_PATTERNS = [
+        "NotoSansCJK*",
+        "NotoSans*CJK*",
+        "NotoSerifCJK*",
+        "Takao*",
+        "VLGothic*",
+        "IPAexGothic*",
+        "IPAGothic*",
+        "ヒラギノ*"
+    ]
+    EMOJI_FILE_PATTERNS = [
+        "*Emoji*",
+        "*emoji*"
+    ]
+
+    def __init__(self, search_dirs, max_fonts=None):
+        self.search_dirs = list(search_dirs)
+        self.max_fonts = max_fonts or int(os.getenv("FONT_CACHE_SIZE", self.DEFAULT_MAX_FONTS))
+        self._lock = threading.RLock()
+        # ディレクトリごとのフォントファイル一覧（ソート済み）
+        self._dir_index = {}
+        # フォントファイルごとのメタ情報（ファミリー名・文字体系）
+        self._files = {}
+        # os.path.exists の結果（インデックス外のパス用）
+        self._exists_cache = {}
+        # 読み込み可否の判定結果
+        self._loadable_cache = {}
+        # 役割（絵文字用・日本語用など）ごとに解決済みのフォントパス
+        self._resolved = {}
+        self._fonts = OrderedDict()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "index_time_ms": 0.0,
+            "load_time_ms": 0.0
+        }
+
+    def _classify_scripts(self, filename):
+        """ファイル名からカバーする文字体系を推定"""
+        if any(fnmatch.fnmatch(filename, pattern) for pattern in self.EMOJI_FILE_PATTERNS):
+            return ["emoji"]
+        if any(fnmatch.fnmatch(filename, pattern) for pattern in self.CJK_FILE_PATTERNS):
+            return ["cjk", "latin"]
+        return ["latin"]
+
+    def _index_dir(self, search_dir):
+        """ディレクトリを一度だけ走査してフォントファイルを記録"""
+        with self._lock:
+            if search_dir in self._dir_index:
+                return self._dir_index[search_dir]
+
+            start = time.perf_counter()
+            paths = []
+            if os.path.isdir(search_dir):
+                for root, dirs, files in os.walk(search_dir):
+                    for file in files:
+                        if file.lower().endswith(self.FONT_EXTENSIONS):
+                            path = os.path.join(root, file)
+                            paths.append(path)
+                            self._files[path] = {
+                                "family": os.path.splitext(file)[0].split('-')[0],
+                                "scripts": self._classify_scripts(file)
+                            }
+            paths.sort()
+            self._dir_index[search_dir] = paths
+            self._stats["index_time_ms"] += (time.perf_counter() - start) * 1000
+            return paths
+
+    def build_index(self):
+        """全検索ディレクトリのインデックスを構築（起動時のウォームアップ用）"""
+        for search_dir in self.search_dirs:
+            self._index_dir(search_dir)
+        print(f"フォントインデックス構築完了: {len(self._files)}ファイル ({self._stats['index_time_ms']:.1f}ms)")
+        return self
+
+    def _indexed_dir_for(self, path):
+        """パスを含むインデックス済み検索ディレクトリを返す"""
+        for search_dir in self.search_dirs:
+            if path.startswith(search_dir):
+                return search_dir
+        return None
+
+    def exists(self, path):
+        """フォントファイルの存在確認（インデックスまたはキャッシュで判定）"""
+        search_dir = self._indexed_dir_for(path)
+        if search_dir is not None:
+            self._index_dir(search_dir)
+            return path in self._files
+
+        with self._lock:
+            if path not in self._exists_cache:
+                self._exists_cache[path] = os.path.exists(path)
+            return self._exists_cache[path]
+
+    def glob(self, search_dir, pattern):
+        """インデックスから '**/名前パターン' 形式のパターンに一致するファイルを返す"""
+        name_pattern = pattern.rsplit('/', 1)[-1]
+        return [
+            path for path in self._index_dir(search_dir)
+            if fnmatch.fnmatch(os.path.basename(path), name_pattern)
+        ]
+
+    def fonts_for_script(self, script):
+        """指定の文字体系をカバーするフォントファイル一覧"""
+        self.build_index()
+        return [path for path, info in sorted(self._files.items()) if script in info["scripts"]]
+
+    def families(self):
+        """インデックス済みフォントのファミリー名一覧"""
+        return sorted({info["family"] for info in self._files.values()})
+
+    def is_loadable(self, path):
+        """フォントファイルがPillowで読み込めるか（結果はキャッシュ）"""
+        with self._lock:
+            if path in self._loadable_cache:
+                return self._loadable_cache[path]
+        try:
+            self.load(path, 12)
+            loadable = True
+        except Exception:
+            loadable = False
+        with self._lock:
+            self._loadable_cache[path] = loadable
+        return loadable
+
+    def resolve(self, key, finder):
+        """役割ごとのフォントパスを一度だけ解決してキャッシュ"""
+        with self._lock:
+            if key in self._resolved:
+                return self._resolved[key]
+        path = finder()
+        with self._lock:
+            self._resolved[key] = path
+        return path
+
+    def load(self, path, size, index=0):
+        """FreeTypeFontを取得（LRUキャッシュ）"""
+        cache_key = (path, size, index)
+        with self._lock:
+            font = self._fonts.get(cache_key)
+            if font is not None:
+                self._fonts.move_to_end(cache_key)
+                self._stats["hits"] += 1
+                return font
+            self._stats["misses"] += 1
+
+        start = time.perf_counter()
+        font = ImageFont.truetype(path, size, index=index)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._stats["load_time_ms"] += elapsed_ms
+            self._fonts[cache_key] = font
+            self._fonts.move_to_end(cache_key)
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+                self._stats["evictions"] += 1
+        return font
+
+    def stats(self):
+        """キャッシュ統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_fonts"] = len(self._fonts)
+            stats["max_fonts"] = self.max_fonts
+            stats["indexed_files"] = len(self._files)
+            stats["resolved_roles"] = len(self._resolved)
+            return stats
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_font_registry(search_dirs=None):
+    """プロセス共通のFontRegistryを取得（初回呼び出し時に作成）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                if search_dirs is None:
+                    search_dirs = [
+                        "/usr/share/fonts/",
+                        "/usr/local/share/fonts/",
+                        "/System/Library/Fonts/",
+                        os.path.expanduser("~/.fonts/")
+                    ]
+                _registry = FontRegistry(search_dirs)
+    return _registry
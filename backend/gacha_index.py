@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+ガチャ画像のインデックス
+
+起動時に hirsakam_gacha_image/* を走査してレアリティごとのファイル一覧（メディアタイプ・サイズ・内容のハッシュによるETag）を作り、
+/gacha・/gacha-ten の抽選はメモリ上の一覧と事前計算した累積確率の配列だけで行う（抽選ごとのファイルシステム走査なし）。
+画像の追加・削除は定期的なポーリングで検出してインデックスを作り直す。
+
+環境変数:
+    GACHA_IMAGE_DIR       ガチャ画像のディレクトリ（デフォルト: ../hirsakam_gacha_image）
+    GACHA_POLL_INTERVAL   変更を確認する間隔（秒、デフォルト: 10）。0 の場合は起動時のみ
+"""
+
+import bisect
+import itertools
+import os
+import random
+import threading
+import time
+from asset_server import content_etag, etag_version
+
+# レアリティ -> 画像ディレクトリ
+GACHA_RARITY_DIRS = {
+    'N': 'normal',
+    'R': 'rare',
+    'SR': 'super_rare',
+    'SSR': 'special_super_rare'
+}
+
+# ガチャ確率設定
+GACHA_PROBABILITIES = {
+    'N': 0.50,    # 50%
+    'R': 0.30,    # 30%
+    'SR': 0.17,   # 17%
+    'SSR': 0.03   # 3%
+}
+
+# 10連の最後の1枚用の確率設定（SR以上確定）
+GACHA_GUARANTEED_PROBABILITIES = {
+    'SR': 0.90,   # 90%
+    'SSR': 0.10   # 10%
+}
+
+GACHA_MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif'
+}
+
+
+class GachaAssetsMissingError(Exception):
+    """抽選されたレアリティの画像がない"""
+
+
+class GachaAsset:
+    """インデックス済みのガチャ画像"""
+
+    def __init__(self, rarity_dir, filename, path, stat):
+        self.rarity_dir = rarity_dir
+        self.filename = filename
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.media_type = GACHA_MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream')
+        # 内容のハッシュ（ファイルが変わらない限り再計算しない）
+        self.etag = content_etag(path, stat)
+
+    @property
+    def url(self):
+        """内容で決まるURL（画像が差し替えられると ?v= が変わるため、ブラウザは immutable としてキャッシュできる）"""
+        return f"/gacha-image/{self.rarity_dir}/{self.filename}?v={etag_version(self.etag)}"
+
+    def result(self, rarity):
+        """/gacha のレスポンス形式"""
+        return {
+            "rarity": rarity,
+            "image_url": self.url,
+            "filename": self.filename
+        }
+
+
+class RarityTable:
+    """確率設定から事前計算した累積確率の配列（抽選は二分探索のみ）"""
+
+    def __init__(self, probabilities):
+        self.rarities = list(probabilities)
+        self.cumulative = list(itertools.accumulate(probabilities.values()))
+
+    def draw(self, rand=None):
+        """レアリティを抽選（従来どおり rand <= 累積確率 となる最初のレアリティ）"""
+        if rand is None:
+            rand = random.random()
+        index = bisect.bisect_left(self.cumulative, rand)
+        # 確率の合計が浮動小数点誤差で1未満の場合は最後のレアリティ
+        return self.rarities[min(index, len(self.rarities) - 1)]
+
+
+GACHA_TABLE = RarityTable(GACHA_PROBABILITIES)
+GACHA_GUARANTEED_TABLE = RarityTable(GACHA_GUARANTEED_PROBABILITIES)
+
+
+class GachaIndex:
+    DEFAULT_POLL_INTERVAL = 10
+    # 未登録の画像のリクエストで作り直す最短間隔（秒）。同じリクエストが続いても走査は間隔ごとに1回だけ
+    LOOKUP_REFRESH_INTERVAL = 1.0
+
+    def __init__(self, image_dir=None, poll_interval=None):
+        self.image_dir = image_dir or os.getenv("GACHA_IMAGE_DIR") or os.path.join("..", "hirsakam_gacha_image")
+        self.poll_interval = float(poll_interval if poll_interval is not None
+                                   else os.getenv("GACHA_POLL_INTERVAL", self.DEFAULT_POLL_INTERVAL))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        # 抽選側はロックを取らずに参照するため、作り直したインデックスは丸ごと差し替える
+        self._assets = {}
+        self._by_name = {}
+        self._signature = None
+        self._last_lookup_refresh = None
+        self._stats = {
+            "draws": 0,
+            "refreshes": 0,
+            "last_refresh_ms": 0.0
+        }
+        self.refresh()
+
+    def _scan(self):
+        """画像ディレクトリを走査してレアリティディレクトリごとの一覧を作成"""
+        assets = {}
+        for rarity_dir in GACHA_RARITY_DIRS.values():
+            directory = os.path.join(self.image_dir, rarity_dir)
+            entries = []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if os.path.splitext(entry.name)[1].lower() not in GACHA_MEDIA_TYPES or not entry.is_file():
+                            continue
+                        entries.append(GachaAsset(rarity_dir, entry.name, entry.path, entry.stat()))
+            except FileNotFoundError:
+                pass
+            assets[rarity_dir] = tuple(sorted(entries, key=lambda asset: asset.filename))
+        return assets
+
+    def refresh(self):
+        """インデックスを作り直す（内容が変わった場合のみ差し替え、戻り値は変更の有無）"""
+        start = time.perf_counter()
+        assets = self._scan()
+        signature = tuple(
+            (asset.rarity_dir, asset.filename, asset.size, asset.mtime_ns)
+            for entries in assets.values() for asset in entries
+        )
+        with self._lock:
+            changed = signature != self._signature
+            if changed:
+                self._assets = assets
+                self._by_name = {(asset.rarity_dir, asset.filename): asset for entries in assets.values() for asset in entries}
+                self._signature = signature
+                self._stats["refreshes"] += 1
+            self._stats["last_refresh_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return changed
+
+    def draw(self, table=GACHA_TABLE):
+        """レアリティを抽選し、その中から画像を1枚選ぶ（ファイルシステムにはアクセスしない）"""
+        rarity = table.draw()
+        rarity_dir = GACHA_RARITY_DIRS[rarity]
+        assets = self._assets.get(rarity_dir)
+        if not assets:
+            raise GachaAssetsMissingError(f"ガチャ画像が見つかりません: {os.path.join(self.image_dir, rarity_dir)}")
+        with self._lock:
+            self._stats["draws"] += 1
+        return random.choice(assets).result(rarity)
+
+    def _lookup_refresh_due(self):
+        """未登録の画像のリクエストで作り直してよいか（最短間隔ごとに1回）"""
+        now = time.monotonic()
+        with self._lock:
+            if self._last_lookup_refresh is not None and now - self._last_lookup_refresh < self.LOOKUP_REFRESH_INTERVAL:
+                return False
+            self._last_lookup_refresh = now
+            return True
+
+    def lookup(self, rarity_dir, filename):
+        """
+        インデックス済みの画像を返す（ポーリング前に追加された画像はその場で作り直して探す）
+        作り直すのは対応している拡張子の場合のみで、最短間隔内は繰り返さない
+        """
+        asset = self._by_name.get((rarity_dir, filename))
+        if (asset is None
+                and os.path.splitext(filename)[1].lower() in GACHA_MEDIA_TYPES
+                and os.path.isfile(os.path.join(self.image_dir, rarity_dir, filename))
+                and self._lookup_refresh_due()):
+            self.refresh()
+            asset = self._by_name.get((rarity_dir, filename))
+        return asset
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self.refresh():
+                    print(f"ガチャ画像インデックスを更新しました: {self.image_dir}")
+            except Exception as e:
+                print(f"ガチャ画像インデックス更新エラー: {e}")
+
+    def start_watcher(self):
+        """画像ディレクトリの変更を定期的に確認するスレッドを開始"""
+        if self._watcher is None and self.poll_interval > 0:
+            self._watcher = threading.Thread(target=self._watch_loop, name="gacha-index", daemon=True)
+            self._watcher.start()
+        return self._watcher
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def stats(self):
+        """インデックス統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["assets"] = {rarity_dir: len(assets) for rarity_dir, assets in self._assets.items()}
+        stats["poll_interval"] = self.poll_interval
+        return stats
+
+
+_gacha_index = None
+_gacha_index_lock = threading.Lock()
+
+
+def get_gacha_index(image_dir=None):
+    """プロセス共通のGachaIndexを取得"""
+    global _gacha_index
+    if _gacha_index is None:
+        with _gacha_index_lock:
+            if _gacha_index is None:
+                _gacha_index = GachaIndex(image_dir)
+    return _gacha_index
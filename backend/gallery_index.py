@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+生成済み画像のギャラリーインデックス（SQLite）
+
+/generate が画像を書き出すたびにインデックスへ追加し、/gallery はインデックスへの
+範囲クエリで一覧を返す。ファイルの手動削除・追加などで生じたずれは定期的な
+突き合わせ（reconcile）でファイルシステムに合わせる。
+
+環境変数:
+    GALLERY_INDEX_PATH           インデックスの保存先（デフォルト: ../output/.gallery_index.sqlite3）
+    GALLERY_RECONCILE_INTERVAL   突き合わせの間隔（秒、デフォルト: 300）。0 の場合は起動時のみ
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+GALLERY_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.avif')
+
+
+class InvalidCursorError(ValueError):
+    """ページングカーソルが不正"""
+
+
+class GalleryIndex:
+    DEFAULT_RECONCILE_INTERVAL = 300
+
+    def __init__(self, output_dir, db_path=None, reconcile_interval=None):
+        self.output_dir = output_dir
+        self.db_path = db_path or os.getenv("GALLERY_INDEX_PATH") or os.path.join(output_dir, ".gallery_index.sqlite3")
+        self.reconcile_interval = int(reconcile_interval if reconcile_interval is not None
+                                      else os.getenv("GALLERY_RECONCILE_INTERVAL", self.DEFAULT_RECONCILE_INTERVAL))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reconciler = None
+        self._stats = {
+            "reconciles": 0,
+            "reconcile_added": 0,
+            "reconcile_removed": 0,
+            "last_reconcile_ms": 0.0
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # 複数スレッド・複数ワーカープロセスから利用するため、接続はロックで保護しWALモードにする
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                " filename TEXT PRIMARY KEY,"
+                " created_at REAL NOT NULL,"
+                " size INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS images_created_at ON images (created_at, filename)")
+
+    def add(self, filename, created_at=None, size=None):
+        """画像をインデックスに追加（作成時刻・サイズ未指定時はファイルから取得）"""
+        if created_at is None or size is None:
+            stat = os.stat(os.path.join(self.output_dir, filename))
+            created_at = stat.st_ctime if created_at is None else created_at
+            size = stat.st_size if size is None else size
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (filename, created_at, size) VALUES (?, ?, ?)",
+                (filename, created_at, size)
+            )
+
+    def remove(self, filename):
+        """画像をインデックスから削除"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM images WHERE filename = ?", (filename,))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    @staticmethod
+    def encode_cursor(created_at, filename):
+        """ページの末尾要素から次ページ用のカーソルを作成"""
+        payload = json.dumps([created_at, filename]).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, filename = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return float(created_at), str(filename)
+        except Exception:
+            raise InvalidCursorError(f"不正なカーソルです: {cursor}")
+
+    def page(self, sort="desc", limit=20, offset=0, cursor=None):
+        """
+        一覧の1ページ分を取得
+        Returns:
+            (ファイル名のリスト, 次ページのカーソル（最終ページならNone）)
+        """
+        descending = sort.lower() != "asc"
+        order = "DESC" if descending else "ASC"
+        query = "SELECT filename, created_at FROM images"
+        params = []
+        if cursor:
+            # (created_at, filename) の複合キーで位置を決めるため、途中で画像が増えてもずれない
+            created_at, filename = self.decode_cursor(cursor)
+            query += " WHERE (created_at, filename) " + ("<" if descending else ">") + " (?, ?)"
+            params.extend([created_at, filename])
+            offset = 0
+        query += f" ORDER BY created_at {order}, filename {order} LIMIT ? OFFSET ?"
+        params.extend([limit + 1, offset])
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1][1], rows[-1][0])
+        return [filename for filename, created_at in rows], next_cursor
+
+    def reconcile(self):
+        """インデックスを出力ディレクトリの内容に合わせる（追加・削除された画像を反映）"""
+        start = time.perf_counter()
+        # 走査中に生成・登録された画像を削除対象にしないよう、インデックスを先に読む
+        with self._lock:
+            indexed = {row[0] for row in self._conn.execute("SELECT filename FROM images")}
+
+        on_disk = set()
+        if os.path.isdir(self.output_dir):
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith(GALLERY_EXTENSIONS) and entry.is_file():
+                        on_disk.add(entry.name)
+
+        added = []
+        for filename in on_disk - indexed:
+            try:
+                stat = os.stat(os.path.join(self.output_dir, filename))
+            except OSError:
+                continue
+            added.append((filename, stat.st_ctime, stat.st_size))
+        # 削除の直前にもう一度存在を確かめる（走査後に書き込まれた画像を消さない）
+        removed = [(filename,) for filename in indexed - on_disk
+                   if not os.path.exists(os.path.join(self.output_dir, filename))]
+
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO images (filename, created_at, size) VALUES (?, ?, ?)", added)
+            self._conn.executemany("DELETE FROM images WHERE filename = ?", removed)
+            self._stats["reconciles"] += 1
+            self._stats["reconcile_added"] += len(added)
+            self._stats["reconcile_removed"] += len(removed)
+            self._stats["last_reconcile_ms"] = (time.perf_counter() - start) * 1000
+
+        if added or removed:
+            print(f"ギャラリーインデックスを更新: 追加{len(added)}件, 削除{len(removed)}件")
+        return len(added), len(removed)
+
+    def _reconcile_loop(self):
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"ギャラリーインデックスの突き合わせエラー: {e}")
+            if self.reconcile_interval <= 0 or self._stop.wait(self.reconcile_interval):
+                return
+
+    def start_reconciler(self):
+        """起動時の突き合わせと定期的な突き合わせをバックグラウンドで開始"""
+        if self._reconciler is None:
+            self._reconciler = threading.Thread(target=self._reconcile_loop, name="gallery-reconcile", daemon=True)
+            self._reconciler.start()
+        return self._reconciler
+
+    def stop_reconciler(self):
+        self._stop.set()
+
+    def stats(self):
+        """インデックス統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["images"] = self.count()
+        stats["db_path"] = self.db_path
+        return stats
+
+
+_gallery_index = None
+_gallery_index_lock = threading.Lock()
+
+
+def get_gallery_index(output_dir=None):
+    """プロセス共通のGalleryIndexを取得"""
+    global _gallery_index
+    if _gallery_index is None:
+        with _gallery_index_lock:
+            if _gallery_index is None:
+                _gallery_index = GalleryIndex(output_dir or os.path.join("..", "output"))
+    return _gallery_index
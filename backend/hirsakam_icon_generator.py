@@ -3,19 +3,57 @@
 Hirsakam コラ画像ジェネレーター
 """
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import copy
+import hashlib
+import json
+import multiprocessing
 import os
 import sys
+import time
 import emoji
 import requests
 from io import BytesIO
-import glob
-try:
-    from rembg import remove
-    REMBG_AVAILABLE = True
-except ImportError:
-    REMBG_AVAILABLE = False
-    print("Warning: rembg library not available. Background removal feature will be disabled.")
+from font_registry import get_font_registry
+from emoji_atlas import get_emoji_atlas, emoji_sequence_key, twemoji_key
+from lru_cache import BoundedLRUCache, image_nbytes
+from output_formats import OutputFormat, format_for_path, get_output_format
+from background_removal import REMBG_AVAILABLE, remove_background_bytes
+
+# 変形済み絵文字スプライトのキャッシュ（絵文字・サイズ・回転・反転ごと、プロセス共通）
+emoji_sprite_cache = BoundedLRUCache(int(os.getenv("EMOJI_SPRITE_CACHE_BYTES", 32 * 1024 * 1024)))
+# デコード済みベース画像（RGBA）のキャッシュ（パス・更新時刻・サイズごと、プロセス共通）
+base_image_cache = BoundedLRUCache(int(os.getenv("BASE_IMAGE_CACHE_BYTES", 64 * 1024 * 1024)))
+# リモートから取得できなかった絵文字（一定時間は再取得しない、プロセス共通）
+emoji_remote_miss_cache = BoundedLRUCache(64 * 1024, size_of=lambda miss: 64,
+                                          ttl=float(os.getenv("EMOJI_REMOTE_MISS_TTL", "600")))
+# デコード・リサイズ済みのオーバーレイ／描画画像のキャッシュ（内容・サイズ・フィルターごと、プロセス共通）
+# ドラッグ中のプレビューなど、同じ画像で繰り返し合成する場合にデコードとリサイズを省く
+layer_image_cache = BoundedLRUCache(int(os.getenv("LAYER_IMAGE_CACHE_BYTES", 64 * 1024 * 1024)))
+# テキストの計測結果（テキスト・フォントごと）と描画・回転済みのテキストスプライト（色・回転ごと）のキャッシュ（プロセス共通）
+text_layout_cache = BoundedLRUCache(int(os.getenv("TEXT_LAYOUT_CACHE_BYTES", 1024 * 1024)),
+                                    size_of=lambda layout: layout.nbytes)
+text_sprite_cache = BoundedLRUCache(int(os.getenv("TEXT_SPRITE_CACHE_BYTES", 32 * 1024 * 1024)),
+                                    size_of=lambda sprite: image_nbytes(sprite[0]))
+
+
+class TextLayout:
+    """複数行テキストの計測結果"""
+
+    def __init__(self, lines, line_height, line_widths, max_width, total_height):
+        self.lines = lines
+        self.line_height = line_height
+        self.line_widths = line_widths
+        self.max_width = max_width
+        self.total_height = total_height
+
+    @property
+    def nbytes(self):
+        """おおよそのメモリ使用量（バイト）"""
+        return 256 + sum(len(line.encode('utf-8')) + 64 for line in self.lines)
+
 
 class HirsakamGenerator:
     # 設定定数
@@ -26,18 +64,43 @@ class HirsakamGenerator:
     LINE_HEIGHT_RATIO = 1.2
     IMAGE_QUALITY = 95
     OUTLINE_WIDTH = 2
+    # テキストの縁取りの最大幅（スプライトの余白 OVERLAY_PADDING に収まる範囲）
+    MAX_STROKE_WIDTH = 20
     TRANSPARENT_ALPHA_THRESHOLD = 128
     BACKGROUND_ALPHA_THRESHOLD = 32
     TEXT_CANVAS_PADDING = 100
     OVERLAY_PADDING = 50
+    # アトラスにない絵文字のダウンロード（auto: アトラスが読み込めない場合のみ、1: 常に、0: 無効）
+    EMOJI_REMOTE_FALLBACK = os.getenv("EMOJI_REMOTE_FALLBACK", "auto").lower()
+    EMOJI_REMOTE_TIMEOUT = float(os.getenv("EMOJI_REMOTE_TIMEOUT", "0.8"))
+    # 最終出力のリサイズに使うフィルター
+    RESAMPLE = Image.Resampling.LANCZOS
+    # プレビュー（ドラッグ中などの低遅延表示）用の設定
+    PREVIEW_SCALE = float(os.getenv("PREVIEW_SCALE", "0.5"))
+    PREVIEW_RESAMPLE = Image.Resampling.BILINEAR
+    # 大きく縮小する場合は先に整数倍の縮小（reduce）を行って高速化する
+    PREVIEW_REDUCING_GAP = 1.0
+    PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "70"))
+    # プレビューは出力形式の速度優先プリセットでエンコードする
+    PREVIEW_PRESET = "speed"
     UNICODE_RANGES = {
         'HIRAGANA': (0x3040, 0x309F),
         'KATAKANA': (0x30A0, 0x30FF),
         'KANJI': (0x4E00, 0x9FAF),
         'FULLWIDTH': (0xFF00, 0xFFEF)
     }
-    def __init__(self, base_image_path="hirsakam.jpg"):
+    def __init__(self, base_image_path="hirsakam.jpg", cache_base_image=True, transparent=False):
         self.base_image_path = base_image_path
+        # 一度しか使わないベース画像（アップロード画像など）はキャッシュしない
+        self.cache_base_image = cache_base_image
+        # Trueの場合はベース画像の透過を保ったまま合成し、透過対応の形式（PNG・WebPなど）ではRGBAのまま出力する
+        self.transparent = transparent
+        self.resample = self.RESAMPLE
+        self.reducing_gap = None
+        # 直近の合成で失敗したレイヤー（失敗を含む結果はキャッシュしないため）
+        self.render_errors = []
+        # バッチ合成中に共有するデコード済みのベース画像（render_batch参照）
+        self._batch_base_canvas = None
         # 猫の顔の中心位置（画像を精密に測定）
         self.face_center = (260, 143)
         
@@ -94,7 +157,9 @@ class HirsakamGenerator:
         ]
     
     def load_base_image(self):
-        """ベース画像を読み込む"""
+        """ベース画像を読み込む（base_image_path はファイルパスまたは画像のバイト列）"""
+        if isinstance(self.base_image_path, (bytes, bytearray)):
+            return Image.open(BytesIO(self.base_image_path))
         if not os.path.exists(self.base_image_path):
             raise FileNotFoundError(f"ベース画像 {self.base_image_path} が見つかりません")
         return Image.open(self.base_image_path)
@@ -123,48 +188,34 @@ class HirsakamGenerator:
             text = unicodedata.normalize('NFC', text)
         except Exception as e:
             print(f"フォント選択時のテキスト正規化エラー: {e}")
+        
+        registry = get_font_registry(self.FONT_SEARCH_DIRS)
             
         if is_emoji:
-            for font_path in self.EMOJI_FONT_PATHS:
-                try:
-                    if os.path.exists(font_path):
-                        print(f"絵文字フォント見つかりました: {font_path}")
-                        font = ImageFont.truetype(font_path, font_size)
-                        # フォントのエンコーディングを確認
-                        try:
-                            font.getsize("test")  # テスト文字列でフォントが使用可能か確認
-                        except:
-                            pass
-                        return font
-                except Exception as e:
-                    continue
+            font_path = registry.resolve(
+                ('emoji', tuple(self.EMOJI_FONT_PATHS)),
+                lambda: self._first_loadable_font(self.EMOJI_FONT_PATHS, "絵文字フォント")
+            )
+            if font_path:
+                return registry.load(font_path, font_size)
             
             print("Warning: 絵文字フォントが見つかりません。テキストフォントを使用します。")
         
         # 日本語テキストの場合は日本語フォントを強制検索
         if self._contains_japanese(text):
-            print("日本語テキストを検出。日本語フォントを優先検索します。")
             japanese_font = self._find_japanese_font(font_size)
             if japanese_font:
                 return japanese_font
             print("Warning: 日本語フォントが見つかりません。汎用フォントを使用します。")
         
-        for font_path in self.TEXT_FONT_PATHS:
-            try:
-                if os.path.exists(font_path):
-                    print(f"テキストフォント見つかりました: {font_path}")
-                    font = ImageFont.truetype(font_path, font_size)
-                    # フォントのエンコーディングを確認
-                    try:
-                        font.getsize("test")  # テスト文字列でフォントが使用可能か確認
-                    except:
-                        pass
-                    return font
-            except Exception as e:
-                continue
+        font_path = registry.resolve(
+            ('text', tuple(self.TEXT_FONT_PATHS)),
+            lambda: self._first_loadable_font(self.TEXT_FONT_PATHS, "テキストフォント")
+        )
+        if font_path:
+            return registry.load(font_path, font_size)
         
         # 動的フォント検索を試行
-        print("指定フォントが見つかりません。システムフォントを検索中...")
         dynamic_font = self._find_system_font(font_size)
         if dynamic_font:
             return dynamic_font
@@ -174,24 +225,35 @@ class HirsakamGenerator:
         self._print_font_diagnostics()
         return ImageFont.load_default()
     
+    def _first_loadable_font(self, font_paths, label):
+        """候補パスのうち最初に読み込めるフォントのパスを返す"""
+        registry = get_font_registry(self.FONT_SEARCH_DIRS)
+        for font_path in font_paths:
+            if registry.exists(font_path) and registry.is_loadable(font_path):
+                print(f"{label}見つかりました: {font_path}")
+                return font_path
+        return None
+    
+    def _first_loadable_match(self, patterns, label):
+        """検索ディレクトリ内でパターンに一致し、最初に読み込めるフォントのパスを返す"""
+        registry = get_font_registry(self.FONT_SEARCH_DIRS)
+        for search_dir in self.FONT_SEARCH_DIRS:
+            for pattern in patterns:
+                for match in registry.glob(search_dir, pattern):
+                    if registry.is_loadable(match):
+                        print(f"{label}: {match}")
+                        return match
+        return None
+    
     def _find_japanese_font(self, font_size):
         """日本語対応フォントを優先的に検索"""
-        for search_dir in self.FONT_SEARCH_DIRS:
-            if not os.path.exists(search_dir):
-                continue
-                
-            for pattern in self.JAPANESE_FONT_PATTERNS:
-                font_path = os.path.join(search_dir, pattern)
-                matches = glob.glob(font_path, recursive=True)
-                
-                for match in matches:
-                    try:
-                        font = ImageFont.truetype(match, font_size)
-                        print(f"日本語フォント見つかりました: {match}")
-                        return font
-                    except Exception as e:
-                        continue
-        
+        registry = get_font_registry(self.FONT_SEARCH_DIRS)
+        font_path = registry.resolve(
+            ('japanese', tuple(self.FONT_SEARCH_DIRS), tuple(self.JAPANESE_FONT_PATTERNS)),
+            lambda: self._first_loadable_match(self.JAPANESE_FONT_PATTERNS, "日本語フォント見つかりました")
+        )
+        if font_path:
+            return registry.load(font_path, font_size)
         return None
     
     def _print_font_diagnostics(self):
@@ -246,24 +308,33 @@ class HirsakamGenerator:
             "**/*.ttc"
         ]
         
-        for search_dir in self.FONT_SEARCH_DIRS:
-            if not os.path.exists(search_dir):
-                continue
-                
-            for pattern in font_patterns:
-                font_path = os.path.join(search_dir, pattern)
-                matches = glob.glob(font_path, recursive=True)
-                
-                for match in matches:
-                    try:
-                        font = ImageFont.truetype(match, font_size)
-                        print(f"動的検索で見つかったフォント: {match}")
-                        return font
-                    except Exception as e:
-                        continue
+        registry = get_font_registry(self.FONT_SEARCH_DIRS)
+        font_path = registry.resolve(
+            ('system', tuple(self.FONT_SEARCH_DIRS)),
+            lambda: self._first_loadable_match(font_patterns, "動的検索で見つかったフォント")
+        )
+        if font_path:
+            return registry.load(font_path, font_size)
         
         return None
     
+    def _paste_rgba(self, image, sprite, position):
+        """
+        RGBA画像を合成する
+        透過出力ではアルファを正しく重ねる（paste はアルファチャンネルも補間するため、不透明なベース画像でも
+        半透明の縁が透けてしまう）。通常の出力は最後にRGB化するため従来どおり paste を使う
+        """
+        if not self.transparent:
+            image.paste(sprite, position, sprite)
+            return image
+        x, y = position
+        # alpha_composite は負の座標を受け付けないため、はみ出す部分を切り取ってから重ねる
+        left, top = max(0, -x), max(0, -y)
+        right, bottom = min(sprite.width, image.width - x), min(sprite.height, image.height - y)
+        if left < right and top < bottom:
+            image.alpha_composite(sprite.crop((left, top, right, bottom)), dest=(x + left, y + top))
+        return image
+    
     def _apply_transforms(self, image, rotation, flip_horizontal, element_type="overlay"):
         """画像に回転と左右反転を適用する共通関数"""
         if rotation != 0:
@@ -361,15 +432,9 @@ class HirsakamGenerator:
                 
             current_y = y + (i * line_height)
             
-            # テキストの境界線を描画（ASCII文字のみ）
-            if not any(ord(char) > 127 for char in line):
-                for dx in range(-self.OUTLINE_WIDTH, self.OUTLINE_WIDTH + 1):
-                    for dy in range(-self.OUTLINE_WIDTH, self.OUTLINE_WIDTH + 1):
-                        if dx != 0 or dy != 0:
-                            draw.text((x + dx, current_y + dy), line, font=font, fill=self.DEFAULT_BACKGROUND_COLOR)
-            
-            # メインテキストを描画
-            draw.text((x, current_y), line, font=font, fill=color)
+            # テキストを境界線（FreeTypeのストローク）付きで描画
+            draw.text((x, current_y), line, font=font, fill=color,
+                      stroke_width=self.OUTLINE_WIDTH, stroke_fill=self.DEFAULT_BACKGROUND_COLOR)
         
         return image
     
@@ -419,20 +484,96 @@ class HirsakamGenerator:
                 draw.text(position, emoji_text, font=font, fill=(255, 255, 255))
                 return image
     
-    def download_emoji_image(self, emoji_char, size=128):
-        """絵文字画像をTwitchから取得する"""
+    def _emoji_remote_fallback_enabled(self):
+        """twemojiからのダウンロードを試すか（auto の場合はアトラスを作成していない環境のみ）"""
+        if self.EMOJI_REMOTE_FALLBACK == "auto":
+            return not get_emoji_atlas().available
+        return self.EMOJI_REMOTE_FALLBACK == "1"
+    
+    def fetch_emoji_sprite(self, emoji_char):
+        """絵文字のスプライト画像を取得する（ローカルアトラス優先、リモートはフォールバック）"""
+        # ローカルアトラスから取得（メモリ上で完結）
+        emoji_img = get_emoji_atlas().get(emoji_char)
+        if emoji_img is not None:
+            return emoji_img
+        
+        if not self._emoji_remote_fallback_enabled():
+            print(f"絵文字がローカルアトラスにありません: {emoji_char}")
+            return None
+        
+        # twemojiのファイル名のキー（ZWJ・肌色・国旗などの複数コードポイントにも対応）で1回だけ取得を試す
+        hex_code = twemoji_key(emoji_char)
+        if emoji_remote_miss_cache.get(hex_code) is not None:
+            return None
+        url = f"https://raw.githubusercontent.com/twitter/twemoji/master/assets/72x72/{hex_code}.png"
         try:
-            # 絵文字のUnicodeコードポイントを取得
-            codepoint = ord(emoji_char)
-            hex_code = f"{codepoint:x}"
-            
-            # Twitch絵文字APIを使用
-            url = f"https://raw.githubusercontent.com/twitter/twemoji/master/assets/72x72/{hex_code}.png"
-            
-            response = requests.get(url, timeout=10)
+            response = requests.get(url, timeout=self.EMOJI_REMOTE_TIMEOUT)
             if response.status_code == 200:
-                emoji_img = Image.open(BytesIO(response.content))
-                print(f"ダウンロードした絵文字: {emoji_char}, モード: {emoji_img.mode}, サイズ: {emoji_img.size}")
+                return Image.open(BytesIO(response.content))
+            print(f"絵文字画像の取得に失敗: {url} ({response.status_code})")
+        except requests.RequestException as e:
+            print(f"絵文字画像の取得に失敗: {url} ({e})")
+        # 取得できなかった絵文字は一定時間ネットワークに問い合わせない
+        emoji_remote_miss_cache.put(hex_code, True)
+        return None
+    
+    def _detect_transparent_background_color(self, image):
+        """完全透明ピクセルで最も多いRGB値を背景色として検出する"""
+        colors = image.getcolors(image.width * image.height)
+        transparent_colors = [(count, color[:3]) for count, color in colors if color[3] == 0]
+        if not transparent_colors:
+            return None
+        
+        max_count = max(count for count, _ in transparent_colors)
+        candidates = {color for count, color in transparent_colors if count == max_count}
+        if len(candidates) == 1:
+            background_color = candidates.pop()
+        else:
+            # 同数の場合は走査順で最初に現れた色を採用（従来の辞書順と同じ結果）
+            pixels = image.load()
+            background_color = next(
+                pixels[x, y][:3]
+                for y in range(image.height) for x in range(image.width)
+                if pixels[x, y][3] == 0 and pixels[x, y][:3] in candidates
+            )
+        print(f"検出された背景色: RGB{background_color}, 出現回数: {max_count}")
+        return background_color
+    
+    def _apply_binary_alpha(self, image, background_mask):
+        """背景マスク（255=背景）の画素を(0,0,0,0)、それ以外をアルファ255にする"""
+        opaque_mask = ImageChops.invert(background_mask)
+        rgb = Image.composite(image.convert('RGB'), Image.new('RGB', image.size, (0, 0, 0)), opaque_mask)
+        rgb.putalpha(opaque_mask)
+        return rgb
+    
+    def _clean_emoji_background(self, image):
+        """背景色とほぼ透明なピクセルを完全透明にし、残りを不透明にする"""
+        background_color = self._detect_transparent_background_color(image)
+        
+        # ほぼ透明（完全透明を含む）なピクセル
+        threshold = self.BACKGROUND_ALPHA_THRESHOLD
+        background_mask = image.getchannel('A').point(lambda a: 255 if a < threshold else 0)
+        
+        # 背景色と一致するピクセル
+        if background_color:
+            difference = ImageChops.difference(image.convert('RGB'), Image.new('RGB', image.size, background_color))
+            channel_max = ImageChops.lighter(ImageChops.lighter(difference.getchannel(0), difference.getchannel(1)), difference.getchannel(2))
+            color_mask = channel_max.point(lambda v: 255 if v == 0 else 0)
+            background_mask = ImageChops.lighter(background_mask, color_mask)
+        
+        return self._apply_binary_alpha(image, background_mask)
+    
+    def _binarize_alpha(self, image, threshold):
+        """アルファ値がしきい値未満のピクセルを完全透明に、それ以外を不透明にする"""
+        background_mask = image.getchannel('A').point(lambda a: 255 if a < threshold else 0)
+        return self._apply_binary_alpha(image, background_mask)
+    
+    def download_emoji_image(self, emoji_char, size=128):
+        """絵文字画像を取得して透明性を整える"""
+        try:
+            emoji_img = self.fetch_emoji_sprite(emoji_char)
+            if emoji_img is not None:
+                print(f"取得した絵文字: {emoji_char}, モード: {emoji_img.mode}, サイズ: {emoji_img.size}")
                 
                 # 常にRGBAモードに変換
                 if emoji_img.mode != 'RGBA':
@@ -440,68 +581,20 @@ class HirsakamGenerator:
                     print(f"RGBAモードに変換: {emoji_img.mode}")
                 
                 # 透明性の処理（背景を透明にする）
-                emoji_array = list(emoji_img.getdata())
-                cleaned_data = []
-                
-                # 最も多い透明ピクセルの色を背景色として検出
-                transparent_colors = {}
-                for pixel in emoji_array:
-                    r, g, b, a = pixel
-                    if a == 0:  # 完全透明
-                        color_key = (r, g, b)
-                        transparent_colors[color_key] = transparent_colors.get(color_key, 0) + 1
-                
-                # 最も多い透明色を背景色とする
-                background_color = None
-                if transparent_colors:
-                    background_color = max(transparent_colors.items(), key=lambda x: x[1])[0]
-                    print(f"検出された背景色: RGB{background_color}, 出現回数: {transparent_colors[background_color]}")
-                
-                for pixel in emoji_array:
-                    r, g, b, a = pixel
-                    
-                    # 背景色またはほぼ透明なピクセルを除去
-                    is_background = (
-                        a == 0 or  # 完全透明
-                        (background_color and (r, g, b) == background_color) or  # 背景色
-                        a < self.BACKGROUND_ALPHA_THRESHOLD  # ほぼ透明
-                    )
-                    
-                    if is_background:
-                        # 背景は完全透明
-                        cleaned_data.append((0, 0, 0, 0))
-                    else:
-                        # 絵文字部分は不透明
-                        cleaned_data.append((r, g, b, 255))
-                
-                emoji_img.putdata(cleaned_data)
+                emoji_img = self._clean_emoji_background(emoji_img)
                 
                 # サイズを調整（透明性処理後）
-                emoji_img = emoji_img.resize((size, size), Image.Resampling.LANCZOS)
+                emoji_img = emoji_img.resize((size, size), self.resample, reducing_gap=self.reducing_gap)
                 
                 # リサイズ後に再度透明性を修正（リサイズで中間値が生じるため）
-                resized_array = list(emoji_img.getdata())
-                final_data = []
-                
-                for pixel in resized_array:
-                    r, g, b, a = pixel
-                    # アルファ値が低い場合は完全透明に
-                    if a < self.TRANSPARENT_ALPHA_THRESHOLD:
-                        final_data.append((0, 0, 0, 0))
-                    else:
-                        # 絵文字部分は完全不透明に
-                        final_data.append((r, g, b, 255))
-                
-                emoji_img.putdata(final_data)
+                emoji_img = self._binarize_alpha(emoji_img, self.TRANSPARENT_ALPHA_THRESHOLD)
                 
                 # 最終的な透明性確認
-                alpha = emoji_img.split()[-1]
-                alpha_values = set(alpha.getdata())
+                alpha_values = {value for value, count in enumerate(emoji_img.getchannel('A').histogram()) if count}
                 print(f"処理後アルファ値: {alpha_values}")
                 
                 return emoji_img
             else:
-                print(f"絵文字画像の取得に失敗: {url}")
                 return None
                 
         except Exception as e:
@@ -558,34 +651,15 @@ class HirsakamGenerator:
             # ベース画像を読み込み
             base_image = Image.open(base_image_path)
             
-            # 描画画像を読み込み
-            drawing_image = Image.open(drawing_image_path)
-            
-            # 描画画像をベース画像のサイズにリサイズ
-            drawing_image = drawing_image.resize(base_image.size, Image.Resampling.LANCZOS)
-            
-            # 両方の画像をRGBAモードに変換
-            if base_image.mode != 'RGBA':
-                base_image = base_image.convert('RGBA')
-            if drawing_image.mode != 'RGBA':
-                drawing_image = drawing_image.convert('RGBA')
-            
             # 描画画像を合成
-            combined = Image.alpha_composite(base_image, drawing_image)
+            combined = self.add_drawing_overlay_obj(base_image, drawing_image_path)
             
             # 出力パスが指定されていない場合はベース画像のパスを使用
             if output_path is None:
                 output_path = base_image_path
             
-            # 画像を保存（RGBAの場合はRGBに変換、元の背景を保持）
-            if combined.mode == 'RGBA':
-                # 元のベース画像の背景を保持してRGBに変換
-                original_base = Image.open(base_image_path)
-                rgb_image = original_base.convert('RGB')
-                rgb_image.paste(combined, mask=combined.split()[-1])
-                combined = rgb_image
-            
-            combined.save(output_path, "JPEG", quality=self.IMAGE_QUALITY)
+            # 合成結果にはベース画像が含まれているため、読み直さずにそのまま保存（透過出力でなければRGB化）
+            self.save_image(combined, output_path)
             return output_path
             
         except Exception as e:
@@ -593,12 +667,64 @@ class HirsakamGenerator:
             # エラーの場合は元の画像をそのまま返す
             return base_image_path
 
+    @staticmethod
+    def _layer_image_key(source):
+        """オーバーレイ／描画画像の内容を表すキー（パスは更新時刻・サイズ、バイト列は内容のハッシュ）"""
+        if isinstance(source, str):
+            stat = os.stat(source)
+            return ('path', os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+        return ('bytes', hashlib.sha1(source).digest(), len(source))
+    
+    def load_layer_image(self, source, size):
+        """
+        オーバーレイ／描画画像をデコードし、指定サイズのRGBA画像にして返す
+        パス・バイト列はデコード・リサイズ結果をキャッシュする（キャッシュ共有のため返り値は変更しないこと）
+        プレビューではJPEGを縮小デコード（draft）し、必要な大きさだけデコードする
+        """
+        size = (int(size[0]), int(size[1]))
+        cache_key = None
+        if isinstance(source, (str, bytes, bytearray)):
+            if isinstance(source, bytearray):
+                source = bytes(source)
+            cache_key = (self._layer_image_key(source), size, self.resample, self.reducing_gap)
+            cached = layer_image_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            image = Image.open(source if isinstance(source, str) else BytesIO(source))
+            if self.resample != self.RESAMPLE:
+                # プレビューではJPEGを縮小デコード（最終出力は従来どおり全体をデコードしてから縮小）
+                image.draft('RGB', size)
+        else:
+            image = source
+        
+        if image.size != size:
+            image = image.resize(size, self.resample, reducing_gap=self.reducing_gap)
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        if cache_key is None:
+            return image
+        image.load()
+        return layer_image_cache.put(cache_key, image)
+    
+    def add_drawing_overlay_obj(self, image, drawing_image):
+        """画像オブジェクトに描画オーバーレイを合成する（RGBAで返す）"""
+        # 描画画像をベース画像のサイズにして読み込み（パスまたはバイト列の場合はデコード結果をキャッシュ）
+        drawing_image = self.load_layer_image(drawing_image, image.size)
+        
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        
+        # 描画画像を合成
+        return Image.alpha_composite(image, drawing_image)
+
     def remove_background(self, image_path_or_obj):
         """画像の背景を透過処理する"""
         if not REMBG_AVAILABLE:
             print("Warning: rembg not available, skipping background removal")
             if isinstance(image_path_or_obj, str):
                 return Image.open(image_path_or_obj)
+            elif isinstance(image_path_or_obj, bytes):
+                return Image.open(BytesIO(image_path_or_obj))
             else:
                 return image_path_or_obj
         
@@ -607,14 +733,17 @@ class HirsakamGenerator:
                 # ファイルパスの場合
                 with open(image_path_or_obj, 'rb') as f:
                     input_data = f.read()
+            elif isinstance(image_path_or_obj, bytes):
+                # 画像バイト列の場合（アップロードされたデータそのもの）
+                input_data = image_path_or_obj
             else:
                 # PIL Imageオブジェクトの場合
                 with BytesIO() as buffer:
                     image_path_or_obj.save(buffer, format='PNG')
                     input_data = buffer.getvalue()
             
-            # 背景透過処理
-            output_data = remove(input_data)
+            # 背景透過処理（同一画像の結果はキャッシュを共有）
+            output_data = remove_background_bytes(input_data)
             
             # 透過済み画像をPILオブジェクトとして返す
             result_image = Image.open(BytesIO(output_data)).convert('RGBA')
@@ -625,6 +754,8 @@ class HirsakamGenerator:
             # エラーの場合は元の画像を返す
             if isinstance(image_path_or_obj, str):
                 return Image.open(image_path_or_obj)
+            elif isinstance(image_path_or_obj, bytes):
+                return Image.open(BytesIO(image_path_or_obj))
             else:
                 return image_path_or_obj
 
@@ -634,73 +765,15 @@ class HirsakamGenerator:
             # ベース画像を読み込み
             base_image = Image.open(base_image_path)
             
-            # オーバーレイ画像を読み込み
-            overlay_image = Image.open(overlay_image_path)
-            
-            # 背景透過処理を適用
-            if remove_background:
-                overlay_image = self.remove_background(overlay_image)
-            
-            # オーバーレイ画像を指定サイズにリサイズ
-            overlay_image = overlay_image.resize((int(width), int(height)), Image.Resampling.LANCZOS)
-            
-            # 両方の画像をRGBAモードに変換
-            if base_image.mode != 'RGBA':
-                base_image = base_image.convert('RGBA')
-            if overlay_image.mode != 'RGBA':
-                overlay_image = overlay_image.convert('RGBA')
-            
-            # 透明度を適用
-            if opacity < 1.0:
-                # アルファチャンネルに透明度を適用
-                alpha = overlay_image.split()[-1]
-                alpha = alpha.point(lambda p: int(p * opacity))
-                overlay_image.putalpha(alpha)
-            
-            # 回転と左右反転を適用
-            overlay_image = self._apply_transforms(overlay_image, rotation, flip_horizontal, "オーバーレイ画像")
-            
-            # 回転後のサイズを更新
-            if rotation != 0:
-                width = overlay_image.width
-                height = overlay_image.height
-            
-            # 位置を調整（中央寄せから左上基準に変換）
-            paste_x = int(x - width / 2)
-            paste_y = int(y - height / 2)
-            
-            # はみ出し部分をトリミングして合成（要素の自由配置を許可）
-            try:
-                base_image.paste(overlay_image, (paste_x, paste_y), overlay_image)
-            except Exception:
-                # 負の座標やはみ出しに対応
-                # より大きなキャンバスを作成して合成後にトリミング
-                expanded_width = max(base_image.width, paste_x + width)
-                expanded_height = max(base_image.height, paste_y + height)
-                expanded_canvas = Image.new('RGBA', (expanded_width, expanded_height), (0, 0, 0, 0))
-                
-                # 元の画像を配置
-                expanded_canvas.paste(base_image, (0, 0))
-                
-                # オーバーレイを配置
-                expanded_canvas.paste(overlay_image, (paste_x, paste_y), overlay_image)
-                
-                # 元のサイズにクロップ
-                base_image = expanded_canvas.crop((0, 0, base_image.width, base_image.height))
+            # オーバーレイを合成
+            base_image = self.add_overlay_image_obj(base_image, overlay_image_path, x, y, width, height, opacity, rotation, remove_background, flip_horizontal)
             
             # 出力パスが指定されていない場合はベース画像のパスを使用
             if output_path is None:
                 output_path = base_image_path
             
-            # 画像を保存（RGBAの場合はRGBに変換、元の背景を保持）
-            if base_image.mode == 'RGBA':
-                # 元のベース画像の背景を保持してRGBに変換
-                original_base = Image.open(base_image_path)
-                rgb_image = original_base.convert('RGB')
-                rgb_image.paste(base_image, mask=base_image.split()[-1])
-                base_image = rgb_image
-            
-            base_image.save(output_path, "JPEG", quality=self.IMAGE_QUALITY)
+            # 合成結果にはベース画像が含まれているため、読み直さずにそのまま保存（透過出力でなければRGB化）
+            self.save_image(base_image, output_path)
             return output_path
             
         except Exception as e:
@@ -708,20 +781,346 @@ class HirsakamGenerator:
             # エラーの場合は元の画像をそのまま返す
             return base_image_path
     
+    def add_overlay_image_obj(self, image, overlay_image, x, y, width, height, opacity, rotation=0, remove_background=False, flip_horizontal=False):
+        """画像オブジェクトにオーバーレイ画像を合成する（RGBAで返す）"""
+        # 背景透過処理を適用（プレビューとキャッシュを共有するため元のファイル内容を渡す）
+        if remove_background:
+            overlay_image = self.remove_background(overlay_image)
+        
+        # オーバーレイ画像を指定サイズで読み込み（パスまたはバイト列の場合はデコード結果をキャッシュ）
+        overlay_image = self.load_layer_image(overlay_image, (width, height))
+        
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        
+        # 透明度を適用
+        if opacity < 1.0:
+            # アルファチャンネルに透明度を適用（キャッシュ済みの画像は変更しない）
+            alpha = overlay_image.getchannel('A')
+            alpha = alpha.point(lambda p: int(p * opacity))
+            overlay_image = overlay_image.copy()
+            overlay_image.putalpha(alpha)
+        
+        # 回転と左右反転を適用
+        overlay_image = self._apply_transforms(overlay_image, rotation, flip_horizontal, "オーバーレイ画像")
+        
+        # 回転後のサイズを更新
+        if rotation != 0:
+            width = overlay_image.width
+            height = overlay_image.height
+        
+        # 位置を調整（中央寄せから左上基準に変換）
+        paste_x = int(x - width / 2)
+        paste_y = int(y - height / 2)
+        
+        # はみ出し部分をトリミングして合成（要素の自由配置を許可）
+        try:
+            image = self._paste_rgba(image, overlay_image, (paste_x, paste_y))
+        except Exception:
+            # 負の座標やはみ出しに対応
+            # より大きなキャンバスを作成して合成後にトリミング
+            expanded_width = max(image.width, paste_x + width)
+            expanded_height = max(image.height, paste_y + height)
+            expanded_canvas = Image.new('RGBA', (expanded_width, expanded_height), (0, 0, 0, 0))
+            
+            # 元の画像を配置
+            expanded_canvas.paste(image, (0, 0))
+            
+            # オーバーレイを配置
+            expanded_canvas.paste(overlay_image, (paste_x, paste_y), overlay_image)
+            
+            # 元のサイズにクロップ
+            image = expanded_canvas.crop((0, 0, image.width, image.height))
+        
+        return image
+    
     def copy_base_image(self, output_path):
         """ベース画像を出力パスにコピーする"""
         try:
-            base_image = self.load_base_image()
-            # RGBモードで保存（透明性を含まない）
-            if base_image.mode != 'RGB':
-                base_image = base_image.convert('RGB')
-            base_image.save(output_path, "JPEG", quality=self.IMAGE_QUALITY)
+            # 透過出力でなければRGBで保存（透明性を含まない）
+            self.save_image(self.load_base_canvas(), output_path)
             print(f"ベース画像をコピーしました: {output_path}")
             return output_path
         except Exception as e:
             print(f"ベース画像コピーエラー: {e}")
             raise
     
+    def load_base_canvas(self, scale=1.0):
+        """デコード済みのベース画像（RGBA）を取得する（キャッシュ共有のため変更しないこと）"""
+        if scale == 1.0 and self._batch_base_canvas is not None:
+            return self._batch_base_canvas
+        if not self.cache_base_image or isinstance(self.base_image_path, (bytes, bytearray)):
+            return self._decode_base_canvas(scale)
+        
+        try:
+            stat = os.stat(self.base_image_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"ベース画像 {self.base_image_path} が見つかりません")
+        # ファイルが更新されるとキーが変わるため、古いデコード結果は使われずに追い出される
+        resize_settings = (int(self.resample), self.reducing_gap) if scale < 1.0 else None
+        cache_key = (os.path.abspath(self.base_image_path), stat.st_mtime_ns, stat.st_size, scale, resize_settings, self.transparent)
+        base_canvas = base_image_cache.get(cache_key)
+        if base_canvas is None:
+            base_canvas = base_image_cache.put(cache_key, self._decode_base_canvas(scale))
+        return base_canvas
+    
+    def create_canvas(self, scale=1.0):
+        """ベース画像から合成用のRGBAキャンバスを作成する（キャッシュ済みの画像の複製）"""
+        return self.load_base_canvas(scale).copy()
+    
+    def _decode_base_canvas(self, scale=1.0):
+        """ベース画像をデコードしてRGBAにする（scale < 1 の場合は縮小）"""
+        base_image = self.load_base_image()
+        if scale < 1.0:
+            size = (max(1, round(base_image.width * scale)), max(1, round(base_image.height * scale)))
+            # JPEGは縮小デコードでデコード自体を軽くする
+            base_image.draft('RGB', size)
+            base_image = base_image.resize(size, self.resample, reducing_gap=self.reducing_gap)
+        if self.transparent:
+            # 透過出力ではベース画像のアルファをそのまま使う
+            return base_image.convert('RGBA')
+        # copy_base_imageと同様にRGBへ揃えてから合成用にRGBA化
+        if base_image.mode != 'RGB':
+            base_image = base_image.convert('RGB')
+        return base_image.convert('RGBA')
+    
+    @staticmethod
+    def scale_layers(layers, scale):
+        """レイヤー定義の座標・サイズを縮小キャンバス用に変換したコピーを返す"""
+        def scaled(value):
+            return max(1, int(round(value * scale)))
+        
+        scaled_layers = []
+        for layer in layers:
+            layer = dict(layer)
+            layer_type = layer.get('type')
+            if layer_type == 'text':
+                layer['position'] = (int(layer['position'][0] * scale), int(layer['position'][1] * scale))
+                if layer.get('font_size'):
+                    layer['font_size'] = scaled(layer['font_size'])
+                if layer.get('stroke_width'):
+                    layer['stroke_width'] = scaled(layer['stroke_width'])
+            elif layer_type == 'emoji':
+                layer['position'] = (int(layer['position'][0] * scale), int(layer['position'][1] * scale))
+                if layer.get('size'):
+                    layer['size'] = scaled(layer['size'])
+            elif layer_type == 'overlay':
+                layer['x'] = layer['x'] * scale
+                layer['y'] = layer['y'] * scale
+                layer['width'] = scaled(layer['width'])
+                layer['height'] = scaled(layer['height'])
+            # drawing はキャンバスサイズに合わせてリサイズされるため変換不要
+            scaled_layers.append(layer)
+        return scaled_layers
+    
+    def apply_layer(self, canvas, layer):
+        """レイヤー定義を1つキャンバスに適用する
+        
+        layer は 'type' キーを持つ辞書:
+            text:    text, position, color, font_size, rotation, stroke_width, stroke_color
+            emoji:   emoji, position, size, rotation, flip_horizontal
+            overlay: image, x, y, width, height, opacity, rotation, remove_background, flip_horizontal
+            drawing: image
+        overlay/drawing の image はファイルパスまたはPIL Imageオブジェクト
+        """
+        layer_type = layer.get('type')
+        if layer_type == 'text':
+            return self.add_text_to_image_obj(
+                canvas,
+                layer['text'],
+                layer['position'],
+                layer.get('color'),
+                layer.get('font_size'),
+                layer.get('rotation', 0),
+                layer.get('stroke_width', 0),
+                layer.get('stroke_color')
+            )
+        elif layer_type == 'emoji':
+            return self.add_emoji_to_image_obj(
+                canvas,
+                layer['emoji'],
+                layer['position'],
+                layer.get('size'),
+                layer.get('rotation', 0),
+                layer.get('flip_horizontal', False)
+            )
+        elif layer_type == 'overlay':
+            return self.add_overlay_image_obj(
+                canvas,
+                layer['image'],
+                layer['x'],
+                layer['y'],
+                layer['width'],
+                layer['height'],
+                layer.get('opacity', 1.0),
+                layer.get('rotation', 0),
+                layer.get('remove_background', False),
+                layer.get('flip_horizontal', False)
+            )
+        elif layer_type == 'drawing':
+            return self.add_drawing_overlay_obj(canvas, layer['image'])
+        
+        print(f"Warning: 不明なレイヤータイプ: {layer_type}")
+        return canvas
+    
+    def composite_layers(self, layers, canvas=None):
+        """レイヤーを順番にメモリ上のRGBAキャンバスへ合成する"""
+        if canvas is None:
+            canvas = self.create_canvas()
+        
+        self.render_errors = []
+        for layer in layers:
+            try:
+                canvas = self.apply_layer(canvas, layer)
+            except Exception as e:
+                # ファイル経由の処理と同様に、失敗したレイヤーはスキップ
+                print(f"レイヤー合成エラー ({layer.get('type')}): {e}")
+                self.render_errors.append(f"{layer.get('type')}: {e}")
+        
+        return canvas
+    
+    @staticmethod
+    def _resolve_output_format(output_format, output_path=None):
+        """出力形式（名前またはOutputFormat、未指定の場合は保存先の拡張子から判定、不明ならJPEG）"""
+        if isinstance(output_format, OutputFormat):
+            return output_format
+        if output_format is None and output_path is not None:
+            return format_for_path(output_path)
+        return get_output_format(output_format)
+    
+    def _output_image(self, image, output_format):
+        """エンコード用の画像（透過出力で形式が対応していればRGBA、それ以外はRGB）"""
+        if self.transparent:
+            if output_format.supports_alpha:
+                return image if image.mode == 'RGBA' else image.convert('RGBA')
+            if image.mode == 'RGBA':
+                # 透過を保存できない形式では透明部分を白にする（そのままRGB化すると透明部分の色が出てしまう）
+                flattened = Image.new('RGB', image.size, (255, 255, 255))
+                flattened.paste(image, mask=image.getchannel('A'))
+                return flattened
+        return image if image.mode == 'RGB' else image.convert('RGB')
+    
+    def save_image(self, image, output_path, output_format=None, preset=None):
+        """画像を保存する（形式は output_format、未指定の場合は保存先の拡張子で決める）"""
+        output_format = self._resolve_output_format(output_format, output_path)
+        image = self._output_image(image, output_format)
+        image.save(output_path, output_format.pil_format, **output_format.save_options(preset))
+        return output_path
+    
+    def save_canvas(self, canvas, output_path, output_format=None, preset=None):
+        """合成済みキャンバスを一度だけエンコードして保存する"""
+        return self.save_image(canvas, output_path, output_format, preset)
+    
+    def encode_canvas(self, canvas, image_format="JPEG", quality=None, preset=None):
+        """合成済みキャンバスをファイルを経由せずバイト列にエンコードする（quality はプリセットの品質を上書き）"""
+        output_format = self._resolve_output_format(image_format)
+        canvas = self._output_image(canvas, output_format)
+        with BytesIO() as buffer:
+            canvas.save(buffer, output_format.pil_format, **output_format.save_options(preset, quality))
+            return buffer.getvalue()
+    
+    def render_layers_to_bytes(self, layers, output_format="jpeg", preset=None):
+        """ベース画像にレイヤーを合成し、保存せずにエンコード済みのバイト列として返す"""
+        canvas = self.composite_layers(layers)
+        image_data = self.encode_canvas(canvas, output_format, preset=preset)
+        print(f"レイヤー合成完了: {len(layers)}レイヤー -> メモリ ({len(image_data)}バイト)")
+        return image_data
+    
+    def render_preview(self, layers, scale=None, image_format="JPEG"):
+        """縮小キャンバス・軽いリサイズフィルター・低品質エンコードでプレビューを合成してバイト列で返す"""
+        if scale is None:
+            scale = self.PREVIEW_SCALE
+        previous = (self.resample, self.reducing_gap)
+        self.resample, self.reducing_gap = self.PREVIEW_RESAMPLE, self.PREVIEW_REDUCING_GAP
+        try:
+            canvas = self.composite_layers(self.scale_layers(layers, scale), canvas=self.create_canvas(scale))
+        finally:
+            self.resample, self.reducing_gap = previous
+        return self.encode_canvas(canvas, image_format, self.PREVIEW_QUALITY, self.PREVIEW_PRESET)
+    
+    @staticmethod
+    def _decode_shared_image(image):
+        """バッチ内で共有する画像をデコードする（スレッド間で共有するため先に読み込んでおく）"""
+        decoded = Image.open(image if isinstance(image, str) else BytesIO(image))
+        decoded.load()
+        return decoded
+    
+    def _share_layer_images(self, layer_sets):
+        """バッチ内で同じ内容のオーバーレイ／描画画像を一度だけデコードし、デコード済みの画像に置き換える"""
+        decoded_images = {}
+        shared_sets = []
+        for layers in layer_sets:
+            shared_layers = []
+            for layer in layers:
+                image = layer.get('image')
+                # 背景透過は元のファイル内容でキャッシュを引くため、デコードせずに渡す
+                if isinstance(image, (str, bytes)) and not layer.get('remove_background'):
+                    if image not in decoded_images:
+                        decoded_images[image] = self._decode_shared_image(image)
+                    layer = dict(layer, image=decoded_images[image])
+                shared_layers.append(layer)
+            shared_sets.append(shared_layers)
+        return shared_sets
+    
+    def render_batch(self, layer_sets, render=None, max_workers=1):
+        """
+        同じベース画像に複数のレイヤー構成を合成する
+        ベース画像・オーバーレイ画像のデコード結果はバッチ内で一度だけ作成し、フォントと絵文字スプライトは
+        プロセス共通のキャッシュを使う。max_workers が2以上の場合はスレッドで並列に合成する
+        （レンダープールの中から呼ぶ場合は、プールのスレッド数を超えないよう1のままにする）。
+        Args:
+            layer_sets: レイヤー定義のリストのリスト
+            render: (ジェネレーター, レイヤー定義) を受け取り結果を返す関数（デフォルト: JPEGのバイト列を返す）
+            max_workers: 並列に合成するスレッド数
+        Returns:
+            layer_sets と同じ順序の (結果, エラー) のリスト（成功した場合のエラーはNone）
+        """
+        if render is None:
+            render = HirsakamGenerator.render_layers_to_bytes
+        base_canvas = self.load_base_canvas()
+        layer_sets = self._share_layer_images(layer_sets)
+        
+        def render_one(layers):
+            # 合成ごとの状態（render_errors）が混ざらないよう、項目ごとに複製したジェネレーターで合成する
+            worker = copy.copy(self)
+            worker.render_errors = []
+            worker._batch_base_canvas = base_canvas
+            try:
+                return render(worker, layers), None
+            except Exception as e:
+                print(f"バッチ合成エラー: {e}")
+                return None, str(e)
+        
+        if max_workers <= 1 or len(layer_sets) <= 1:
+            return [render_one(layers) for layers in layer_sets]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(layer_sets)), thread_name_prefix="batch") as executor:
+            return list(executor.map(render_one, layer_sets))
+    
+    def render_layers(self, layers, output_path):
+        """ベース画像にレイヤーを合成し、最後に一度だけ保存する"""
+        canvas = self.composite_layers(layers)
+        self.save_canvas(canvas, output_path)
+        print(f"レイヤー合成完了: {len(layers)}レイヤー -> {output_path}")
+        return output_path
+    
+    def crop_image_bytes(self, image_data, crop_x, crop_y, crop_width, crop_height):
+        """画像のバイト列をトリミングし、JPEGのバイト列で返す（範囲が無効な場合はそのままJPEG化）"""
+        image = Image.open(BytesIO(image_data))
+        
+        # トリミング範囲を検証（crop_imageと同じ補正）
+        crop_x = max(crop_x, 0)
+        crop_y = max(crop_y, 0)
+        crop_width = min(crop_width, image.width - crop_x)
+        crop_height = min(crop_height, image.height - crop_y)
+        
+        if crop_width <= 0 or crop_height <= 0:
+            print("Warning: Invalid crop dimensions, returning original image")
+        else:
+            image = image.crop((crop_x, crop_y, crop_x + crop_width, crop_y + crop_height))
+            print(f"画像をトリミングしました: (範囲: {crop_x}, {crop_y}, {crop_width}, {crop_height})")
+        
+        return self.encode_canvas(image)
+    
     def crop_image(self, input_path, crop_x, crop_y, crop_width, crop_height, output_path=None):
         """画像をトリミングする"""
         try:
@@ -755,7 +1154,7 @@ class HirsakamGenerator:
             if cropped_image.mode != 'RGB':
                 cropped_image = cropped_image.convert('RGB')
             
-            cropped_image.save(output_path, "JPEG", quality=self.IMAGE_QUALITY)
+            self.save_image(cropped_image, output_path)
             print(f"画像をトリミングしました: {output_path} (範囲: {crop_x}, {crop_y}, {crop_width}, {crop_height})")
             return output_path
             
@@ -764,8 +1163,9 @@ class HirsakamGenerator:
             # エラーの場合は元の画像をそのまま返す
             return input_path
     
-    def add_text_to_image(self, input_path, text, position, color=None, font_size=None, rotation=0, output_path=None):
-        """既存の画像にテキストを追加する"""
+    def add_text_to_image(self, input_path, text, position, color=None, font_size=None, rotation=0, output_path=None,
+                          stroke_width=0, stroke_color=None):
+        """既存の画像にテキストを追加する（stroke_width > 0 の場合は stroke_color で縁取り）"""
         if color is None:
             color = self.DEFAULT_TEXT_COLOR
         if font_size is None:
@@ -780,29 +1180,18 @@ class HirsakamGenerator:
                 output_path = input_path
                 
             # テキストを追加
-            result_image = self.add_text_to_image_obj(image, text, position, color, font_size, rotation)
+            result_image = self.add_text_to_image_obj(image, text, position, color, font_size, rotation, stroke_width, stroke_color)
             
-            # RGBモードで保存
-            if result_image.mode != 'RGB':
-                result_image = result_image.convert('RGB')
-            result_image.save(output_path, "JPEG", quality=self.IMAGE_QUALITY)
+            # 透過出力でなければRGBで保存
+            self.save_image(result_image, output_path)
             print(f"テキストを追加しました: {text} at {position}")
             return output_path
         except Exception as e:
             print(f"テキスト追加エラー: {e}")
             return input_path
     
-    def add_text_to_image_obj(self, image, text, position, color=None, font_size=None, rotation=0):
-        """画像オブジェクトにテキストを追加する（回転対応・複数行対応）"""
-        if color is None:
-            color = self.DEFAULT_TEXT_COLOR
-        if font_size is None:
-            font_size = self.DEFAULT_FONT_SIZE
-            
-        draw = ImageDraw.Draw(image)
-        font = self.get_font(font_size, text=text)
-        
-        # テキストの正規化とエンコーディング処理
+    def _normalize_text(self, text):
+        """テキストを正規化する（UTF-8・NFC形式・改行コード）"""
         try:
             # UTF-8エンコーディングを明示的に確保
             if isinstance(text, bytes):
@@ -818,25 +1207,39 @@ class HirsakamGenerator:
         except Exception as e:
             print(f"テキスト正規化エラー: {e}")
             # エラーの場合は元のテキストを使用
+        return text
+    
+    @staticmethod
+    def _font_id(font, font_size):
+        """キャッシュのキーに使うフォントの識別子（ファイル・フェイス番号・サイズ）"""
+        return (getattr(font, 'path', None) or type(font).__name__, getattr(font, 'index', 0), font_size)
+    
+    def get_text_layout(self, text, font, font_size, stroke_width=0):
+        """
+        複数行テキストの寸法を計測する（行・行の高さ・各行の幅・全体の幅と高さ、縁取りを含む）
+        同じテキスト・フォントの計測結果は色や回転が違っても共有する
+        """
+        cache_key = (text, self._font_id(font, font_size), stroke_width)
+        layout = text_layout_cache.get(cache_key)
+        if layout is not None:
+            return layout
         
-        # 複数行テキストの処理
+        draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
         lines = text.split('\n')
         line_height = font_size * self.LINE_HEIGHT_RATIO
         
         # 全体のテキストサイズを計算
         total_height = int(len(lines) * line_height)
-        max_width = 0
+        line_widths = []
         for line in lines:
             # 空行も含めて計算（フロントエンドと一致させる）
-            if line.strip():
-                bbox = draw.textbbox((0, 0), line, font=font)
-                line_width = bbox[2] - bbox[0]
-                max_width = max(max_width, line_width)
-            else:
-                # 空行の場合は最小幅を確保
-                bbox = draw.textbbox((0, 0), ' ', font=font)
-                line_width = bbox[2] - bbox[0]
-                max_width = max(max_width, line_width)
+            try:
+                bbox = draw.textbbox((0, 0), line if line.strip() else ' ', font=font, stroke_width=stroke_width)
+                line_widths.append(bbox[2] - bbox[0])
+            except Exception as e:
+                print(f"テキスト計測エラー: {e}")
+                line_widths.append(0)
+        max_width = max(line_widths, default=0)
         
         # 最小サイズを確保
         if max_width == 0:
@@ -844,72 +1247,98 @@ class HirsakamGenerator:
         if total_height == 0:
             total_height = int(line_height)
         
-        if rotation != 0:
-            # 回転する場合はテキストを一時的な透明画像に描画してから回転
-            # 複数行を考慮したサイズで透明画像を作成
-            text_img = Image.new('RGBA', (max_width + self.TEXT_CANVAS_PADDING, total_height + self.TEXT_CANVAS_PADDING), (0, 0, 0, 0))
-            text_draw = ImageDraw.Draw(text_img)
-            
-            # 各行を描画
-            for i, line in enumerate(lines):
-                # 空行も含めて描画（フロントエンドと一致させる）
-                if line.strip():
+        layout = TextLayout(tuple(lines), line_height, tuple(line_widths), max_width, total_height)
+        return text_layout_cache.put(cache_key, layout)
+    
+    def get_text_sprite(self, text, font, font_size, color, rotation=0, stroke_width=0, stroke_color=None):
+        """
+        描画・回転まで済ませたテキストのスプライトと、位置合わせ用のオフセット (dx, dy) を取得する
+        合成位置は (x - dx, y - dy)。キャッシュ共有のためスプライトは変更しないこと
+        縁取り（stroke_width > 0）はFreeTypeのストロークで1回のラスタライズで描く
+        """
+        if stroke_width:
+            stroke_color = tuple(stroke_color or self.DEFAULT_BACKGROUND_COLOR)
+        else:
+            stroke_color = None
+        # 縁取りがある場合は外側の縁が縁取りの色になるため、下地も縁取りの色にする
+        background = self._text_background(stroke_color or color, rotation)
+        cache_key = (text, self._font_id(font, font_size), color, rotation, background, stroke_width, stroke_color)
+        sprite = text_sprite_cache.get(cache_key)
+        if sprite is not None:
+            return sprite
+        
+        layout = self.get_text_layout(text, font, font_size, stroke_width)
+        # 複数行を考慮したサイズで透明画像を作成
+        text_img = Image.new('RGBA', (layout.max_width + self.TEXT_CANVAS_PADDING, layout.total_height + self.TEXT_CANVAS_PADDING), background)
+        text_draw = ImageDraw.Draw(text_img)
+        # 回転なしの場合は各行をテキストの中心（anchor_x）から中央揃えにする（直接描画していた時と同じ位置）
+        anchor_x = self.OVERLAY_PADDING + layout.max_width // 2
+        
+        # 各行を描画
+        for i, (line, line_width) in enumerate(zip(layout.lines, layout.line_widths)):
+            # 空行も含めて描画（フロントエンドと一致させる）
+            if line.strip():
+                line_y = int(self.OVERLAY_PADDING + i * layout.line_height)
+                try:
+                    # 中央揃えで描画
+                    if rotation != 0:
+                        line_x = self.OVERLAY_PADDING + (layout.max_width - line_width) // 2
+                    else:
+                        line_x = anchor_x - line_width // 2
+                    text_draw.text((line_x, line_y), line, font=font, fill=color,
+                                   stroke_width=stroke_width, stroke_fill=stroke_color)
+                except Exception as e:
+                    print(f"テキスト描画エラー (行 {i+1}): {e}")
+                    # エラーの場合はシンプルな描画を試行
                     try:
-                        bbox = text_draw.textbbox((0, 0), line, font=font)
-                        line_width = bbox[2] - bbox[0]
-                        # 中央揃えで描画
-                        line_x = self.OVERLAY_PADDING + (max_width - line_width) // 2
-                        line_y = int(self.OVERLAY_PADDING + i * line_height)
-                        text_draw.text((line_x, line_y), line, font=font, fill=color)
-                    except Exception as e:
-                        print(f"テキスト描画エラー (行 {i+1}): {e}")
-                        # エラーの場合はシンプルな描画を試行
-                        try:
-                            line_x = self.OVERLAY_PADDING
-                            line_y = int(self.OVERLAY_PADDING + i * line_height)
-                            text_draw.text((line_x, line_y), line, font=font, fill=color)
-                        except:
-                            print(f"シンプル描画も失敗: {line}")
-                # 空行の場合は何も描画しないが、スペースは確保される
-            
+                        line_x = self.OVERLAY_PADDING if rotation != 0 else anchor_x
+                        text_draw.text((line_x, line_y), line, font=font, fill=color,
+                                       stroke_width=stroke_width, stroke_fill=stroke_color)
+                    except:
+                        print(f"シンプル描画も失敗: {line}")
+            # 空行の場合は何も描画しないが、スペースは確保される
+        
+        if rotation != 0:
             # PillowとCSSの回転方向の違いを修正（負の値で時計回り）
-            rotated_text = text_img.rotate(-rotation, expand=True)
-            
-            # 位置調整して合成
-            paste_x = position[0] - rotated_text.width // 2
-            paste_y = position[1] - rotated_text.height // 2
-            
-            # RGBAモードに変換して合成
-            if image.mode != 'RGBA':
-                image = image.convert('RGBA')
-            
-            image.paste(rotated_text, (paste_x, paste_y), rotated_text)
+            text_img = text_img.rotate(-rotation, expand=True)
+            offset = (text_img.width // 2, text_img.height // 2)
         else:
-            # 回転なしの場合は直接描画（複数行対応）
-            start_y = int(position[1] - total_height // 2)
-            
-            for i, line in enumerate(lines):
-                # 空行も含めて描画（フロントエンドと一致させる）
-                if line.strip():
-                    try:
-                        bbox = draw.textbbox((0, 0), line, font=font)
-                        line_width = bbox[2] - bbox[0]
-                        # 中央揃えで描画
-                        line_x = position[0] - line_width // 2
-                        line_y = int(start_y + i * line_height)
-                        draw.text((line_x, line_y), line, font=font, fill=color)
-                    except Exception as e:
-                        print(f"テキスト描画エラー (行 {i+1}): {e}")
-                        # エラーの場合はシンプルな描画を試行
-                        try:
-                            line_x = position[0]
-                            line_y = int(start_y + i * line_height)
-                            draw.text((line_x, line_y), line, font=font, fill=color)
-                        except:
-                            print(f"シンプル描画も失敗: {line}")
-                # 空行の場合は何も描画しないが、スペースは確保される
+            offset = (anchor_x, layout.total_height // 2 + self.OVERLAY_PADDING)
+        return text_sprite_cache.put(cache_key, (text_img, offset))
+    
+    def add_text_to_image_obj(self, image, text, position, color=None, font_size=None, rotation=0,
+                              stroke_width=0, stroke_color=None):
+        """画像オブジェクトにテキストを追加する（回転対応・複数行対応・縁取り対応）"""
+        if color is None:
+            color = self.DEFAULT_TEXT_COLOR
+        if font_size is None:
+            font_size = self.DEFAULT_FONT_SIZE
+        if isinstance(color, str):
+            color = ImageColor.getrgb(color)
+        if isinstance(stroke_color, str):
+            stroke_color = ImageColor.getrgb(stroke_color)
         
-        return image
+        font = self.get_font(font_size, text=text)
+        text = self._normalize_text(text)
+        
+        # 同じテキスト・フォント・色・回転・縁取りのスプライトは描画済みのものを合成するだけ
+        text_img, (offset_x, offset_y) = self.get_text_sprite(
+            text, font, font_size, tuple(color), rotation, int(stroke_width or 0), stroke_color
+        )
+        if image.mode != 'RGBA' and (rotation != 0 or self.transparent):
+            # RGBAモードに変換して合成
+            image = image.convert('RGBA')
+        return self._paste_rgba(image, text_img, (position[0] - offset_x, position[1] - offset_y))
+    
+    def _text_background(self, color, rotation=0):
+        """
+        テキスト描画用の透明な下地
+        文字色にしておくとアンチエイリアスの縁が暗くならない（回転なしの場合は直接描画していた時と同じ結果になる）。
+        回転ありの通常出力は従来の出力を変えないよう黒のまま
+        """
+        if (self.transparent or rotation == 0) and len(color) >= 3:
+            return tuple(color[:3]) + (0,)
+        return (0, 0, 0, 0)
     
     def add_emoji_to_image(self, input_path, emoji_char, position, size=None, rotation=0, flip_horizontal=False, output_path=None):
         """既存の画像に絵文字を追加する（透明性を保持）"""
@@ -927,43 +1356,44 @@ class HirsakamGenerator:
             # 絵文字を追加
             result_image = self.add_emoji_to_image_obj(image, emoji_char, position, size, rotation, flip_horizontal)
             
-            # RGBモードで保存（元の背景を保持）
-            if result_image.mode != 'RGB':
-                if result_image.mode == 'RGBA':
-                    # 元の画像をベースとしてRGB変換
-                    rgb_image = Image.new('RGB', result_image.size)
-                    # 元のベース画像の背景を使用
-                    base_rgb = image.convert('RGB') if image.mode != 'RGB' else image
-                    rgb_image.paste(base_rgb, (0, 0))
-                    rgb_image.paste(result_image, mask=result_image.split()[-1] if result_image.mode == 'RGBA' else None)
-                    result_image = rgb_image
-                else:
-                    result_image = result_image.convert('RGB')
-            
-            result_image.save(output_path, "JPEG", quality=self.IMAGE_QUALITY)
+            # 合成結果にはベース画像が含まれているため、そのまま保存（透過出力でなければRGB化）
+            self.save_image(result_image, output_path)
             print(f"絵文字を追加しました: {emoji_char} at {position}")
             return output_path
         except Exception as e:
             print(f"絵文字追加エラー: {e}")
             return input_path
     
+    def get_emoji_sprite(self, emoji_char, size, rotation=0, flip_horizontal=False):
+        """回転・反転まで適用済みの絵文字スプライトを取得する（キャッシュ共有のため変更しないこと）"""
+        cache_key = (emoji_sequence_key(emoji_char), size, rotation, bool(flip_horizontal), self.resample)
+        emoji_image = emoji_sprite_cache.get(cache_key)
+        if emoji_image is not None:
+            return emoji_image
+        
+        # 絵文字画像をダウンロード（透明性処理済み）
+        emoji_image = self.download_emoji_image(emoji_char, size)
+        if emoji_image is None:
+            return None
+        
+        # 回転と左右反転を適用
+        emoji_image = self._apply_transforms(emoji_image, rotation, flip_horizontal, "絵文字")
+        return emoji_sprite_cache.put(cache_key, emoji_image)
+    
     def add_emoji_to_image_obj(self, image, emoji_char, position, size=None, rotation=0, flip_horizontal=False):
         """画像オブジェクトに絵文字を追加する（回転対応、透明性保持）"""
         if size is None:
             size = self.DEFAULT_EMOJI_SIZE
             
         try:
-            # 絵文字画像をダウンロード（透明性処理済み）
-            emoji_image = self.download_emoji_image(emoji_char, size)
+            emoji_image = self.get_emoji_sprite(emoji_char, size, rotation, flip_horizontal)
             if emoji_image is None:
                 print(f"絵文字画像の取得に失敗: {emoji_char}")
+                self.render_errors.append(f"emoji: 絵文字画像を取得できません ({emoji_char})")
                 return image
             
             print(f"絵文字合成開始: {emoji_char}, 回転: {rotation}度")
             
-            # 回転と左右反転を適用
-            emoji_image = self._apply_transforms(emoji_image, rotation, flip_horizontal, "絵文字")
-            
             # 位置調整して合成
             paste_x = position[0] - emoji_image.width // 2
             paste_y = position[1] - emoji_image.height // 2
@@ -973,11 +1403,241 @@ class HirsakamGenerator:
                 image = image.convert('RGBA')
             
             # アルファマスクを使用して透明性を保持して合成
-            image.paste(emoji_image, (paste_x, paste_y), emoji_image)
+            image = self._paste_rgba(image, emoji_image, (paste_x, paste_y))
             print(f"絵文字合成完了: 位置({paste_x}, {paste_y})")
             
             return image
         except Exception as e:
             print(f"絵文字合成エラー: {e}")
+            self.render_errors.append(f"emoji: {e}")
             return image
 
+
+
+# ---------------------------------------------------------------------------
+# コマンドライン（JSONLマニフェストによる一括生成）
+# ---------------------------------------------------------------------------
+
+DEFAULT_LAYER_ORDER = ['text', 'emoji', 'overlay1', 'overlay2', 'overlay3']
+
+# ワーカープロセスごとのジェネレーター（ベース画像・透過出力の有無ごと、フォント・絵文字スプライトのキャッシュはプロセス内で共有）
+_cli_generators = {}
+
+
+def _resolve_manifest_path(path, manifest_dir):
+    """マニフェスト内の相対パスはマニフェストのあるディレクトリを基準にする"""
+    return path if os.path.isabs(path) else os.path.join(manifest_dir, path)
+
+
+def _hex_to_rgb(color):
+    if isinstance(color, str):
+        color = color.lstrip('#')
+        return tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
+    return tuple(color)
+
+
+def manifest_entry_layers(entry, manifest_dir="."):
+    """
+    マニフェストの1行からレイヤー定義を作成する
+    text / emoji 系のキーは /generate と同じ名前、overlays は slotNumber と位置・サイズ・image（パス）を持つ配列、
+    drawing は描画画像のパス。layers を指定した場合はレイヤー定義をそのまま使う
+    """
+    if 'layers' in entry:
+        layers = []
+        for layer in entry['layers']:
+            layer = dict(layer)
+            if isinstance(layer.get('image'), str):
+                layer['image'] = _resolve_manifest_path(layer['image'], manifest_dir)
+            layers.append(layer)
+        return layers
+
+    overlays_by_slot = {}
+    for index, overlay in enumerate(entry.get('overlays') or [], start=1):
+        overlays_by_slot[overlay.get('slotNumber', index)] = overlay
+
+    layers = []
+    for layer_type in entry.get('layer_order') or DEFAULT_LAYER_ORDER:
+        if layer_type == 'text' and entry.get('text'):
+            layers.append({
+                'type': 'text',
+                'text': entry['text'],
+                'position': (entry.get('text_x', 260), entry.get('text_y', 143)),
+                'color': _hex_to_rgb(entry.get('text_color', "#ffffff")),
+                'font_size': entry.get('font_size', HirsakamGenerator.DEFAULT_FONT_SIZE),
+                'rotation': entry.get('text_rotation', 0),
+                'stroke_width': entry.get('text_stroke_width', 0),
+                'stroke_color': _hex_to_rgb(entry.get('text_stroke_color', "#000000"))
+            })
+        elif layer_type == 'emoji' and entry.get('emoji'):
+            layers.append({
+                'type': 'emoji',
+                'emoji': entry['emoji'],
+                'position': (entry.get('emoji_x', 260), entry.get('emoji_y', 143)),
+                'size': entry.get('emoji_size', HirsakamGenerator.DEFAULT_EMOJI_SIZE),
+                'rotation': entry.get('emoji_rotation', 0),
+                'flip_horizontal': entry.get('emoji_flip_horizontal', False)
+            })
+        elif layer_type.startswith('overlay'):
+            overlay = overlays_by_slot.get(int(layer_type.replace('overlay', '')))
+            if overlay:
+                layers.append({
+                    'type': 'overlay',
+                    'image': _resolve_manifest_path(overlay['image'], manifest_dir),
+                    'x': overlay['x'],
+                    'y': overlay['y'],
+                    'width': overlay['width'],
+                    'height': overlay['height'],
+                    'opacity': overlay.get('opacity', 1.0),
+                    'rotation': overlay.get('rotation', 0),
+                    'remove_background': overlay.get('remove_background', overlay.get('removeBackground', False)),
+                    'flip_horizontal': overlay.get('flip_horizontal', overlay.get('flipHorizontal', False))
+                })
+
+    # 描画データは最上位レイヤー
+    if entry.get('drawing'):
+        layers.append({'type': 'drawing', 'image': _resolve_manifest_path(entry['drawing'], manifest_dir)})
+    return layers
+
+
+def _init_cli_worker(quiet):
+    """ワーカープロセスの初期化（合成処理の詳細ログを抑制）"""
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def _render_manifest_entry(task):
+    """マニフェストの1行を合成して保存する（戻り値: (行番号, 出力パス, エラー)）"""
+    line_number, line, manifest_dir, default_base_image, output_dir = task
+    try:
+        entry = json.loads(line)
+        if not isinstance(entry, dict):
+            raise ValueError("オブジェクトではありません")
+    except ValueError as e:
+        return line_number, None, f"マニフェストを解釈できません: {e}"
+    try:
+        base_image = entry.get('base_image')
+        base_image = _resolve_manifest_path(base_image, manifest_dir) if base_image else default_base_image
+        transparent = bool(entry.get('transparent', False))
+        output_path = entry.get('output') or os.path.join(output_dir, f"image_{line_number:06d}.{'png' if transparent else 'jpg'}")
+        output_path = _resolve_manifest_path(output_path, manifest_dir)
+
+        generator = _cli_generators.get((base_image, transparent))
+        if generator is None:
+            generator = _cli_generators[(base_image, transparent)] = HirsakamGenerator(base_image, transparent=transparent)
+
+        output_dirname = os.path.dirname(output_path)
+        if output_dirname:
+            os.makedirs(output_dirname, exist_ok=True)
+        canvas = generator.composite_layers(manifest_entry_layers(entry, manifest_dir))
+        # 中断時に書きかけのファイルが残らないよう一時ファイルから置き換える
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        generator.save_canvas(canvas, temp_path, format_for_path(output_path))
+        os.replace(temp_path, output_path)
+        return line_number, output_path, "; ".join(generator.render_errors) or None
+    except Exception as e:
+        return line_number, None, str(e)
+
+
+def _read_checkpoint(checkpoint_path):
+    """完了済みの行番号を読み込む"""
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, encoding='utf-8') as f:
+        return {int(line) for line in f if line.strip().isdigit()}
+
+
+def _iter_manifest_tasks(manifest_path, completed, default_base_image, output_dir):
+    """マニフェストを1行ずつ読み、未完了の行をタスクとして返す（全体をメモリに載せない）"""
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip() or line_number in completed:
+                continue
+            # 解釈できない行も失敗として数えるよう、JSONの解析はワーカー側で行う
+            yield line_number, line, manifest_dir, default_base_image, output_dir
+
+
+def run_manifest(manifest_path, workers=None, checkpoint_path=None, restart=False, base_image=None,
+                 output_dir=".", progress_every=10, quiet=True):
+    """
+    JSONLマニフェストの各行を合成して保存する
+    完了した行番号をチェックポイントファイルに追記し、再実行時は完了済みの行をスキップする
+    Returns:
+        (成功数, 失敗数)
+    """
+    checkpoint_path = checkpoint_path or f"{manifest_path}.checkpoint"
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    completed = _read_checkpoint(checkpoint_path)
+    with open(manifest_path, encoding='utf-8') as f:
+        total = sum(1 for line in f if line.strip())
+    if completed:
+        print(f"チェックポイントから再開: {len(completed)}/{total}件完了済み")
+
+    default_base_image = os.path.abspath(base_image or os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hirsakam.jpg"))
+    tasks = _iter_manifest_tasks(manifest_path, completed, default_base_image, output_dir)
+    workers = workers or os.cpu_count() or 1
+
+    succeeded = failed = 0
+    start = time.perf_counter()
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint, \
+            multiprocessing.Pool(workers, initializer=_init_cli_worker, initargs=(quiet,)) as pool:
+        # 順不同で受け取り、ワーカーを遊ばせない
+        for line_number, output_path, error in pool.imap_unordered(_render_manifest_entry, tasks, chunksize=4):
+            if output_path is None:
+                failed += 1
+                print(f"❌ {line_number}行目: {error}", file=sys.stderr)
+            elif error:
+                # 一部のレイヤーが欠けた出力は失敗として扱い、再実行時に生成し直すためチェックポイントにも記録しない
+                failed += 1
+                print(f"❌ {line_number}行目: 一部のレイヤーに失敗 ({error})", file=sys.stderr)
+            else:
+                succeeded += 1
+                checkpoint.write(f"{line_number}\n")
+                checkpoint.flush()
+
+            done = succeeded + failed
+            if done % progress_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"[{len(completed) + done}/{total}] {done / elapsed:.1f} images/s (失敗: {failed})")
+
+    elapsed = time.perf_counter() - start
+    rate = (succeeded + failed) / elapsed if elapsed else 0.0
+    print(f"完了: {succeeded}件成功, {failed}件失敗, {elapsed:.1f}秒 ({rate:.1f} images/s)")
+    return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Hirsakam コラ画像ジェネレーター（JSONLマニフェストによる一括生成）",
+        epilog='マニフェストの例: {"text": "LGTM", "emoji": "👍", "output": "out/lgtm.jpg"}'
+    )
+    parser.add_argument("manifest", help="1行に1件の合成内容を書いたJSONLファイル")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（デフォルト: CPU数）")
+    parser.add_argument("--base-image", default=None, help="base_image を指定しない行のベース画像（デフォルト: hirsakam.jpg）")
+    parser.add_argument("--output-dir", default=".", help="output を指定しない行の出力先（マニフェストからの相対パス）")
+    parser.add_argument("--checkpoint", default=None, help="チェックポイントファイル（デフォルト: <manifest>.checkpoint）")
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを破棄して最初から生成する")
+    parser.add_argument("--progress-every", type=int, default=10, help="進捗を表示する間隔（件数）")
+    parser.add_argument("--verbose", action="store_true", help="合成処理の詳細ログを表示する")
+    args = parser.parse_args()
+
+    try:
+        succeeded, failed = run_manifest(
+            args.manifest,
+            workers=args.workers,
+            checkpoint_path=args.checkpoint,
+            restart=args.restart,
+            base_image=args.base_image,
+            output_dir=args.output_dir,
+            progress_every=max(1, args.progress_every),
+            quiet=not args.verbose
+        )
+    except KeyboardInterrupt:
+        print("\n中断しました。同じコマンドを再実行すると続きから生成します", file=sys.stderr)
+        sys.exit(130)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
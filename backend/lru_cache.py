@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+バイト数上限付きLRUキャッシュ（スレッドセーフ）
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+def image_nbytes(image):
+    """PIL画像のおおよそのメモリ使用量（バイト）"""
+    return image.width * image.height * len(image.getbands())
+
+
+class BoundedLRUCache:
+    def __init__(self, max_bytes, size_of=image_nbytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        # 有効期限（秒）。Noneの場合は無期限
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    def _remove(self, key):
+        """エントリを削除（ロック取得済みで呼び出すこと）"""
+        value, size, stored_at = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        """キャッシュから値を取得（なければNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            value, size, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        """キャッシュに値を格納し、上限を超えた分を古い順に追い出す"""
+        size = self.size_of(value)
+        if size > self.max_bytes:
+            # 上限より大きい値はキャッシュしない
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._stats["evictions"] += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """キャッシュ統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+            return stats
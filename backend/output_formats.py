@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+生成画像の出力形式
+
+JPEG・WebP（非可逆／可逆）・PNG・AVIF（コーデックが利用可能な場合）のエンコード設定を、
+速度優先（speed）・標準（balanced）・サイズ優先（size）のプリセットとしてまとめる。
+出力形式はフォームのパラメーター、または Accept ヘッダーから決める。
+
+環境変数:
+    OUTPUT_PRESET   プリセットを指定しない場合のプリセット（デフォルト: balanced）
+"""
+
+import mimetypes
+import os
+from PIL import features
+
+PRESETS = ("speed", "balanced", "size")
+DEFAULT_PRESET = os.getenv("OUTPUT_PRESET", "balanced")
+
+
+class UnsupportedFormatError(ValueError):
+    """指定された出力形式・プリセットが使えない"""
+
+
+def _avif_available():
+    """AVIFのエンコードが可能か（Pillow 11.2以降の標準対応、または pillow-avif-plugin）"""
+    try:
+        if features.check("avif"):
+            return True
+    except Exception:
+        pass
+    try:
+        import pillow_avif  # noqa: F401  読み込むとPillowにAVIFが登録される
+        return True
+    except ImportError:
+        return False
+
+
+class OutputFormat:
+    def __init__(self, name, pil_format, extension, media_type, presets, available=True, supports_alpha=True):
+        self.name = name
+        self.pil_format = pil_format
+        self.extension = extension
+        self.media_type = media_type
+        self.presets = presets
+        self.available = available
+        # 透過（アルファチャンネル）を保存できるか
+        self.supports_alpha = supports_alpha
+
+    def save_options(self, preset=None, quality=None):
+        """Image.save に渡すオプション（quality を指定するとプリセットの品質を上書き）"""
+        preset = preset or DEFAULT_PRESET
+        if preset not in self.presets:
+            raise UnsupportedFormatError(f"プリセットは {', '.join(PRESETS)} のいずれかを指定してください")
+        options = dict(self.presets[preset])
+        if quality is not None and 'quality' in options and not options.get('lossless'):
+            options['quality'] = quality
+        return options
+
+
+OUTPUT_FORMATS = {
+    output_format.name: output_format
+    for output_format in (
+        OutputFormat("jpeg", "JPEG", "jpg", "image/jpeg", {
+            "speed": {"quality": 90},
+            # 従来の出力（IMAGE_QUALITY）と同じ
+            "balanced": {"quality": 95},
+            "size": {"quality": 85, "optimize": True, "progressive": True}
+        }, supports_alpha=False),
+        OutputFormat("webp", "WEBP", "webp", "image/webp", {
+            # method は 0（速い）〜 6（小さい）
+            "speed": {"quality": 80, "method": 0},
+            "balanced": {"quality": 80, "method": 3},
+            "size": {"quality": 75, "method": 6}
+        }),
+        OutputFormat("webp-lossless", "WEBP", "webp", "image/webp", {
+            # 可逆圧縮では quality が圧縮の手間を表す
+            "speed": {"lossless": True, "quality": 0, "method": 0},
+            "balanced": {"lossless": True, "quality": 50, "method": 3},
+            "size": {"lossless": True, "quality": 80, "method": 4}
+        }),
+        OutputFormat("png", "PNG", "png", "image/png", {
+            "speed": {"compress_level": 1},
+            "balanced": {"compress_level": 6},
+            "size": {"optimize": True}
+        }),
+        OutputFormat("avif", "AVIF", "avif", "image/avif", {
+            # speed は 0（遅い・小さい）〜 10（速い）。8未満はリクエスト内でエンコードするには遅すぎる
+            "speed": {"quality": 60, "speed": 10},
+            "balanced": {"quality": 60, "speed": 9},
+            "size": {"quality": 55, "speed": 8}
+        }, available=_avif_available()),
+    )
+}
+
+# 拡張子やフォームで使える別名
+FORMAT_ALIASES = {
+    "jpg": "jpeg",
+    "webp-lossy": "webp"
+}
+
+# Accept ヘッダーで明示的に求められた場合に選ぶ順（小さい順）
+NEGOTIATION_ORDER = ("avif", "webp")
+
+
+def available_formats():
+    """利用可能な出力形式の名前"""
+    return [name for name, output_format in OUTPUT_FORMATS.items() if output_format.available]
+
+
+def get_output_format(name):
+    """名前（jpeg / webp / webp-lossless / png / avif）から出力形式を取得"""
+    name = (name or "jpeg").lower()
+    output_format = OUTPUT_FORMATS.get(FORMAT_ALIASES.get(name, name))
+    if output_format is None or not output_format.available:
+        raise UnsupportedFormatError(f"出力形式は {', '.join(available_formats())} のいずれかを指定してください")
+    return output_format
+
+
+def format_for_path(path):
+    """ファイルの拡張子から出力形式を取得（不明な拡張子はJPEG）"""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    for output_format in OUTPUT_FORMATS.values():
+        if output_format.extension == extension and output_format.available:
+            return output_format
+    return OUTPUT_FORMATS["jpeg"]
+
+
+def media_type_for(filename):
+    """ファイル名からメディアタイプを取得"""
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    for output_format in OUTPUT_FORMATS.values():
+        if output_format.extension == extension:
+            return output_format.media_type
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _accepted_types(accept_header):
+    """Accept ヘッダーのメディアタイプ -> q値"""
+    accepted = {}
+    for part in (accept_header or "").split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[media_type.lower()] = q
+    return accepted
+
+
+def negotiate(accept_header=None, requested=None):
+    """
+    出力形式を決める
+    requested（フォームの output_format）があればそれを使い、"auto" または未指定の場合は Accept ヘッダーで
+    image/avif・image/webp が明示されていればそれを選ぶ（*/* や image/* だけの場合は従来どおりJPEG）
+    """
+    if requested and requested.lower() != "auto":
+        return get_output_format(requested)
+
+    accepted = _accepted_types(accept_header)
+    for name in NEGOTIATION_ORDER:
+        output_format = OUTPUT_FORMATS[name]
+        if output_format.available and accepted.get(output_format.media_type, 0) > 0:
+            return output_format
+    return OUTPUT_FORMATS["jpeg"]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+生成結果のキャッシュ（内容アドレス方式）
+
+ベース画像・各レイヤーのパラメーター・オーバーレイ／描画画像の内容から
+正規化したキーを作り、生成画像を image_{キー}.jpg として保存する。
+同じ内容のリクエストは既存のファイルをそのまま返すため、再描画もディスクの重複もない。
+（JPEG以外の出力形式は image_{キー}.webp などの拡張子で保存する）
+
+環境変数:
+    RENDER_CACHE   0 の場合はキャッシュを使わず毎回生成する
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+# 描画結果が変わる変更（フォント・合成処理など）を入れた場合は値を上げて既存キーを無効化する
+RENDER_CACHE_VERSION = 1
+KEY_LENGTH = 32
+CACHE_FILENAME_PATTERN = re.compile(rf"image_[0-9a-f]{{{KEY_LENGTH}}}\.[a-z]+")
+
+
+class RenderResultCache:
+    def __init__(self, output_dir, enabled=None):
+        self.output_dir = output_dir
+        self.enabled = enabled if enabled is not None else os.getenv("RENDER_CACHE", "1") != "0"
+        self._lock = threading.Lock()
+        # (パス, 更新時刻, サイズ) -> ダイジェスト（デフォルトのベース画像を毎回読まないため）
+        self._file_digests = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "uncacheable": 0
+        }
+
+    def file_digest(self, path):
+        """ファイル内容のSHA-256（同じファイルは更新時刻とサイズが変わるまで再計算しない）"""
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._file_digests.get(memo_key)
+        if digest is not None:
+            return digest
+
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        with self._lock:
+            self._file_digests[memo_key] = digest
+        return digest
+
+    def _image_digest(self, image):
+        """レイヤーの画像（パスまたはバイト列）のダイジェスト"""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(image).hexdigest()
+        if isinstance(image, str):
+            return self.file_digest(image)
+        # PIL Imageなど内容を特定できないものはキャッシュしない
+        return None
+
+    def make_key(self, base_image, layers, settings=None):
+        """リクエストの正規化キーを作成（base_image はパスまたはバイト列、キャッシュできない場合はNone）"""
+        if not self.enabled:
+            return None
+
+        base_digest = self._image_digest(base_image)
+        if base_digest is None:
+            return None
+
+        canonical_layers = []
+        for layer in layers:
+            layer = dict(layer)
+            if 'image' in layer:
+                digest = self._image_digest(layer['image'])
+                if digest is None:
+                    return None
+                layer['image'] = digest
+            canonical_layers.append(layer)
+
+        canonical = json.dumps(
+            {
+                "version": RENDER_CACHE_VERSION,
+                "base": base_digest,
+                "layers": canonical_layers,
+                "settings": settings or {}
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:KEY_LENGTH]
+
+    def filename_for(self, key, extension="jpg"):
+        return f"image_{key}.{extension}"
+
+    @staticmethod
+    def is_cache_filename(filename):
+        """内容から作ったキャッシュ用のファイル名か（同じ名前の内容は変わらない）"""
+        return CACHE_FILENAME_PATTERN.fullmatch(filename) is not None
+
+    def lookup(self, key, extension="jpg"):
+        """キャッシュ済みの生成画像のパスを返す（なければNone）"""
+        if key is None:
+            with self._lock:
+                self._stats["uncacheable"] += 1
+            return None
+
+        path = os.path.join(self.output_dir, self.filename_for(key, extension))
+        hit = os.path.exists(path)
+        with self._lock:
+            self._stats["hits" if hit else "misses"] += 1
+        return path if hit else None
+
+    def stats(self):
+        """キャッシュ統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["enabled"] = self.enabled
+        return stats
+
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache(output_dir=None):
+    """プロセス共通のRenderResultCacheを取得"""
+    global _render_cache
+    if _render_cache is None:
+        with _render_cache_lock:
+            if _render_cache is None:
+                _render_cache = RenderResultCache(output_dir or os.path.join("..", "output"))
+    return _render_cache
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+画像処理のワーカープール
+
+Pillowによる合成などCPU負荷の高い処理をイベントループの外（スレッドプール）で実行し、
+rembgの推論は別プロセスで実行する。待ち行列が上限に達した場合は PoolSaturatedError を送出する。
+
+環境変数:
+    RENDER_THREAD_WORKERS   画像処理スレッド数（デフォルト: CPU数÷BACKEND_WORKERS、最大8）。0 の場合はイベントループ上で直接実行
+    RENDER_QUEUE_DEPTH      実行待ちにできる処理数の上限（デフォルト: スレッド数の4倍）
+    RENDER_RETRY_AFTER      混雑時に返すRetry-Afterの秒数（デフォルト: 1）
+    REMBG_PROCESS_WORKERS   rembg推論用のプロセス数（デフォルト: rembgが利用可能なら1、BACKEND_WORKERSが2以上なら0）。0 の場合はスレッド内で推論
+                            推論プロセスはワーカープロセスごとに起動するため、合計は BACKEND_WORKERS × この値になる
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from background_removal import REMBG_AVAILABLE, set_inference_executor, warm_up_worker
+
+
+class PoolSaturatedError(Exception):
+    """ワーカープールの待ち行列が上限に達した"""
+
+    def __init__(self, retry_after):
+        super().__init__("サーバーが混雑しています。しばらくしてから再度お試しください。")
+        self.retry_after = retry_after
+
+
+class RenderPool:
+    def __init__(self, thread_workers=None, queue_depth=None, process_workers=None, retry_after=None):
+        # 複数ワーカープロセスで起動している場合はCPUをワーカー間で分け合う
+        backend_workers = max(1, int(os.getenv("BACKEND_WORKERS", "1")))
+        default_threads = max(1, min(8, (os.cpu_count() or 1) // backend_workers))
+        self.thread_workers = int(thread_workers if thread_workers is not None else os.getenv("RENDER_THREAD_WORKERS", default_threads))
+        self.queue_depth = int(queue_depth if queue_depth is not None else os.getenv("RENDER_QUEUE_DEPTH", max(1, self.thread_workers) * 4))
+        # 推論プロセスはワーカーごとに起動され、それぞれがモデルを読み込む。
+        # 複数ワーカーの場合は既にイベントループが分かれているため、追加のプロセスは起動せずスレッド内で推論する
+        default_processes = 1 if REMBG_AVAILABLE and backend_workers == 1 else 0
+        self.process_workers = int(process_workers if process_workers is not None else os.getenv("REMBG_PROCESS_WORKERS", default_processes))
+        self.retry_after = int(retry_after if retry_after is not None else os.getenv("RENDER_RETRY_AFTER", 1))
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "max_in_flight": 0
+        }
+        self._threads = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="render") if self.thread_workers > 0 else None
+        self._processes = None
+        if self.process_workers > 0:
+            # onnxruntimeはfork後の利用が安全でないためspawnで起動する
+            self._processes = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            set_inference_executor(self._processes)
+
+    def _reserve(self):
+        """実行枠を確保（実行中＋待ち行列が上限を超える場合は拒否）"""
+        with self._lock:
+            if self._in_flight >= max(1, self.thread_workers) + self.queue_depth:
+                self._stats["rejected"] += 1
+                raise PoolSaturatedError(self.retry_after)
+            self._in_flight += 1
+            self._stats["submitted"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, func, *args, **kwargs):
+        """同期関数をワーカースレッドで実行し、結果を待つ"""
+        self._reserve()
+        try:
+            if self._threads is None:
+                return func(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._threads, functools.partial(func, *args, **kwargs))
+        finally:
+            self._release()
+
+    def warm_up(self):
+        """rembg推論プロセスを起動し、モデルを読み込ませる"""
+        if self._processes is None:
+            return False
+        futures = [self._processes.submit(warm_up_worker) for _ in range(self.process_workers)]
+        for future in futures:
+            future.result()
+        return True
+
+    def shutdown(self):
+        set_inference_executor(None)
+        if self._threads is not None:
+            self._threads.shutdown(wait=False)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """プール統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+            stats["thread_workers"] = self.thread_workers
+            stats["queue_depth"] = self.queue_depth
+            stats["process_workers"] = self.process_workers
+            return stats
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """プロセス共通のRenderPoolを取得"""
+    global _render_pool
+    if _render_pool is None:
+        with _render_pool_lock:
+            if _render_pool is None:
+                _render_pool = RenderPool()
+    return _render_pool
@@ -0,0 +1,59 @@
+"""AssetServer の Range リクエストの扱い"""
+
+import os
+import sys
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asset_server import AssetServer
+
+CONTENT = bytes(range(256)) * 4
+
+
+def _client(tmp_path):
+    path = tmp_path / "asset.bin"
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+    server = AssetServer()
+
+    @app.get("/asset")
+    def asset(request: Request):
+        return server.serve(request, str(path), media_type="application/octet-stream")
+
+    return TestClient(app)
+
+
+def test_invalid_range_is_ignored(tmp_path):
+    # 終了が開始より前の不正なRangeは無視して全体を返す（RFC 9110）
+    response = _client(tmp_path).get("/asset", headers={"Range": "bytes=500-100"})
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert "content-range" not in response.headers
+
+
+def test_range_past_end_is_not_satisfiable(tmp_path):
+    response = _client(tmp_path).get("/asset", headers={"Range": f"bytes={len(CONTENT)}-"})
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_satisfiable_range_returns_partial_content(tmp_path):
+    response = _client(tmp_path).get("/asset", headers={"Range": "bytes=100-199"})
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+
+def test_multiple_ranges_are_ignored(tmp_path):
+    # 離れた複数範囲をまとめて間の部分まで送らないよう、全体を返す
+    response = _client(tmp_path).get("/asset", headers={"Range": "bytes=0-9,900-909"})
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert "content-range" not in response.headers
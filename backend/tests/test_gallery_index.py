@@ -0,0 +1,56 @@
+"""ギャラリーインデックスの突き合わせ（走査中に追加された画像の扱い）"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gallery_index
+from gallery_index import GalleryIndex
+
+
+def _write(output_dir, filename):
+    with open(os.path.join(output_dir, filename), 'wb') as f:
+        f.write(b'\xff\xd8\xff\xd9')
+
+
+def test_image_added_during_scan_is_not_removed(tmp_path, monkeypatch):
+    output_dir = str(tmp_path)
+    index = GalleryIndex(output_dir, reconcile_interval=0)
+    _write(output_dir, "image_old.jpg")
+    index.add("image_old.jpg")
+    real_scandir = os.scandir
+
+    def scandir_then_generate(path):
+        # 走査が終わった直後に /generate が画像を書き込み、インデックスに登録する
+        entries = list(real_scandir(path))
+        _write(output_dir, "image_new.jpg")
+        index.add("image_new.jpg")
+        return _Entries(entries)
+
+    monkeypatch.setattr(gallery_index.os, "scandir", scandir_then_generate)
+    added, removed = index.reconcile()
+
+    assert removed == 0
+    assert index.count() == 2
+
+
+def test_deleted_image_is_removed(tmp_path):
+    output_dir = str(tmp_path)
+    index = GalleryIndex(output_dir, reconcile_interval=0)
+    _write(output_dir, "image_gone.jpg")
+    index.add("image_gone.jpg")
+    os.remove(os.path.join(output_dir, "image_gone.jpg"))
+
+    assert index.reconcile() == (0, 1)
+    assert index.count() == 0
+
+
+class _Entries(list):
+    """os.scandir の戻り値と同じくwith文で使えるリスト"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
@@ -0,0 +1,67 @@
+"""サムネイルの作成（透過出力の透明部分の扱い）"""
+
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hirsakam_icon_generator import HirsakamGenerator
+from thumbnails import ThumbnailStore
+
+
+def _transparent_output(source_dir, filename):
+    """四隅が透明で中央だけ不透明な生成画像を作成"""
+    image = Image.new('RGBA', (300, 300), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (100, 100, 200, 200))
+    image.save(os.path.join(source_dir, filename))
+    return image
+
+
+def test_on_request_thumbnail_of_transparent_output_is_white(tmp_path):
+    store = ThumbnailStore(str(tmp_path))
+    _transparent_output(str(tmp_path), "image_transparent.png")
+
+    path = store.ensure(128, "image_transparent.png")
+
+    with Image.open(path) as thumbnail:
+        assert thumbnail.mode == 'RGB'
+        assert min(thumbnail.getpixel((0, 0))) > 245
+        red, green, blue = thumbnail.getpixel((64, 64))
+        assert red > 200 and green < 60 and blue < 60
+
+
+def test_on_request_and_eager_thumbnails_match(tmp_path):
+    store = ThumbnailStore(str(tmp_path))
+    image = _transparent_output(str(tmp_path), "image_transparent.webp")
+
+    eager_path = store.generate_all("image_transparent.webp", image, transparent=True)[0]
+    with Image.open(eager_path) as eager:
+        eager_corner = eager.getpixel((0, 0))
+    os.remove(eager_path)
+    with Image.open(store.ensure(128, "image_transparent.webp")) as on_request:
+        on_request_corner = on_request.getpixel((0, 0))
+
+    assert min(eager_corner) > 245
+    assert min(on_request_corner) > 245
+
+
+def test_thumbnail_of_opaque_render_with_translucent_overlay_matches_output(tmp_path):
+    base_path = os.path.join(str(tmp_path), "base.jpg")
+    Image.new('RGB', (256, 256), (40, 40, 200)).save(base_path, quality=95)
+    generator = HirsakamGenerator(base_path, cache_base_image=False)
+    overlay = Image.new('RGBA', (256, 256), (255, 0, 0, 255))
+    canvas = generator.composite_layers([{
+        "type": "overlay", "image": overlay, "x": 128, "y": 128,
+        "width": 256, "height": 256, "opacity": 0.5
+    }])
+    output_path = generator.save_canvas(canvas, os.path.join(str(tmp_path), "image_opaque.jpg"))
+    store = ThumbnailStore(str(tmp_path), widths=(128,))
+
+    thumbnail_path = store.generate_all("image_opaque.jpg", canvas, transparent=generator.transparent)[0]
+
+    with Image.open(output_path) as output, Image.open(thumbnail_path) as thumbnail:
+        expected = output.getpixel((128, 128))
+        actual = thumbnail.getpixel((64, 64))
+    assert all(abs(a - e) <= 6 for a, e in zip(actual, expected))
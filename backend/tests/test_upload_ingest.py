@@ -0,0 +1,28 @@
+"""base64オーバーレイの取り込み（不正な文字を含むデータは400にする）"""
+
+import base64
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upload_ingest import InvalidUploadError, UploadIngestor
+
+
+def test_data_url_is_decoded(tmp_path):
+    ingestor = UploadIngestor(str(tmp_path))
+    encoded = base64.b64encode(b'\x89PNG\r\n\x1a\n').decode('ascii')
+
+    upload = ingestor.ingest_data_url(f"data:image/png;base64,{encoded}")
+
+    assert upload.data == b'\x89PNG\r\n\x1a\n'
+
+
+def test_data_url_with_non_base64_characters_is_rejected(tmp_path):
+    ingestor = UploadIngestor(str(tmp_path))
+    encoded = base64.b64encode(b'\x89PNG\r\n\x1a\n').decode('ascii')
+
+    with pytest.raises(InvalidUploadError):
+        ingestor.ingest_data_url(f"data:image/png;base64,{encoded[:4]}!*{encoded[4:]}")
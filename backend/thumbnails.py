@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+ギャラリー用サムネイル
+
+生成画像ごとに決まった幅のサムネイル（JPEG）をディスクに保存する。
+/generate の書き出し時に作成し、未作成のもの（既存の画像など）は初回リクエスト時に作成する。
+
+環境変数:
+    THUMBNAIL_DIR       サムネイルの保存先（デフォルト: ../output/thumbs）
+    THUMBNAIL_QUALITY   サムネイルのJPEG品質（デフォルト: 80）
+"""
+
+from PIL import Image
+import os
+import threading
+
+THUMBNAIL_WIDTHS = (128, 256, 512)
+
+
+class ThumbnailStore:
+    DEFAULT_QUALITY = 80
+
+    def __init__(self, source_dir, thumb_dir=None, widths=THUMBNAIL_WIDTHS, quality=None):
+        self.source_dir = source_dir
+        self.thumb_dir = thumb_dir or os.getenv("THUMBNAIL_DIR") or os.path.join(source_dir, "thumbs")
+        self.widths = tuple(widths)
+        self.quality = int(quality or os.getenv("THUMBNAIL_QUALITY", self.DEFAULT_QUALITY))
+        self._lock = threading.Lock()
+        self._stats = {
+            "generated": 0,
+            "generated_on_request": 0
+        }
+
+    def path_for(self, width, filename):
+        """サムネイルの保存パス（JPEG以外の元画像も .jpg で保存する）"""
+        name = os.path.splitext(filename)[0] + ".jpg"
+        return os.path.join(self.thumb_dir, str(width), name)
+
+    def _save(self, image, width, filename, transparent=False):
+        """
+        画像を指定幅に縮小して保存し、縮小後の画像を返す（元画像より大きくはしない）
+        transparent=True の場合のみ透明部分を白にする（通常の出力はアルファを捨てた保存画像と同じ色にする）
+        """
+        path = self.path_for(width, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if image.mode != 'RGB' and not (transparent and image.mode == 'RGBA'):
+            image = image.convert('RGB')
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+        if image.mode == 'RGBA':
+            # 透過出力の画像はJPEGに保存できないため、透明部分を白にする
+            flattened = Image.new('RGB', image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel('A'))
+            image = flattened
+        # 書き込み途中のファイルを配信しないよう一時ファイルから置き換える
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        image.save(temp_path, "JPEG", quality=self.quality, optimize=True)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._stats["generated"] += 1
+        return image
+
+    def _open_source(self, filename, width):
+        """元画像を読み込む（JPEGは指定幅以上を保つ範囲で縮小デコードして軽くする）"""
+        with Image.open(os.path.join(self.source_dir, filename)) as source:
+            source.draft('RGB', (width, max(1, source.height * width // source.width)))
+            # 透過出力（PNG・WebPなど）はアルファを残し、_save で透明部分を白にする
+            if source.mode in ('RGBA', 'LA', 'PA') or 'transparency' in source.info:
+                return source.convert('RGBA')
+            return source.convert('RGB')
+
+    def generate_all(self, filename, image=None, transparent=False):
+        """
+        全ての幅のサムネイルを作成（imageを渡すと元画像のデコードを省略）
+        imageが透過出力のキャンバスの場合は transparent=True を渡す
+        """
+        if image is None:
+            image = self._open_source(filename, max(self.widths))
+            transparent = image.mode == 'RGBA'
+        # 大きい幅から順に縮小し、次の幅の元画像として使い回す
+        for width in sorted(self.widths, reverse=True):
+            image = self._save(image, width, filename, transparent)
+        return [self.path_for(width, filename) for width in self.widths]
+
+    def ensure(self, width, filename):
+        """サムネイルのパスを返す（未作成または元画像より古い場合は作成）"""
+        source_path = os.path.join(self.source_dir, filename)
+        if not os.path.exists(source_path):
+            raise FileNotFoundError(source_path)
+
+        path = self.path_for(width, filename)
+        try:
+            if os.path.getmtime(path) >= os.path.getmtime(source_path):
+                return path
+        except OSError:
+            pass
+
+        # 保存済みの画像にアルファが残っているのは透過出力の場合のみ
+        source = self._open_source(filename, width)
+        self._save(source, width, filename, transparent=source.mode == 'RGBA')
+        with self._lock:
+            self._stats["generated_on_request"] += 1
+        return path
+
+    @staticmethod
+    def etag_for(path):
+        """サムネイルファイルの強いETag（内容を置き換えるたびに更新時刻とサイズが変わる）"""
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def stats(self):
+        """サムネイル統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["widths"] = list(self.widths)
+        stats["thumb_dir"] = self.thumb_dir
+        return stats
+
+
+_thumbnail_store = None
+_thumbnail_store_lock = threading.Lock()
+
+
+def get_thumbnail_store(source_dir=None):
+    """プロセス共通のThumbnailStoreを取得"""
+    global _thumbnail_store
+    if _thumbnail_store is None:
+        with _thumbnail_store_lock:
+            if _thumbnail_store is None:
+                _thumbnail_store = ThumbnailStore(source_dir or os.path.join("..", "output"))
+    return _thumbnail_store
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+アップロード画像の取り込み
+
+アップロードされたファイルやbase64のオーバーレイ画像をメモリ上のバイト列として扱い、
+一時ファイルへの書き出しと再読み込みを省く。上限を超える大きなデータのみ一時ファイルに書き出す。
+
+環境変数:
+    UPLOAD_SPILL_BYTES   これを超えるアップロードは一時ファイルに書き出す（デフォルト: 16MB）
+"""
+
+import base64
+import binascii
+import json
+import os
+import shutil
+import threading
+import uuid
+
+
+class InvalidUploadError(ValueError):
+    """アップロードデータを解釈できない"""
+
+
+def _parse_overlay_json(value, field_name):
+    """オーバーレイ指定のJSON（オブジェクトの配列）を解析する"""
+    try:
+        overlays = json.loads(value)
+    except ValueError as e:
+        raise InvalidUploadError(f"{field_name} を解釈できません: {e}")
+    if not isinstance(overlays, list) or not all(isinstance(overlay, dict) for overlay in overlays):
+        raise InvalidUploadError(f"{field_name} はオブジェクトの配列で指定してください")
+    return overlays
+
+
+def parse_overlay_fields(overlay_images=None, overlay_meta=None, overlay_parts=None):
+    """
+    オーバーレイの指定をスロット番号ごとの辞書にまとめる（リクエストごとに一度だけ解析）
+    Args:
+        overlay_images: base64のデータURLを含むJSON（従来形式）
+        overlay_meta: バイナリで送られたオーバーレイの位置・サイズなどのJSON（画像データは含まない）
+        overlay_parts: スロット番号 -> UploadFile（overlay1〜3のマルチパート）
+    Returns:
+        スロット番号 -> オーバーレイ定義（画像は 'data'（データURL）または 'upload'（UploadFile））
+    Raises:
+        InvalidUploadError: overlay_images または overlay_meta を解釈できない（メッセージにフィールド名を含む）
+    """
+    # 2つのフィールドはそれぞれ検証し、どちらが不正かを区別する
+    legacy_overlays = _parse_overlay_json(overlay_images, "overlay_images") if overlay_images else []
+    binary_meta = _parse_overlay_json(overlay_meta, "overlay_meta") if overlay_meta else []
+
+    overlays_by_slot = {}
+    for overlay in legacy_overlays:
+        overlays_by_slot.setdefault(overlay.get('slotNumber'), overlay)
+
+    if binary_meta:
+        overlay_parts = overlay_parts or {}
+        for meta in binary_meta:
+            slot_number = meta.get('slotNumber')
+            upload = overlay_parts.get(slot_number)
+            if upload is None:
+                print(f"オーバーレイ画像のパートがありません: overlay{slot_number}")
+                continue
+            # 同じスロットが両方の形式で送られた場合はバイナリを優先
+            overlays_by_slot[slot_number] = dict(meta, upload=upload)
+    return overlays_by_slot
+
+
+class IngestedUpload:
+    """取り込んだアップロード（メモリ上のバイト列、または一時ファイルのパス）"""
+
+    def __init__(self, data=None, path=None, size=0):
+        self.data = data
+        self.path = path
+        self.size = size
+
+    @property
+    def source(self):
+        """画像処理に渡す値（バイト列またはファイルパス）"""
+        return self.data if self.data is not None else self.path
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    def read(self):
+        """内容をバイト列で返す"""
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def cleanup(self):
+        """一時ファイルに書き出していた場合は削除"""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadIngestor:
+    DEFAULT_SPILL_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, upload_dir, spill_bytes=None):
+        self.upload_dir = upload_dir
+        self.spill_bytes = int(spill_bytes or os.getenv("UPLOAD_SPILL_BYTES", self.DEFAULT_SPILL_BYTES))
+        self._lock = threading.Lock()
+        self._stats = {
+            "in_memory": 0,
+            "spilled": 0,
+            "bytes_avoided": 0,
+            "bytes_spilled": 0
+        }
+
+    def _record(self, size, spilled):
+        with self._lock:
+            if spilled:
+                self._stats["spilled"] += 1
+                self._stats["bytes_spilled"] += size
+            else:
+                self._stats["in_memory"] += 1
+                self._stats["bytes_avoided"] += size
+
+    def _spill_path(self, prefix, extension):
+        return os.path.join(self.upload_dir, f"{prefix}_{uuid.uuid4()}{extension}")
+
+    def ingest_file(self, upload, prefix="upload"):
+        """UploadFileを取り込む（上限以下ならメモリ上、超える場合のみ一時ファイルへ書き出す）"""
+        file = upload.file
+        size = getattr(upload, "size", None)
+        if size is None:
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+        file.seek(0)
+
+        if size > self.spill_bytes:
+            extension = os.path.splitext(upload.filename or "")[1]
+            path = self._spill_path(prefix, extension)
+            with open(path, "wb") as buffer:
+                shutil.copyfileobj(file, buffer)
+            self._record(size, True)
+            return IngestedUpload(path=path, size=size)
+
+        data = file.read()
+        self._record(len(data), False)
+        return IngestedUpload(data=data, size=len(data))
+
+    def ingest_data_url(self, data_url, prefix="overlay"):
+        """base64のデータURL（data:image/png;base64,...）をデコードして取り込む"""
+        encoded = data_url.split(',', 1)[1] if ',' in data_url else data_url
+        try:
+            data = base64.b64decode(encoded, validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise InvalidUploadError(f"base64データをデコードできません: {e}")
+
+        if len(data) > self.spill_bytes:
+            path = self._spill_path(prefix, ".png")
+            with open(path, "wb") as f:
+                f.write(data)
+            self._record(len(data), True)
+            return IngestedUpload(path=path, size=len(data))
+
+        self._record(len(data), False)
+        return IngestedUpload(data=data, size=len(data))
+
+    def ingest_overlay(self, overlay):
+        """parse_overlay_fieldsで得たオーバーレイ定義の画像を取り込む"""
+        if overlay.get('upload') is not None:
+            return self.ingest_file(overlay['upload'], "overlay")
+        return self.ingest_data_url(overlay['data'], "overlay")
+
+    def stats(self):
+        """取り込み統計を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["spill_bytes"] = self.spill_bytes
+        return stats
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_upload_ingestor(upload_dir=None):
+    """プロセス共通のUploadIngestorを取得"""
+    global _ingestor
+    if _ingestor is None:
+        with _ingestor_lock:
+            if _ingestor is None:
+                _ingestor = UploadIngestor(upload_dir or os.path.join("..", "temp_uploads"))
+    return _ingestor
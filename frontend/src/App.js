@@ -1573,38 +1573,32 @@ N: ${nCount}枚`);
         data.append('drawing_data', blob, 'drawing.png');
       }
 
-      // オーバーレイ画像データがある場合は送信
+      // オーバーレイ画像データがある場合は送信（画像はバイナリのまま overlay1〜3 として、位置などは overlay_meta で送る）
       const allOverlaySlots = getAllOverlaySlots();
       if (allOverlaySlots.length > 0) {
-        const overlayData = await Promise.all(allOverlaySlots.map(async (overlay) => {
+        const overlayMeta = await Promise.all(allOverlaySlots.map(async (overlay) => {
           // スロット番号を特定
           const slotNumber = overlaySlot1 === overlay ? 1 : overlaySlot2 === overlay ? 2 : 3;
           
-          // 画像をbase64に変換
+          // 画像をBlobとして取得
           const response = await fetch(overlay.url);
           const blob = await response.blob();
-          const reader = new FileReader();
+          data.append(`overlay${slotNumber}`, blob, `overlay${slotNumber}.png`);
           
-          return new Promise((resolve) => {
-            reader.onload = () => {
-              resolve({
-                slotNumber: slotNumber, // スロット番号を追加
-                data: reader.result, // base64 data URL
-                x: Math.round(overlay.x * imageScale),
-                y: Math.round(overlay.y * imageScale),
-                width: Math.round(overlay.width * imageScale),
-                height: Math.round(overlay.height * imageScale),
-                opacity: overlay.opacity,
-                rotation: overlay.rotation || 0,
-                removeBackground: overlay.removeBackground || false,
-                flipHorizontal: overlay.flipHorizontal || false
-              });
-            };
-            reader.readAsDataURL(blob);
-          });
+          return {
+            slotNumber: slotNumber, // スロット番号を追加
+            x: Math.round(overlay.x * imageScale),
+            y: Math.round(overlay.y * imageScale),
+            width: Math.round(overlay.width * imageScale),
+            height: Math.round(overlay.height * imageScale),
+            opacity: overlay.opacity,
+            rotation: overlay.rotation || 0,
+            removeBackground: overlay.removeBackground || false,
+            flipHorizontal: overlay.flipHorizontal || false
+          };
         }));
         
-        data.append('overlay_images', JSON.stringify(overlayData));
+        data.append('overlay_meta', JSON.stringify(overlayMeta));
       }
 
       // レイヤー順序を送信
@@ -1623,6 +1617,9 @@ N: ${nCount}枚`);
       const result = await response.json();
       setGeneratedImage(result.download_url);
       setPreviewMode(false);
+      if (result.errors && result.errors.length > 0) {
+        alert('一部のレイヤーを描画できませんでした:\n' + result.errors.join('\n'));
+      }
       // プレビューモード終了時にtextBoundsをリセット
       const bounds = calculateTextBounds();
       setTextBounds(bounds);
@@ -2946,9 +2943,10 @@ N: ${nCount}枚`);
             {gallery.map((image, index) => (
               <div key={index} className="gallery-item">
                 <img 
-                  src={`${getApiBaseUrl()}${image.url}`} 
+                  src={`${getApiBaseUrl()}${image.thumb_url || image.url}`} 
                   alt={`Gallery item ${index + 1}`}
                   className="gallery-image"
+                  loading="lazy"
                 />
                 <button 
                   onClick={() => downloadImage(image.url, image.filename)}
@@ -210,6 +210,15 @@ def run_both():
 
 def main():
     """メイン関数"""
+    # --workers N でバックエンドのワーカープロセス数を指定（BACKEND_WORKERS環境変数と同じ）
+    if "--workers" in sys.argv:
+        index = sys.argv.index("--workers")
+        if index + 1 >= len(sys.argv) or not sys.argv[index + 1].isdigit():
+            print("❌ --workers には数値を指定してください")
+            sys.exit(1)
+        os.environ["BACKEND_WORKERS"] = sys.argv[index + 1]
+        del sys.argv[index:index + 2]
+    
     if len(sys.argv) < 2:
         # デフォルトで両方起動
         run_both()
@@ -232,8 +241,11 @@ def main():
         print("  python3 run.py frontend  # フロントエンドサーバーのみ起動")
         print("  python3 run.py both      # 両方同時に起動")
         print("  python3 run.py help      # このヘルプを表示")
+        print("  python3 run.py backend --workers 4  # バックエンドを4ワーカープロセスで起動")
         print("\n環境変数:")
         print("  SERVER_URL               # サーバーURL（例: http://your-server.com）")
+        print("  BACKEND_WORKERS          # バックエンドのワーカープロセス数（デフォルト: 1、推奨: CPUコア数）")
+        print("                           # 背景透過モデルはワーカーごとに読み込まれる（メモリはワーカー数に比例）")
         print("\nサーバー環境での起動例:")
         print("  SERVER_URL=\"http://your-server\" python3 run.py")
         print("\n推奨（別々のターミナルで起動する場合）:")